@@ -0,0 +1,109 @@
+"""
+Benchmark of services.chunks.get_text_chunks on a large synthetic text.
+
+Compares the chunker against the previous implementation, which sliced the remaining token list
+on every chunk, checks that both produce the same chunks and prints their timings.
+
+Usage, from the repository root:
+
+    python -m benchmarks.chunking --size_mb 10
+"""
+
+import argparse
+import random
+import time
+from typing import List, Tuple
+
+from services.chunks import (
+    CHUNK_SIZE,
+    MIN_CHUNK_LENGTH_TO_EMBED,
+    MIN_CHUNK_SIZE_CHARS,
+    get_text_chunks_with_token_counts,
+    tokenizer,
+)
+
+WORDS = (
+    "the quick brown fox jumps over lazy dog revenue quarter growth retrieval plugin "
+    "document chunk embedding vector index query café naïve résumé 東京 数据 données"
+).split()
+
+
+def make_text(size_bytes: int, seed: int = 0) -> str:
+    """
+    Generate a deterministic text of about size_bytes bytes, made of sentences and paragraphs.
+    """
+    rng = random.Random(seed)
+    parts: List[str] = []
+    size = 0
+    while size < size_bytes:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 30)))
+        sentence = sentence.capitalize() + rng.choice([".", ".", ".", "?", "!"])
+        sentence += "\n\n" if rng.random() < 0.1 else " "
+        parts.append(sentence)
+        size += len(sentence.encode("utf-8"))
+    return "".join(parts)
+
+
+def slicing_text_chunks(text: str, chunk_token_size: int) -> List[Tuple[str, int]]:
+    """
+    The previous chunker, which re-slices the remaining tokens after every chunk.
+
+    It stopped after 10000 chunks, the cap is left out here so that both chunkers cover the whole text.
+    """
+    if not text or text.isspace():
+        return []
+    tokens = tokenizer.encode(text, disallowed_special=())
+    chunks = []
+    chunk_size = chunk_token_size or CHUNK_SIZE
+    while tokens:
+        chunk = tokens[:chunk_size]
+        chunk_text = tokenizer.decode(chunk)
+        if not chunk_text or chunk_text.isspace():
+            tokens = tokens[len(chunk) :]
+            continue
+        last_punctuation = max(
+            chunk_text.rfind("."),
+            chunk_text.rfind("?"),
+            chunk_text.rfind("!"),
+            chunk_text.rfind("\n"),
+        )
+        if last_punctuation != -1 and last_punctuation > MIN_CHUNK_SIZE_CHARS:
+            chunk_text = chunk_text[: last_punctuation + 1]
+        chunk_text_to_append = chunk_text.replace("\n", " ").strip()
+        num_chunk_tokens = len(tokenizer.encode(chunk_text, disallowed_special=()))
+        if len(chunk_text_to_append) > MIN_CHUNK_LENGTH_TO_EMBED:
+            chunks.append((chunk_text_to_append, num_chunk_tokens))
+        tokens = tokens[num_chunk_tokens:]
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size_mb", type=float, default=10, help="The size of the text in megabytes")
+    parser.add_argument("--chunk_token_size", type=int, default=CHUNK_SIZE)
+    parser.add_argument(
+        "--skip_baseline",
+        action="store_true",
+        help="Only time the current chunker, the previous one takes minutes on large texts",
+    )
+    args = parser.parse_args()
+
+    text = make_text(int(args.size_mb * 1024 * 1024))
+    print(f"text: {len(text.encode('utf-8')) / 1024 / 1024:.1f} MB")
+
+    start = time.perf_counter()
+    chunks = get_text_chunks_with_token_counts(text, args.chunk_token_size)
+    elapsed = time.perf_counter() - start
+    print(f"get_text_chunks: {len(chunks)} chunks in {elapsed:.2f}s")
+
+    if not args.skip_baseline:
+        start = time.perf_counter()
+        baseline_chunks = slicing_text_chunks(text, args.chunk_token_size)
+        baseline_elapsed = time.perf_counter() - start
+        print(f"slicing baseline: {len(baseline_chunks)} chunks in {baseline_elapsed:.2f}s")
+        assert chunks == baseline_chunks, "chunkers disagree"
+        print(f"identical output, {baseline_elapsed / elapsed:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
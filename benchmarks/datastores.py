@@ -0,0 +1,231 @@
+"""
+Macro benchmark of DataStore.upsert, query and delete on a synthetic corpus, for any datastore.
+
+Documents are embedded with the deterministic hashing embedder (EMBEDDING_PROVIDER=hash) so that no
+network or model is needed, and the datastore is created with get_datastore exactly as the server does,
+from the DATASTORE environment variable or --datastore. Chroma runs in memory by default. Prints the
+throughput, latency percentiles and peak memory of each phase as JSON.
+
+Usage, from the repository root:
+
+    python -m benchmarks.datastores --datastore chroma --documents 2000 --queries 500
+
+Other datastores are configured with their usual environment variables, or with --env, e.g.
+
+    python -m benchmarks.datastores --datastore redis --env REDIS_HOST=localhost
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+import numpy as np
+
+from benchmarks.chunking import make_text
+
+AUTHORS = ["alice", "bob", "carol", "dave"]
+SOURCES = ["email", "file", "chat"]
+
+
+def make_corpus(num_documents: int, document_kb: float, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Generate num_documents deterministic documents of about document_kb kilobytes each, with metadata.
+    Document sizes vary between half and one and a half times the mean.
+    """
+    rng = random.Random(seed)
+    documents = []
+    for i in range(num_documents):
+        size = int(document_kb * 1024 * rng.uniform(0.5, 1.5))
+        documents.append(
+            {
+                "id": f"bench-{i}",
+                "text": make_text(size, seed=seed * 1_000_003 + i),
+                "metadata": {
+                    "source": rng.choice(SOURCES),
+                    "author": rng.choice(AUTHORS),
+                    "created_at": f"2023-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                },
+            }
+        )
+    return documents
+
+
+def make_queries(corpus: List[Dict[str, Any]], num_queries: int, seed: int = 0) -> List[str]:
+    """
+    Sample num_queries short queries from the sentences of the corpus.
+    """
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(num_queries):
+        sentences = rng.choice(corpus)["text"].split(". ")
+        words = rng.choice(sentences).split()
+        queries.append(" ".join(words[: rng.randint(3, 10)]))
+    return queries
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    """
+    Return the number of calls, calls per second and latency percentiles in milliseconds.
+    """
+    ms = np.asarray(latencies) * 1000
+    return {
+        "calls": len(latencies),
+        "calls_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "seconds": elapsed,
+        "p50_ms": float(np.percentile(ms, 50)) if len(ms) else 0.0,
+        "p95_ms": float(np.percentile(ms, 95)) if len(ms) else 0.0,
+        "p99_ms": float(np.percentile(ms, 99)) if len(ms) else 0.0,
+    }
+
+
+async def run_concurrently(
+    calls: List[Callable[[], Awaitable[Any]]], concurrency: int
+) -> Dict[str, float]:
+    """
+    Run calls with at most concurrency in flight, and summarize their latencies.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def timed(call: Callable[[], Awaitable[Any]]) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[timed(call) for call in calls])
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def peak_rss_mb() -> float:
+    """
+    Return the peak resident set size of the process in megabytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    # Imported here, after the environment is set up, since some modules read it on import
+    from datastore.factory import get_datastore
+    from models.models import Document, DocumentMetadataFilter, Query
+    from services.metrics import CHUNKS, EMBEDDED_TOKENS
+
+    corpus = make_corpus(args.documents, args.document_kb, seed=args.seed)
+    query_texts = make_queries(corpus, args.queries * args.queries_per_request, seed=args.seed)
+    documents = [Document(**document) for document in corpus]
+    datastore = await get_datastore(args.datastore)
+    results: Dict[str, Any] = {
+        "datastore": args.datastore or os.environ.get("DATASTORE"),
+        "documents": args.documents,
+        "document_kb": args.document_kb,
+        "concurrency": args.concurrency,
+    }
+
+    # Upsert the corpus in batches
+    chunks_before, tokens_before = CHUNKS.get(), EMBEDDED_TOKENS.get()
+    batches = [
+        documents[i : i + args.batch_size] for i in range(0, len(documents), args.batch_size)
+    ]
+    upsert = await run_concurrently(
+        [lambda batch=batch: datastore.upsert(batch) for batch in batches], args.concurrency
+    )
+    chunks = CHUNKS.get() - chunks_before
+    upsert.update(
+        {
+            "chunks": chunks,
+            "tokens": EMBEDDED_TOKENS.get() - tokens_before,
+            "docs_per_second": len(documents) / upsert["seconds"],
+            "chunks_per_second": chunks / upsert["seconds"],
+        }
+    )
+    results["upsert"] = upsert
+    results["peak_rss_mb_after_upsert"] = peak_rss_mb()
+
+    # Query, a fraction of the queries filtered by author
+    rng = random.Random(args.seed)
+    requests = []
+    for i in range(args.queries):
+        texts = query_texts[i * args.queries_per_request : (i + 1) * args.queries_per_request]
+        requests.append(
+            [
+                Query(
+                    query=text,
+                    top_k=args.top_k,
+                    filter=DocumentMetadataFilter(author=rng.choice(AUTHORS))
+                    if rng.random() < args.filtered_fraction
+                    else None,
+                )
+                for text in texts
+            ]
+        )
+    query = await run_concurrently(
+        [lambda queries=queries: datastore.query(queries) for queries in requests],
+        args.concurrency,
+    )
+    query["queries_per_second"] = query["calls_per_second"] * args.queries_per_request
+    results["query"] = query
+
+    # Delete the corpus in batches of ids
+    if not args.keep:
+        ids = [document["id"] for document in corpus]
+        id_batches = [ids[i : i + args.batch_size] for i in range(0, len(ids), args.batch_size)]
+        delete = await run_concurrently(
+            [lambda batch=batch: datastore.delete(ids=batch) for batch in id_batches],
+            args.concurrency,
+        )
+        delete["docs_per_second"] = len(ids) / delete["seconds"]
+        results["delete"] = delete
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--datastore", default=None, help="The datastore to benchmark, DATASTORE if not set")
+    parser.add_argument("--documents", type=int, default=1000, help="The number of documents in the corpus")
+    parser.add_argument("--document_kb", type=float, default=4, help="The mean size of a document in kilobytes")
+    parser.add_argument("--batch_size", type=int, default=50, help="The number of documents per upsert and delete call")
+    parser.add_argument("--queries", type=int, default=500, help="The number of query calls")
+    parser.add_argument("--queries_per_request", type=int, default=1, help="The number of queries in each query call")
+    parser.add_argument("--filtered_fraction", type=float, default=0.25, help="The fraction of queries filtered by author")
+    parser.add_argument("--top_k", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=4, help="The number of calls in flight at a time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="Keep the corpus in the datastore instead of deleting it")
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="An environment variable to set before the datastore is created, can be repeated",
+    )
+    parser.add_argument("--output", default=None, help="The file to write the JSON results to, stdout if not set")
+    args = parser.parse_args()
+
+    os.environ.setdefault("EMBEDDING_PROVIDER", "hash")
+    os.environ.setdefault("CHROMA_IN_MEMORY", "True")
+    for variable in args.env:
+        key, _, value = variable.partition("=")
+        os.environ[key] = value
+
+    results = asyncio.run(run(args))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 from abc import ABC, abstractmethod
-from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, TypeVar
 import asyncio
+import functools
+import os
 
 from models.models import (
     Document,
@@ -10,36 +13,257 @@ from models.models import (
     QueryResult,
     QueryWithEmbedding,
 )
-from services.chunks import get_document_chunks
-from services.openai import get_embeddings
+from services.chunks import get_document_hash, iter_document_chunk_batches
+from services.embedding_batcher import query_embedding_batcher
+from services.embedding_cache import get_embeddings_with_cache
+from services.embedding_profile import embedding_profile
+from services.metrics import DATASTORE_BATCH_SIZE, DATASTORE_ERRORS, DATASTORE_SECONDS
+from services.query_cache import (
+    get_query_cache,
+    get_semantic_cache,
+    invalidate_query_cache,
+)
+
+# The maximum number of document ids removed by a single bulk delete
+DELETE_BATCH_SIZE = int(os.environ.get("DELETE_BATCH_SIZE", 500))
+# The default number of threads each datastore runs the blocking calls of its client library in, see DataStore._run_blocking
+DATASTORE_THREAD_POOL_SIZE = int(os.environ.get("DATASTORE_THREAD_POOL_SIZE", 8))
+
+T = TypeVar("T")
+
+# The thread pools of all the datastores, shut down with the server
+_thread_pools: List[ThreadPoolExecutor] = []
+
+
+def get_id_batches(ids: List[str]) -> Iterator[List[str]]:
+    """
+    Split a list of ids into batches of at most DELETE_BATCH_SIZE ids.
+    """
+    for start in range(0, len(ids), DELETE_BATCH_SIZE):
+        yield ids[start : start + DELETE_BATCH_SIZE]
+
+
+def _instrumented(method):
+    """
+    Wrap a datastore's _upsert, _query or delete to record its latency, errors and batch size.
+    """
+    operation = method.__name__
+
+    @functools.wraps(method)
+    async def instrumented(self, *args, **kwargs):
+        labels = {"datastore": type(self).__name__, "operation": operation}
+        batch = args[0] if args else kwargs.get("chunks", kwargs.get("queries"))
+        if operation == "_upsert" and batch is not None:
+            DATASTORE_BATCH_SIZE.observe(
+                sum(len(chunks) for chunks in batch.values()), **labels
+            )
+        elif operation == "_query" and batch is not None:
+            DATASTORE_BATCH_SIZE.observe(len(batch), **labels)
+        with DATASTORE_SECONDS.time(DATASTORE_ERRORS, **labels):
+            return await method(self, *args, **kwargs)
+
+    return instrumented
+
+
+def shutdown_datastore_thread_pools() -> None:
+    """
+    Shut down the thread pools of all the datastores, waiting for the calls running in them.
+    """
+    while _thread_pools:
+        _thread_pools.pop().shutdown(wait=True)
 
 
 class DataStore(ABC):
+    # Whether lower scores are better matches, for datastores that score results by distance rather than similarity
+    score_is_distance = False
+    # The number of threads running the blocking calls of the datastore's client library, datastores set it from
+    # their own <NAME>_THREAD_POOL_SIZE environment variable
+    thread_pool_size = DATASTORE_THREAD_POOL_SIZE
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Every datastore's _upsert, _query and delete are timed, and the sizes of their batches recorded
+        for name in ("_upsert", "_query", "delete"):
+            method = cls.__dict__.get(name)
+            if method is not None and not getattr(method, "__isabstractmethod__", False):
+                setattr(cls, name, _instrumented(method))
+
+        # Cached query results are invalidated by every delete, whichever datastore implements it
+        delete = cls.__dict__.get("delete")
+        if delete is not None and not getattr(delete, "__isabstractmethod__", False):
+
+            @functools.wraps(delete)
+            async def delete_and_invalidate(self, *args, **kwargs):
+                try:
+                    return await delete(self, *args, **kwargs)
+                finally:
+                    await invalidate_query_cache()
+
+            cls.delete = delete_and_invalidate  # type: ignore
+
+    async def _run_blocking(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Run a blocking call, such as a request made with a synchronous client library, in the datastore's
+        thread pool, so that it does not stall the event loop and concurrent calls run in parallel.
+        The pool is created on first use, with thread_pool_size threads.
+        """
+        thread_pool = self.__dict__.get("_thread_pool")
+        if thread_pool is None:
+            thread_pool = ThreadPoolExecutor(
+                max_workers=self.thread_pool_size,
+                thread_name_prefix=type(self).__name__,
+            )
+            self._thread_pool = thread_pool
+            _thread_pools.append(thread_pool)
+        return await asyncio.get_running_loop().run_in_executor(
+            thread_pool, functools.partial(func, *args, **kwargs)
+        )
+
     async def upsert(
         self, documents: List[Document], chunk_token_size: Optional[int] = None
     ) -> List[str]:
         """
         Takes in a list of documents and inserts them into the database.
-        First deletes all the existing vectors with the document id (if necessary, depends on the vector db), then inserts the new ones.
+        If the datastore stores chunk hashes, only the chunks that changed are embedded and written, and documents
+        identical to the stored ones are skipped. Otherwise first deletes all the existing vectors with the document id
+        (if necessary, depends on the vector db), then inserts the new ones.
         Return a list of document ids.
         """
+        try:
+            with DATASTORE_SECONDS.time(
+                DATASTORE_ERRORS, datastore=type(self).__name__, operation="upsert"
+            ):
+                return await self._upsert_documents(documents, chunk_token_size)
+        finally:
+            await invalidate_query_cache()
+
+    async def _upsert_documents(
+        self, documents: List[Document], chunk_token_size: Optional[int] = None
+    ) -> List[str]:
+        """
+        Upserts documents, see upsert. Return a list of document ids.
+        """
+        document_ids = [document.id for document in documents if document.id]
+        stored_hashes = (
+            await self._get_chunk_hashes(document_ids) if document_ids else None
+        )
+        if stored_hashes is not None:
+            return await self._upsert_incrementally(
+                documents, chunk_token_size, stored_hashes
+            )
+
         # Delete any existing vectors for documents with the input document ids
-        await asyncio.gather(
-            *[
-                self.delete(
-                    filter=DocumentMetadataFilter(
-                        document_id=document.id,
-                    ),
-                    delete_all=False,
+        if document_ids:
+            await self._delete_documents(list(dict.fromkeys(document_ids)))
+
+        return await self._upsert_in_batches(documents, chunk_token_size)
+
+    async def _upsert_in_batches(
+        self, documents: List[Document], chunk_token_size: Optional[int] = None
+    ) -> List[str]:
+        """
+        Chunks, embeds and inserts documents one batch of chunks at a time, so that memory stays bounded however large the documents are.
+        Return a list of document ids.
+        """
+        ids: Dict[str, None] = {}
+        async for chunks in iter_document_chunk_batches(documents, chunk_token_size):
+            if any(chunks.values()):
+                ids.update(dict.fromkeys(await self._upsert(chunks)))
+        return list(ids)
+
+    async def _upsert_incrementally(
+        self,
+        documents: List[Document],
+        chunk_token_size: Optional[int],
+        stored_hashes: Dict[str, Dict[str, Tuple[Optional[str], Optional[str]]]],
+    ) -> List[str]:
+        """
+        Upserts documents by writing only their new and changed chunks, then deleting their stale chunks.
+        Return a list of document ids.
+        """
+        ids: Dict[str, None] = {}
+        changed_documents: List[Document] = []
+        document_hashes: Dict[str, str] = {}
+        for document in documents:
+            if document.id:
+                document_hash = get_document_hash(document, chunk_token_size)
+                # The first chunk of a document carries the hash of the whole document
+                _, stored_document_hash = stored_hashes.get(document.id, {}).get(
+                    f"{document.id}_0", (None, None)
                 )
-                for document in documents
-                if document.id
-            ]
-        )
+                if stored_document_hash == document_hash:
+                    ids[document.id] = None
+                    continue
+                document_hashes[document.id] = document_hash
+            changed_documents.append(document)
+
+        new_chunk_ids: Dict[str, Set[str]] = {}
+
+        def skip_chunk(chunk: DocumentChunk) -> bool:
+            document_id = chunk.metadata.document_id
+            new_chunk_ids.setdefault(document_id, set()).add(chunk.id)  # type: ignore
+            stored_chunk_hash, _ = stored_hashes.get(document_id, {}).get(  # type: ignore
+                chunk.id, (None, None)
+            )
+            # The first chunk is always rewritten, to update the document hash it carries
+            return chunk.id != f"{document_id}_0" and stored_chunk_hash == chunk.chunk_hash
+
+        # The first chunks are written last, so that a document only matches its hash once all its chunks are written
+        first_chunks: Dict[str, List[DocumentChunk]] = {}
+        async for chunks in iter_document_chunk_batches(
+            changed_documents, chunk_token_size, skip_chunk=skip_chunk
+        ):
+            batch: Dict[str, List[DocumentChunk]] = {}
+            for document_id, doc_chunks in chunks.items():
+                ids[document_id] = None
+                for chunk in doc_chunks:
+                    if chunk.id == f"{document_id}_0":
+                        chunk.document_hash = document_hashes.get(document_id)
+                        first_chunks[document_id] = [chunk]
+                    else:
+                        batch.setdefault(document_id, []).append(chunk)
+            if batch:
+                await self._upsert(batch)
+        if first_chunks:
+            await self._upsert(first_chunks)
 
-        chunks = get_document_chunks(documents, chunk_token_size)
+        # Delete the chunks that are no longer part of the changed documents
+        stale_chunk_ids = [
+            chunk_id
+            for document_id in document_hashes
+            for chunk_id in stored_hashes.get(document_id, {})
+            if chunk_id not in new_chunk_ids.get(document_id, set())
+        ]
+        if stale_chunk_ids:
+            await self._delete_chunks(stale_chunk_ids)
+
+        return list(ids)
+
+    async def _delete_documents(self, document_ids: List[str]) -> None:
+        """
+        Removes all the chunks of the given documents, before new versions of them are inserted.
+        By default the ids are deleted in batches from get_id_batches, with one call to delete per batch.
+        Datastores that can delete all the documents at once more cheaply override this.
+        """
+        for batch in get_id_batches(document_ids):
+            await self.delete(ids=batch)
 
-        return await self._upsert(chunks)
+    async def _get_chunk_hashes(
+        self, document_ids: List[str]
+    ) -> Optional[Dict[str, Dict[str, Tuple[Optional[str], Optional[str]]]]]:
+        """
+        Returns the hashes stored with the chunks of the given documents, as a dictionary from document id
+        to a dictionary from chunk id to (chunk_hash, document_hash), or None if the datastore does not store hashes.
+        Datastores that return hashes must also implement _delete_chunks and store the chunk_hash and
+        document_hash of the chunks they insert.
+        """
+        return None
+
+    async def _delete_chunks(self, chunk_ids: List[str]) -> None:
+        """
+        Removes chunks by their chunk ids. Only needed by datastores that implement _get_chunk_hashes.
+        """
+        raise NotImplementedError
 
     @abstractmethod
     async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
@@ -53,16 +277,38 @@ class DataStore(ABC):
     async def query(self, queries: List[Query]) -> List[QueryResult]:
         """
         Takes in a list of queries and filters and returns a list of query results with matching document chunks and scores.
+        If the query cache is enabled, queries answered since the last write are served from it.
+        """
+        with DATASTORE_SECONDS.time(
+            DATASTORE_ERRORS, datastore=type(self).__name__, operation="query"
+        ):
+            cache = get_query_cache()
+            if cache is None:
+                return await self._embed_and_query(queries)
+            return await cache.get_or_query(queries, self._embed_and_query)
+
+    async def _embed_and_query(self, queries: List[Query]) -> List[QueryResult]:
+        """
+        Embeds queries and returns a list of query results with matching document chunks and scores.
         """
         # get a list of of just the queries from the Query list
         query_texts = [query.query for query in queries]
-        query_embeddings = get_embeddings(query_texts)
+        # embed the queries together with those of concurrent requests
+        query_embeddings = embedding_profile.apply(
+            await get_embeddings_with_cache(
+                query_texts, embed=query_embedding_batcher.embed
+            )
+        )
         # hydrate the queries with embeddings
         queries_with_embeddings = [
             QueryWithEmbedding(**query.dict(), embedding=embedding)
             for query, embedding in zip(queries, query_embeddings)
         ]
-        return await self._query(queries_with_embeddings)
+        # answer paraphrases of recent queries without searching the datastore
+        semantic_cache = get_semantic_cache(embedding_profile.dimension)
+        if semantic_cache is None:
+            return await self._query(queries_with_embeddings)
+        return await semantic_cache.get_or_query(queries_with_embeddings, self._query)
 
     @abstractmethod
     async def _query(self, queries: List[QueryWithEmbedding]) -> List[QueryResult]:
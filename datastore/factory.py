@@ -1,9 +1,13 @@
-from datastore.datastore import DataStore
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Union
 import os
+import sys
+
+from datastore.datastore import DataStore
 
 
-async def get_datastore() -> DataStore:
-    datastore = os.environ.get("DATASTORE")
+async def get_datastore(datastore: Optional[str] = None) -> DataStore:
+    datastore = datastore or os.environ.get("DATASTORE")
     assert datastore is not None
 
     match datastore:
@@ -56,8 +60,91 @@ async def get_datastore() -> DataStore:
             from datastore.providers.analyticdb_datastore import AnalyticDBDataStore
 
             return AnalyticDBDataStore()
+        case "numpy":
+            from datastore.providers.numpy_datastore import NumpyDataStore
+
+            return NumpyDataStore()
+        case "faiss":
+            from datastore.providers.faiss_datastore import FaissDataStore
+
+            return FaissDataStore()
+        case "duckdb":
+            from datastore.providers.duckdb_datastore import DuckDBDataStore
+
+            return DuckDBDataStore()
+        case "sharded":
+            from datastore.providers.sharded_datastore import ShardedDataStore
+
+            return await ShardedDataStore.init()
+        case "replicated":
+            from datastore.providers.replicated_datastore import ReplicatedDataStore
+
+            return await ReplicatedDataStore.init()
         case _:
             raise ValueError(
                 f"Unsupported vector database: {datastore}. "
-                f"Try one of the following: llama, pinecone, weaviate, milvus, zilliz, redis, or qdrant"
-            )
\ No newline at end of file
+                f"Try one of the following: llama, pinecone, weaviate, milvus, zilliz, redis, qdrant, numpy, faiss, duckdb, sharded, or replicated"
+            )
+
+@contextmanager
+def _provider_environment(env: Dict[str, str]) -> Iterator[None]:
+    """
+    Apply environment variable overrides while a datastore is created.
+
+    Providers read their settings when their module is imported, so the provider modules are
+    imported again under the overrides. Afterwards the previously imported modules are restored and
+    those first imported under the overrides are dropped, so that they keep none of their settings.
+    """
+    if not env:
+        yield
+        return
+
+    saved_env = {key: os.environ.get(key) for key in env}
+    saved_modules = {
+        name: module
+        for name, module in sys.modules.items()
+        if name.startswith("datastore.providers.")
+    }
+    os.environ.update(env)
+    for name in saved_modules:
+        del sys.modules[name]
+    try:
+        yield
+    finally:
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        imported = [name for name in sys.modules if name.startswith("datastore.providers.")]
+        for name in imported:
+            if name not in saved_modules:
+                module = sys.modules.pop(name)
+                # Imported submodules are also attributes of their package, which `import a.b as c` reads
+                package, _, attribute = name.rpartition(".")
+                if getattr(sys.modules.get(package), attribute, None) is module:
+                    delattr(sys.modules[package], attribute)
+        sys.modules.update(saved_modules)
+        for name, module in saved_modules.items():
+            package, _, attribute = name.rpartition(".")
+            if package in sys.modules:
+                setattr(sys.modules[package], attribute, module)
+
+
+async def get_datastore_from_spec(spec: Union[str, Dict]) -> DataStore:
+    """
+    Create one of the datastores of a composite datastore, such as a shard or a replica.
+
+    Args:
+        spec: A datastore name, or an object such as {"datastore": "redis", "env": {"REDIS_HOST": "redis-0"}}
+            whose env variables override the environment while the datastore is created.
+
+    Returns:
+        The datastore.
+    """
+    if isinstance(spec, str):
+        spec = {"datastore": spec}
+    if spec["datastore"] in ("sharded", "replicated"):
+        raise ValueError(f"A {spec['datastore']} datastore cannot be part of another one")
+    with _provider_environment(spec.get("env", {})):
+        return await get_datastore(spec["datastore"])
@@ -9,9 +9,10 @@ from psycopg2cffi import compat
 compat.register()
 import psycopg2
 from psycopg2.extras import DictCursor
-from psycopg2.pool import SimpleConnectionPool
+from psycopg2.pool import ThreadedConnectionPool
 
 from services.date import to_unix_timestamp
+from services.embedding_profile import embedding_profile
 from datastore.datastore import DataStore
 from models.models import (
     DocumentChunk,
@@ -30,7 +31,8 @@ PG_CONFIG = {
     "host": os.environ.get("PG_HOST", "localhost"),
     "port": int(os.environ.get("PG_PORT", "5432")),
 }
-OUTPUT_DIM = 1536
+# The index always uses L2 distance, which ranks unit length embeddings like cosine similarity
+OUTPUT_DIM = embedding_profile.dimension
 
 
 class AnalyticDBDataStore(DataStore):
@@ -42,7 +44,8 @@ class AnalyticDBDataStore(DataStore):
         self.host = config["host"]
         self.port = config["port"]
 
-        self.connection_pool = SimpleConnectionPool(
+        # Connections are used by the datastore's threads, see DataStore._run_blocking
+        self.connection_pool = ThreadedConnectionPool(
             minconn=1,
             maxconn=100,
             dbname=self.database,
@@ -99,7 +102,7 @@ class AnalyticDBDataStore(DataStore):
                 USING ann(embedding)
                 WITH (
                     distancemeasure=L2,
-                    dim=OUTPUT_DIM,
+                    dim={OUTPUT_DIM},
                     pq_segments=64,
                     hnsw_m=100,
                     pq_centers=2048
@@ -112,9 +115,8 @@ class AnalyticDBDataStore(DataStore):
         Takes in a dict of document_ids to list of document chunks and inserts them into the database.
         Return a list of document ids.
         """
-        loop = asyncio.get_event_loop()
         tasks = [
-            loop.run_in_executor(None, self._upsert_chunk, chunk)
+            self._run_blocking(self._upsert_chunk, chunk)
             for document_chunks in chunks.values()
             for chunk in document_chunks
         ]
@@ -131,7 +133,7 @@ class AnalyticDBDataStore(DataStore):
         data = (
             chunk.id,
             chunk.text,
-            chunk.embedding,
+            chunk.embedding.tolist(),
             chunk.metadata.document_id,
             chunk.metadata.source,
             chunk.metadata.source_id,
@@ -240,8 +242,14 @@ class AnalyticDBDataStore(DataStore):
                 results.append(document_chunk)
             return results
 
-        conn = self.connection_pool.getconn()
-        try:
+        def run_queries() -> List[QueryResult]:
+            conn = self.connection_pool.getconn()
+            try:
+                return fetch_results(conn)
+            finally:
+                self.connection_pool.putconn(conn)
+
+        def fetch_results(conn) -> List[QueryResult]:
             for query in queries:
                 try:
                     cur = conn.cursor(cursor_factory=DictCursor)
@@ -256,8 +264,8 @@ class AnalyticDBDataStore(DataStore):
                     logger.error(e)
                     query_results.append(QueryResult(query=query.query, results=[]))
             return query_results
-        finally:
-            self.connection_pool.putconn(conn)
+
+        return await self._run_blocking(run_queries)
 
     async def delete(
         self,
@@ -265,7 +273,7 @@ class AnalyticDBDataStore(DataStore):
         filter: Optional[DocumentMetadataFilter] = None,
         delete_all: Optional[bool] = None,
     ) -> bool:
-        async def execute_delete(query: str, params: Optional[List] = None) -> bool:
+        def _execute_delete(query: str, params: Optional[List] = None) -> bool:
             conn = self.connection_pool.getconn()
             try:
                 with conn.cursor() as cur:
@@ -281,6 +289,9 @@ class AnalyticDBDataStore(DataStore):
             finally:
                 self.connection_pool.putconn(conn)
 
+        async def execute_delete(query: str, params: Optional[List] = None) -> bool:
+            return await self._run_blocking(_execute_delete, query, params)
+
         if delete_all:
             query = f"DELETE FROM {self.collection_name} WHERE document_id LIKE %s;"
             return await execute_delete(query, ["%"])
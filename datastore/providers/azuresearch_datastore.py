@@ -6,6 +6,7 @@ import base64
 from typing import Dict, List, Optional, Union
 from datastore.datastore import DataStore
 from models.models import DocumentChunk, DocumentChunkMetadata, DocumentChunkWithScore, DocumentMetadataFilter, Query, QueryResult, QueryWithEmbedding
+from services.embedding_profile import embedding_profile
 from loguru import logger
 from azure.search.documents.aio import SearchClient
 from azure.search.documents.models import Vector, QueryType
@@ -21,7 +22,9 @@ AZURESEARCH_API_KEY = os.environ.get("AZURESEARCH_API_KEY")
 AZURESEARCH_SEMANTIC_CONFIG = os.environ.get("AZURESEARCH_SEMANTIC_CONFIG")
 AZURESEARCH_LANGUAGE = os.environ.get("AZURESEARCH_LANGUAGE", "en-us")
 AZURESEARCH_DISABLE_HYBRID = os.environ.get("AZURESEARCH_DISABLE_HYBRID")
-AZURESEARCH_DIMENSIONS = os.environ.get("AZURESEARCH_DIMENSIONS", 1536) # Default to OpenAI's ada-002 embedding model vector size
+AZURESEARCH_DIMENSIONS = int(os.environ.get("AZURESEARCH_DIMENSIONS", embedding_profile.dimension))
+# Azure Cognitive Search's name for the metric of the embedding profile
+AZURESEARCH_METRIC = {"cosine": "cosine", "ip": "dotProduct", "l2": "euclidean"}[embedding_profile.metric]
 assert AZURESEARCH_SERVICE is not None
 assert AZURESEARCH_INDEX is not None
 
@@ -76,7 +79,7 @@ class AzureSearchDataStore(DataStore):
                     # base64-encode the id string to stay within Azure Search's valid characters for keys
                     FIELDS_ID: base64.urlsafe_b64encode(bytes(chunk.id, "utf-8")).decode("ascii"),
                     FIELDS_TEXT: chunk.text,
-                    FIELDS_EMBEDDING: chunk.embedding,
+                    FIELDS_EMBEDDING: chunk.embedding.tolist(),
                     FIELDS_DOCUMENT_ID: document_id,
                     FIELDS_SOURCE: chunk.metadata.source,
                     FIELDS_SOURCE_ID: chunk.metadata.source_id,
@@ -97,29 +100,34 @@ class AzureSearchDataStore(DataStore):
     async def delete(self, ids: Optional[List[str]] = None, filter: Optional[DocumentMetadataFilter] = None, delete_all: Optional[bool] = None) -> bool:
         filter = None if delete_all else self._translate_filter(filter)
         if delete_all or filter is not None:
-            deleted = set()
-            while True:
-                search_result = await self.client.search(None, filter=filter, top=MAX_DELETE_BATCH_SIZE, include_total_count=True, select=FIELDS_ID)
-                if await search_result.get_count() == 0:
-                    break
-                documents = [{ FIELDS_ID: d[FIELDS_ID] } async for d in search_result if d[FIELDS_ID] not in deleted]
-                if len(documents) > 0:
-                    logger.info(f"Deleting {len(documents)} chunks " + ("using a filter" if filter is not None else "using delete_all"))
-                    del_result = await self.client.delete_documents(documents=documents)
-                    if not all([rr.succeeded for rr in del_result]):
-                        raise Exception("Failed to delete documents")
-                    deleted.update([d[FIELDS_ID] for d in documents])
-                else:
-                    # All repeats, delay a bit to let the index refresh and try again
-                    time.sleep(0.25)
-        
+            await self._delete_by_filter(filter)
+
         if ids is not None and len(ids) > 0:
-            for id in ids:
-                logger.info(f"Deleting chunks for document id {id}")
-                await self.delete(filter=DocumentMetadataFilter(document_id=id))
+            logger.info(f"Deleting chunks for document ids {ids}")
+            await self._delete_by_filter(self._translate_document_ids(ids))
 
         return True
 
+    async def _delete_by_filter(self, filter: Optional[str]) -> None:
+        """
+        Deletes all the chunks matching an Azure Search filter string, or every chunk if the filter is None
+        """
+        deleted = set()
+        while True:
+            search_result = await self.client.search(None, filter=filter, top=MAX_DELETE_BATCH_SIZE, include_total_count=True, select=FIELDS_ID)
+            if await search_result.get_count() == 0:
+                break
+            documents = [{ FIELDS_ID: d[FIELDS_ID] } async for d in search_result if d[FIELDS_ID] not in deleted]
+            if len(documents) > 0:
+                logger.info(f"Deleting {len(documents)} chunks " + ("using a filter" if filter is not None else "using delete_all"))
+                del_result = await self.client.delete_documents(documents=documents)
+                if not all([rr.succeeded for rr in del_result]):
+                    raise Exception("Failed to delete documents")
+                deleted.update([d[FIELDS_ID] for d in documents])
+            else:
+                # All repeats, delay a bit to let the index refresh and try again
+                time.sleep(0.25)
+
     async def _query(self, queries: List[QueryWithEmbedding]) -> List[QueryResult]:
         """
         Takes in a list of queries with embeddings and filters and returns a list of query results with matching document chunks and scores.
@@ -141,7 +149,7 @@ class AzureSearchDataStore(DataStore):
                         q, 
                         filter=filter, 
                         top=query.top_k, 
-                        vector=Vector(value=query.embedding, k=vector_top_k, fields=FIELDS_EMBEDDING),
+                        vector=Vector(value=query.embedding.tolist(), k=vector_top_k, fields=FIELDS_EMBEDDING),
                         query_type=QueryType.SEMANTIC,
                         query_language=AZURESEARCH_LANGUAGE,
                         semantic_configuration_name=AZURESEARCH_SEMANTIC_CONFIG)
@@ -150,7 +158,7 @@ class AzureSearchDataStore(DataStore):
                         q, 
                         filter=filter, 
                         top=query.top_k, 
-                        vector=Vector(value=query.embedding, k=vector_top_k, fields=FIELDS_EMBEDDING))
+                        vector=Vector(value=query.embedding.tolist(), k=vector_top_k, fields=FIELDS_EMBEDDING))
             results: List[DocumentChunkWithScore] = []
             async for hit in r:
                 f = lambda field: hit.get(field) if field != "-" else None
@@ -172,6 +180,14 @@ class AzureSearchDataStore(DataStore):
         except Exception as e:
             raise Exception(f"Error querying the index: {e}")
 
+    @staticmethod
+    def _translate_document_ids(ids: List[str]) -> str:
+        """
+        Translates a list of document ids into a single Azure Search filter string matching any of them
+        """
+        escaped_ids = "|".join(id.replace("'", "''") for id in ids)
+        return f"search.in({FIELDS_DOCUMENT_ID}, '{escaped_ids}', '|')"
+
     @staticmethod    
     def _translate_filter(filter: DocumentMetadataFilter) -> str:
         """
@@ -241,8 +257,7 @@ class AzureSearchDataStore(DataStore):
                         VectorSearchAlgorithmConfiguration(
                             name="default",
                             kind="hnsw",
-                            # Could change to dotproduct for OpenAI's embeddings since they normalize vectors to unit length
-                            hnsw_parameters=HnswParameters(metric="cosine") 
+                            hnsw_parameters=HnswParameters(metric=AZURESEARCH_METRIC)
                         )
                     ]
                 )
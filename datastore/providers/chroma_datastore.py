@@ -7,15 +7,15 @@ Consult the Chroma docs and GitHub repo for more information:
 - https://www.trychroma.com/
 """
 
+import asyncio
 import os
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import chromadb
 
-from datastore.datastore import DataStore
+from datastore.datastore import DATASTORE_THREAD_POOL_SIZE, DataStore
 from models.models import (
-    Document,
     DocumentChunk,
     DocumentChunkMetadata,
     DocumentChunkWithScore,
@@ -24,16 +24,22 @@ from models.models import (
     QueryWithEmbedding,
     Source,
 )
-from services.chunks import get_document_chunks
+from services.embedding_profile import embedding_profile
 
 CHROMA_IN_MEMORY = os.environ.get("CHROMA_IN_MEMORY", "True")
 CHROMA_PERSISTENCE_DIR = os.environ.get("CHROMA_PERSISTENCE_DIR", "openai")
 CHROMA_HOST = os.environ.get("CHROMA_HOST", "http://127.0.0.1")
 CHROMA_PORT = os.environ.get("CHROMA_PORT", "8000")
 CHROMA_COLLECTION = os.environ.get("CHROMA_COLLECTION", "openaiembeddings")
+# The number of threads running Chroma client calls, defaults to 1 for local clients, whose
+# database connection cannot be used by several threads at once, and to DATASTORE_THREAD_POOL_SIZE otherwise
+CHROMA_THREAD_POOL_SIZE = os.environ.get("CHROMA_THREAD_POOL_SIZE")
 
 
 class ChromaDataStore(DataStore):
+    # Results are scored by their distance to the query
+    score_is_distance = True
+
     def __init__(
         self,
         in_memory: bool = CHROMA_IN_MEMORY,  # type: ignore
@@ -42,7 +48,9 @@ class ChromaDataStore(DataStore):
         host: str = CHROMA_HOST,
         port: str = CHROMA_PORT,
         client: Optional[chromadb.Client] = None,
+        thread_pool_size: Optional[int] = None,
     ):
+        local = True
         if client:
             self._client = client
         else:
@@ -58,6 +66,7 @@ class ChromaDataStore(DataStore):
 
                 self._client = chromadb.Client(settings=settings)
             else:
+                local = False
                 self._client = chromadb.Client(
                     settings=chromadb.config.Settings(
                         chroma_api_impl="rest",
@@ -68,20 +77,14 @@ class ChromaDataStore(DataStore):
         self._collection = self._client.get_or_create_collection(
             name=collection_name,
             embedding_function=None,
+            # The metric names of the embedding profile match Chroma's hnsw spaces
+            metadata={"hnsw:space": embedding_profile.metric},
+        )
+        if thread_pool_size is None and CHROMA_THREAD_POOL_SIZE:
+            thread_pool_size = int(CHROMA_THREAD_POOL_SIZE)
+        self.thread_pool_size = thread_pool_size or (
+            1 if local else DATASTORE_THREAD_POOL_SIZE
         )
-
-    async def upsert(
-        self, documents: List[Document], chunk_token_size: Optional[int] = None
-    ) -> List[str]:
-        """
-        Takes in a list of documents and inserts them into the database. If an id already exists, the document is updated.
-        Return a list of document ids.
-        """
-
-        chunks = get_document_chunks(documents, chunk_token_size)
-
-        # Chroma has a true upsert, so we don't need to delete first
-        return await self._upsert(chunks)
 
     async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
         """
@@ -89,10 +92,11 @@ class ChromaDataStore(DataStore):
         Return a list of document ids.
         """
 
-        self._collection.upsert(
+        await self._run_blocking(
+            self._collection.upsert,
             ids=[chunk.id for chunk_list in chunks.values() for chunk in chunk_list],
             embeddings=[
-                chunk.embedding
+                chunk.embedding.tolist()
                 for chunk_list in chunks.values()
                 for chunk in chunk_list
             ],
@@ -100,13 +104,43 @@ class ChromaDataStore(DataStore):
                 chunk.text for chunk_list in chunks.values() for chunk in chunk_list
             ],
             metadatas=[
-                self._process_metadata_for_storage(chunk.metadata)
+                self._process_chunk_for_storage(chunk)
                 for chunk_list in chunks.values()
                 for chunk in chunk_list
             ],
         )
         return list(chunks.keys())
 
+    async def _get_chunk_hashes(
+        self, document_ids: List[str]
+    ) -> Optional[Dict[str, Dict[str, Tuple[Optional[str], Optional[str]]]]]:
+        """
+        Returns the hashes stored in the metadata of the chunks of the given documents.
+        """
+        if len(document_ids) > 1:
+            where_clause = {"$or": [{"document_id": id_} for id_ in document_ids]}
+        else:
+            (id_,) = document_ids
+            where_clause = {"document_id": id_}
+
+        result = await self._run_blocking(
+            self._collection.get, where=where_clause, include=["metadatas"]
+        )
+
+        hashes: Dict[str, Dict[str, Tuple[Optional[str], Optional[str]]]] = {}
+        for id_, metadata in zip(result["ids"], result["metadatas"]):
+            hashes.setdefault(metadata["document_id"], {})[id_] = (
+                metadata.get("chunk_hash"),
+                metadata.get("document_hash"),
+            )
+        return hashes
+
+    async def _delete_chunks(self, chunk_ids: List[str]) -> None:
+        """
+        Removes chunks by their chunk ids.
+        """
+        await self._run_blocking(self._collection.delete, ids=chunk_ids)
+
     def _where_from_query_filter(self, query_filter: DocumentMetadataFilter) -> Dict:
         output = {
             k: v
@@ -162,6 +196,16 @@ class ChromaDataStore(DataStore):
 
         return stored_metadata
 
+    def _process_chunk_for_storage(self, chunk: DocumentChunk) -> Dict:
+        stored_metadata = self._process_metadata_for_storage(chunk.metadata)
+        # Hashes used by incremental upserts to find the chunks that changed
+        if chunk.chunk_hash:
+            stored_metadata["chunk_hash"] = chunk.chunk_hash
+        if chunk.document_hash:
+            stored_metadata["document_hash"] = chunk.document_hash
+
+        return stored_metadata
+
     def _process_metadata_from_storage(self, metadata: Dict) -> DocumentChunkMetadata:
         return DocumentChunkMetadata(
             source=Source(metadata["source"]) if "source" in metadata else None,
@@ -178,17 +222,23 @@ class ChromaDataStore(DataStore):
         """
         Takes in a list of queries with embeddings and filters and returns a list of query results with matching document chunks and scores.
         """
-        results = [
-            self._collection.query(
-                query_embeddings=[query.embedding],
-                include=["documents", "distances", "metadatas"],  # embeddings
-                n_results=min(query.top_k, self._collection.count()),  # type: ignore
-                where=(
-                    self._where_from_query_filter(query.filter) if query.filter else {}
-                ),
-            )
-            for query in queries
-        ]
+        count = await self._run_blocking(self._collection.count)
+        results = await asyncio.gather(
+            *[
+                self._run_blocking(
+                    self._collection.query,
+                    query_embeddings=[query.embedding.tolist()],
+                    include=["documents", "distances", "metadatas"],  # embeddings
+                    n_results=min(query.top_k, count),  # type: ignore
+                    where=(
+                        self._where_from_query_filter(query.filter)
+                        if query.filter
+                        else {}
+                    ),
+                )
+                for query in queries
+            ]
+        )
 
         output = []
         for query, result in zip(queries, results):
@@ -229,7 +279,7 @@ class ChromaDataStore(DataStore):
         Returns whether the operation was successful.
         """
         if delete_all:
-            self._collection.delete()
+            await self._run_blocking(self._collection.delete)
             return True
 
         if ids and len(ids) > 0:
@@ -246,5 +296,5 @@ class ChromaDataStore(DataStore):
         elif filter:
             where_clause = self._where_from_query_filter(filter)
 
-        self._collection.delete(where=where_clause)
+        await self._run_blocking(self._collection.delete, where=where_clause)
         return True
@@ -0,0 +1,375 @@
+"""
+DuckDB datastore for the ChatGPT retrieval plugin.
+
+Chunks, their metadata and their embeddings, as fixed-size float arrays, are stored in one table of
+an embedded DuckDB database, in a single local file or in memory. Queries are answered by a
+vectorized scan of the table computing the similarity of every chunk, with filters pushed down into
+the scan as WHERE clauses.
+
+Consult the DuckDB docs for more information:
+- https://duckdb.org/docs/api/python/overview
+- https://duckdb.org/docs/sql/functions/array
+"""
+
+import asyncio
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import duckdb
+import numpy as np
+import pyarrow as pa
+
+from datastore.datastore import DATASTORE_THREAD_POOL_SIZE, DataStore
+from models.models import (
+    DocumentChunk,
+    DocumentChunkMetadata,
+    DocumentChunkWithScore,
+    DocumentMetadataFilter,
+    QueryResult,
+    QueryWithEmbedding,
+)
+from services.date import to_unix_timestamp
+from services.embedding_profile import embedding_profile
+
+# The DuckDB database file, the database is kept in memory if not set
+DUCKDB_PATH = os.environ.get("DUCKDB_PATH")
+# The table the chunks are stored in
+DUCKDB_TABLE = os.environ.get("DUCKDB_TABLE", "chunks")
+# The number of threads running DuckDB statements off the event loop, each statement also runs on DuckDB's own threads
+DUCKDB_THREAD_POOL_SIZE = int(
+    os.environ.get("DUCKDB_THREAD_POOL_SIZE", DATASTORE_THREAD_POOL_SIZE)
+)
+
+# The array function scoring chunks against a query, and whether the best chunks have the highest scores
+SIMILARITY_FUNCTION, HIGHER_IS_BETTER = {
+    "cosine": ("array_cosine_similarity", True),
+    "ip": ("array_inner_product", True),
+    "l2": ("array_distance", False),
+}[embedding_profile.metric]
+
+# The columns of the table besides the embedding, in order
+COLUMNS = (
+    "id",
+    "text",
+    "document_id",
+    "source",
+    "source_id",
+    "url",
+    "author",
+    "created_at",
+    "chunk_hash",
+    "document_hash",
+)
+# The columns returned with query results
+RESULT_COLUMNS = COLUMNS[:8]
+
+
+def _to_datetime(date_str: str) -> datetime:
+    """
+    Convert a date string to a naive UTC datetime, the type of the created_at column.
+    """
+    return datetime.fromtimestamp(to_unix_timestamp(date_str), timezone.utc).replace(
+        tzinfo=None
+    )
+
+
+class DuckDBDataStore(DataStore):
+    # Results are scored by their euclidean distance to the query with the l2 metric, by similarity otherwise
+    score_is_distance = not HIGHER_IS_BETTER
+    thread_pool_size = DUCKDB_THREAD_POOL_SIZE
+
+    def __init__(
+        self,
+        path: Optional[str] = DUCKDB_PATH,
+        table: str = DUCKDB_TABLE,
+        dimension: int = embedding_profile.dimension,
+    ):
+        self._connection = duckdb.connect(path or ":memory:")
+        self._table = table
+        self._dimension = dimension
+        # Statements run concurrently on their own cursors, but writes are serialized, so that
+        # concurrent upserts of the same chunks do not conflict
+        self._write_lock = threading.Lock()
+        self._connection.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id VARCHAR NOT NULL,
+                text VARCHAR NOT NULL,
+                document_id VARCHAR,
+                source VARCHAR,
+                source_id VARCHAR,
+                url VARCHAR,
+                author VARCHAR,
+                created_at TIMESTAMP,
+                chunk_hash VARCHAR,
+                document_hash VARCHAR,
+                embedding FLOAT[{dimension}] NOT NULL
+            )
+            """
+        )
+        (embedding_type,) = self._connection.execute(
+            "SELECT data_type FROM information_schema.columns WHERE table_name = ? AND column_name = 'embedding'",
+            [table],
+        ).fetchone()
+        if embedding_type != f"FLOAT[{dimension}]":
+            raise ValueError(
+                f"The {table} table stores {embedding_type} embeddings, not {dimension}-dimensional ones"
+            )
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _execute(self, sql: str, parameters: Optional[List[Any]] = None) -> List[Tuple]:
+        with self._connection.cursor() as cursor:
+            return cursor.execute(sql, parameters or []).fetchall()
+
+    def _embeddings_array(self, embeddings: List[np.ndarray]) -> pa.FixedSizeListArray:
+        """
+        Pack embeddings into an Arrow array of fixed-size lists, backed by one contiguous float32 buffer.
+        """
+        matrix = np.stack(embeddings).astype(np.float32, copy=False)
+        if matrix.shape[1] != self._dimension:
+            raise ValueError(
+                f"Embeddings have {matrix.shape[1]} dimensions, the table stores {self._dimension}"
+            )
+        return pa.FixedSizeListArray.from_arrays(pa.array(matrix.ravel()), self._dimension)
+
+    def _where_from_query_filter(
+        self, query_filter: Optional[DocumentMetadataFilter]
+    ) -> Tuple[List[str], List[Any]]:
+        """
+        Compile a filter into the conditions of a WHERE clause and their parameters.
+        """
+        conditions: List[str] = []
+        parameters: List[Any] = []
+        if query_filter is None:
+            return conditions, parameters
+        for field in ("document_id", "source_id", "author"):
+            value = getattr(query_filter, field)
+            if value is not None:
+                conditions.append(f"{field} = ?")
+                parameters.append(value)
+        if query_filter.source:
+            conditions.append("source = ?")
+            parameters.append(query_filter.source.value)
+        # Chunks without a creation date never match a date range
+        if query_filter.start_date:
+            conditions.append("created_at >= ?")
+            parameters.append(_to_datetime(query_filter.start_date))
+        if query_filter.end_date:
+            conditions.append("created_at <= ?")
+            parameters.append(_to_datetime(query_filter.end_date))
+        return conditions, parameters
+
+    def _insert(self, chunks: List[DocumentChunk]) -> None:
+        # A chunk uploaded again replaces its previous version, as does the last of duplicates in a batch
+        chunks = list({chunk.id: chunk for chunk in chunks}.values())
+        new_chunks = pa.table(
+            {
+                "id": [chunk.id for chunk in chunks],
+                "text": [chunk.text for chunk in chunks],
+                "document_id": [chunk.metadata.document_id for chunk in chunks],
+                "source": [
+                    chunk.metadata.source.value if chunk.metadata.source else None
+                    for chunk in chunks
+                ],
+                "source_id": [chunk.metadata.source_id for chunk in chunks],
+                "url": [chunk.metadata.url for chunk in chunks],
+                "author": [chunk.metadata.author for chunk in chunks],
+                "created_at": pa.array(
+                    [
+                        _to_datetime(chunk.metadata.created_at)
+                        if chunk.metadata.created_at
+                        else None
+                        for chunk in chunks
+                    ],
+                    pa.timestamp("us"),
+                ),
+                # Hashes used by incremental upserts to find the chunks that changed
+                "chunk_hash": [chunk.chunk_hash for chunk in chunks],
+                "document_hash": [chunk.document_hash for chunk in chunks],
+                "embedding": self._embeddings_array([chunk.embedding for chunk in chunks]),  # type: ignore
+            }
+        )
+        columns = ", ".join(COLUMNS + ("embedding",))
+        with self._write_lock, self._connection.cursor() as cursor:
+            # The Arrow table is scanned in place, in one bulk insert
+            cursor.register("new_chunks", new_chunks)
+            try:
+                cursor.execute("BEGIN TRANSACTION")
+                cursor.execute(
+                    f"DELETE FROM {self._table} WHERE id IN (SELECT id FROM new_chunks)"
+                )
+                cursor.execute(
+                    f"INSERT INTO {self._table} ({columns}) SELECT {columns} FROM new_chunks"
+                )
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+            finally:
+                cursor.unregister("new_chunks")
+
+    def _search(
+        self, queries: List[QueryWithEmbedding], query_filter: Optional[DocumentMetadataFilter]
+    ) -> List[List[DocumentChunkWithScore]]:
+        """
+        Search the chunks matching a filter for the nearest neighbors of several queries, in one statement.
+        """
+        top_k = max(query.top_k or 0 for query in queries)  # type: ignore
+        if top_k == 0:
+            return [[] for _ in queries]
+        conditions, parameters = self._where_from_query_filter(query_filter)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        # max_by and min_by with a count keep the best rows of each query in a heap, without sorting the table
+        best_by = "max_by" if HIGHER_IS_BETTER else "min_by"
+        query_table = pa.table(
+            {
+                "position": list(range(len(queries))),
+                "embedding": self._embeddings_array([query.embedding for query in queries]),  # type: ignore
+            }
+        )
+        with self._connection.cursor() as cursor:
+            cursor.register("queries", query_table)
+            try:
+                rows = cursor.execute(
+                    f"""
+                    SELECT position, {best_by}(
+                        {{{", ".join(f"{column}: {column}" for column in RESULT_COLUMNS)}, score: score}},
+                        score,
+                        {top_k}
+                    )
+                    FROM (
+                        SELECT q.position, {", ".join(f"c.{column}" for column in RESULT_COLUMNS)},
+                            {SIMILARITY_FUNCTION}(c.embedding, q.embedding) AS score
+                        FROM queries q, (SELECT * FROM {self._table} {where}) c
+                    )
+                    GROUP BY position
+                    """,
+                    parameters,
+                ).fetchall()
+            finally:
+                cursor.unregister("queries")
+
+        results: List[List[DocumentChunkWithScore]] = [[] for _ in queries]
+        for position, best in rows:
+            for row in (best or [])[: queries[position].top_k]:
+                results[position].append(
+                    DocumentChunkWithScore(
+                        id=row["id"],
+                        text=row["text"],
+                        metadata=DocumentChunkMetadata(
+                            document_id=row["document_id"],
+                            source=row["source"],
+                            source_id=row["source_id"],
+                            url=row["url"],
+                            author=row["author"],
+                            created_at=row["created_at"].isoformat()
+                            if row["created_at"]
+                            else None,
+                        ),
+                        score=row["score"],
+                    )
+                )
+        return results
+
+    async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
+        """
+        Takes in a list of list of document chunks and inserts them into the database.
+        Return a list of document ids.
+        """
+        chunk_list = [chunk for doc_chunks in chunks.values() for chunk in doc_chunks]
+        if chunk_list:
+            await self._run_blocking(self._insert, chunk_list)
+        return list(chunks.keys())
+
+    async def _query(self, queries: List[QueryWithEmbedding]) -> List[QueryResult]:
+        """
+        Takes in a list of queries with embeddings and filters and returns a list of query results with matching document chunks and scores.
+        """
+        # Queries with the same filter are answered together, by one scan of the table
+        groups: Dict[Optional[str], List[int]] = {}
+        for i, query in enumerate(queries):
+            groups.setdefault(query.filter.json() if query.filter else None, []).append(i)
+
+        group_results = await asyncio.gather(
+            *[
+                self._run_blocking(
+                    self._search,
+                    [queries[i] for i in positions],
+                    queries[positions[0]].filter,
+                )
+                for positions in groups.values()
+            ]
+        )
+
+        results: List[List[DocumentChunkWithScore]] = [[] for _ in queries]
+        for positions, group_result in zip(groups.values(), group_results):
+            for i, chunks in zip(positions, group_result):
+                results[i] = chunks
+        return [
+            QueryResult(query=query.query, results=chunks)
+            for query, chunks in zip(queries, results)
+        ]
+
+    async def _get_chunk_hashes(
+        self, document_ids: List[str]
+    ) -> Optional[Dict[str, Dict[str, Tuple[Optional[str], Optional[str]]]]]:
+        """
+        Returns the hashes stored with the chunks of the given documents.
+        """
+        rows = await self._run_blocking(
+            self._execute,
+            f"SELECT document_id, id, chunk_hash, document_hash FROM {self._table} WHERE document_id IN (SELECT unnest(?::VARCHAR[]))",
+            [document_ids],
+        )
+        hashes: Dict[str, Dict[str, Tuple[Optional[str], Optional[str]]]] = {}
+        for document_id, id_, chunk_hash, document_hash in rows:
+            hashes.setdefault(document_id, {})[id_] = (chunk_hash, document_hash)
+        return hashes
+
+    def _delete_where(self, conditions: List[str], parameters: List[Any]) -> None:
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._write_lock:
+            self._execute(f"DELETE FROM {self._table} {where}", parameters)
+
+    async def _delete_chunks(self, chunk_ids: List[str]) -> None:
+        """
+        Removes chunks by their chunk ids.
+        """
+        await self._run_blocking(
+            self._delete_where, ["id IN (SELECT unnest(?::VARCHAR[]))"], [chunk_ids]
+        )
+
+    async def _delete_documents(self, document_ids: List[str]) -> None:
+        """
+        Removes the chunks of all the documents with a single statement.
+        """
+        await self.delete(ids=document_ids)
+
+    async def delete(
+        self,
+        ids: Optional[List[str]] = None,
+        filter: Optional[DocumentMetadataFilter] = None,
+        delete_all: Optional[bool] = None,
+    ) -> bool:
+        """
+        Removes vectors by ids, filter, or everything in the datastore.
+        Multiple parameters can be used at once.
+        Returns whether the operation was successful.
+        """
+        if delete_all:
+            await self._run_blocking(self._delete_where, [], [])
+            return True
+
+        conditions, parameters = self._where_from_query_filter(filter)
+        if ids:
+            conditions.append("document_id IN (SELECT unnest(?::VARCHAR[]))")
+            parameters.append(ids)
+        # A filter without any field set matches nothing, rather than every chunk
+        if not conditions:
+            return True
+        await self._run_blocking(self._delete_where, conditions, parameters)
+        return True
@@ -0,0 +1,622 @@
+"""
+FAISS datastore for the ChatGPT retrieval plugin.
+
+Chunks are searched with an approximate nearest neighbor index of the faiss-cpu library, running
+inside the API process, and their text and metadata kept alongside it. The index and the chunks
+can be saved to a local file shortly after writes and loaded from it on startup.
+
+Consult the FAISS docs for more information about the index types:
+- https://github.com/facebookresearch/faiss/wiki/Faiss-indexes
+"""
+
+import atexit
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import faiss
+import numpy as np
+from loguru import logger
+
+from datastore.datastore import DATASTORE_THREAD_POOL_SIZE, DataStore
+from models.models import (
+    DocumentChunk,
+    DocumentChunkMetadata,
+    DocumentChunkWithScore,
+    DocumentMetadataFilter,
+    QueryResult,
+    QueryWithEmbedding,
+    Source,
+)
+from services.date import to_unix_timestamp
+from services.embedding_profile import embedding_profile
+
+# The file the index and the chunks are saved to, they are kept in memory only if not set
+FAISS_INDEX_PATH = os.environ.get("FAISS_INDEX_PATH")
+# How long after a write the index is saved, so that the writes of this interval are saved together.
+# With 0 the index is saved after every write
+FAISS_SAVE_INTERVAL_SECONDS = float(os.environ.get("FAISS_SAVE_INTERVAL_SECONDS", 5))
+# The type of index, one of flat (exact search), ivfpq or hnsw
+FAISS_INDEX_TYPE = os.environ.get("FAISS_INDEX_TYPE", "flat")
+# The number of inverted lists of an ivfpq index, and the number of them searched by each query
+FAISS_IVF_NLIST = int(os.environ.get("FAISS_IVF_NLIST", 1024))
+FAISS_IVF_NPROBE = int(os.environ.get("FAISS_IVF_NPROBE", 16))
+# The number of sub-vectors each embedding is compressed to by an ivfpq index, which must divide the dimension
+FAISS_PQ_M = int(os.environ.get("FAISS_PQ_M", 64))
+# The number of chunks an ivfpq index is trained on, they are searched exactly until there are that many
+FAISS_IVF_TRAIN_SIZE = int(os.environ.get("FAISS_IVF_TRAIN_SIZE", 39 * FAISS_IVF_NLIST))
+# The number of neighbors of each node of an hnsw index, and the size of the candidate lists when adding and searching
+FAISS_HNSW_M = int(os.environ.get("FAISS_HNSW_M", 32))
+FAISS_HNSW_EF_CONSTRUCTION = int(os.environ.get("FAISS_HNSW_EF_CONSTRUCTION", 40))
+FAISS_HNSW_EF_SEARCH = int(os.environ.get("FAISS_HNSW_EF_SEARCH", 64))
+# The number of threads searching and updating the index off the event loop
+FAISS_THREAD_POOL_SIZE = int(
+    os.environ.get("FAISS_THREAD_POOL_SIZE", DATASTORE_THREAD_POOL_SIZE)
+)
+
+INDEX_TYPES = ("flat", "ivfpq", "hnsw")
+# HNSW graphs cannot remove nodes, deleted chunks are skipped by searches until this fraction
+# of the graph is deleted and it is rebuilt
+HNSW_REBUILD_THRESHOLD = 0.25
+
+# Metadata fields that filters match exactly
+FILTER_FIELDS = ("document_id", "source", "source_id", "author")
+
+METRIC_TYPE = {
+    "cosine": faiss.METRIC_INNER_PRODUCT,
+    "ip": faiss.METRIC_INNER_PRODUCT,
+    "l2": faiss.METRIC_L2,
+}[embedding_profile.metric]
+
+
+def _has_conditions(query_filter: DocumentMetadataFilter) -> bool:
+    return any(value is not None for value in query_filter.dict().values())
+
+
+class _ReadWriteLock:
+    """
+    A lock held by any number of readers at once or by a single writer. Waiting writers
+    keep new readers out, so that a stream of searches cannot starve writes.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class FaissDataStore(DataStore):
+    # Results are scored by their squared euclidean distance to the query with the l2 metric, by similarity otherwise
+    score_is_distance = embedding_profile.metric == "l2"
+    thread_pool_size = FAISS_THREAD_POOL_SIZE
+
+    def __init__(
+        self,
+        path: Optional[str] = FAISS_INDEX_PATH,
+        index_type: str = FAISS_INDEX_TYPE,
+        dimension: int = embedding_profile.dimension,
+        nlist: int = FAISS_IVF_NLIST,
+        nprobe: int = FAISS_IVF_NPROBE,
+        pq_m: int = FAISS_PQ_M,
+        train_size: int = FAISS_IVF_TRAIN_SIZE,
+        hnsw_m: int = FAISS_HNSW_M,
+        ef_construction: int = FAISS_HNSW_EF_CONSTRUCTION,
+        ef_search: int = FAISS_HNSW_EF_SEARCH,
+        save_interval: float = FAISS_SAVE_INTERVAL_SECONDS,
+    ):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(
+                f"Unsupported FAISS index type: {index_type}. "
+                f"Try one of the following: {', '.join(INDEX_TYPES)}"
+            )
+        self._path = path
+        self.index_type = index_type
+        self._dimension = dimension
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        # Product quantizers need at least 256 training vectors, one per centroid of each sub-vector
+        self.train_size = max(train_size, nlist, 256)
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.save_interval = save_interval
+        # Searches share the index, writes hold it alone
+        self._lock = _ReadWriteLock()
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._save_timer: Optional[threading.Timer] = None
+        self._timer_lock = threading.Lock()
+        self._training = False
+
+        # The chunks by the int64 id of their vector in the index
+        self._records: Dict[int, Dict[str, Any]] = {}
+        self._id_of: Dict[str, int] = {}
+        self._next_id = 0
+        # The ids of the chunks with each value of the filterable fields, and their creation timestamps
+        self._postings: Dict[str, Dict[str, Set[int]]] = {field: {} for field in FILTER_FIELDS}
+        self._timestamps: Dict[int, float] = {}
+        # Ids still in an hnsw index but deleted
+        self._deleted: Set[int] = set()
+
+        if path and os.path.exists(path):
+            self._load()
+        else:
+            self._active_type = index_type if index_type != "ivfpq" else "flat"
+            self._index = self._create_index(self._active_type)
+        if path:
+            # Writes still waiting for their save are saved when the process exits
+            atexit.register(self.flush)
+
+    # Index
+
+    def _create_index(self, index_type: str) -> faiss.Index:
+        """
+        Create an empty index of the given type, mapping the int64 ids of the chunks to its vectors.
+        An ivfpq index stays empty until it is trained.
+        """
+        if index_type == "flat":
+            index = faiss.IndexFlat(self._dimension, METRIC_TYPE)
+        elif index_type == "ivfpq":
+            quantizer = faiss.IndexFlat(self._dimension, METRIC_TYPE)
+            index = faiss.IndexIVFPQ(
+                quantizer, self._dimension, self.nlist, self.pq_m, 8, METRIC_TYPE
+            )
+            index.nprobe = self.nprobe
+        else:
+            index = faiss.IndexHNSWFlat(self._dimension, self.hnsw_m, METRIC_TYPE)
+            index.hnsw.efConstruction = self.ef_construction
+            index.hnsw.efSearch = self.ef_search
+        return faiss.IndexIDMap2(index)
+
+    def _search_parameters(
+        self, selector: Optional[faiss.IDSelector]
+    ) -> Optional[faiss.SearchParameters]:
+        if selector is None:
+            return None
+        if self._active_type == "ivfpq":
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+        if self._active_type == "hnsw":
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=self.ef_search)
+        return faiss.SearchParameters(sel=selector)
+
+    def _vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the ids and vectors stored in the index.
+        """
+        ids = faiss.vector_to_array(self._index.id_map).astype(np.int64)
+        vectors = self._index.index.reconstruct_n(0, self._index.ntotal)
+        return ids, vectors
+
+    def _rebuild(self, index_type: str) -> None:
+        """
+        Move the vectors of the live chunks into a new index of the given type, training it on them first.
+        Only flat and hnsw indexes can be rebuilt, ivfpq vectors are compressed and cannot be reconstructed.
+        """
+        ids, vectors = self._vectors()
+        live = np.array([id_ not in self._deleted for id_ in ids], dtype=bool)
+        index = self._create_index(index_type)
+        if not index.is_trained:
+            index.train(vectors[live])
+        index.add_with_ids(vectors[live], ids[live])
+        self._index = index
+        self._active_type = index_type
+        self._deleted.clear()
+        logger.info(f"Rebuilt the FAISS index as {index_type} with {index.ntotal} chunks")
+
+    # Storage
+
+    def _load(self) -> None:
+        with np.load(self._path) as saved:  # type: ignore
+            self._index = faiss.deserialize_index(saved["index"])
+            state = json.loads(saved["chunks"].tobytes())
+        if self._index.d != self._dimension:
+            raise ValueError(
+                f"The index at {self._path} stores {self._index.d}-dimensional embeddings, "
+                f"not {self._dimension}-dimensional ones"
+            )
+        self._active_type = state["index_type"]
+        if self._active_type not in (self.index_type, "flat"):
+            logger.warning(
+                f"The index at {self._path} is a {self._active_type} index, not {self.index_type}, "
+                "and is used as it is"
+            )
+        self._next_id = state["next_id"]
+        self._deleted = set(state["deleted"])
+        for id_, record in state["chunks"].items():
+            self._add_record(int(id_), record)
+        logger.info(f"Loaded {len(self._records)} chunks from {self._path}")
+
+    def _save(self) -> None:
+        """
+        Save the index and the chunks if they changed, to a temporary file renamed over the previous one.
+        Writes made while a save runs are saved by the next one.
+        """
+        with self._save_lock:
+            with self._lock.read():
+                if not self._dirty:
+                    return
+                index = faiss.serialize_index(self._index)
+                state = {
+                    "index_type": self._active_type,
+                    "next_id": self._next_id,
+                    "deleted": sorted(self._deleted),
+                    "chunks": self._records,
+                }
+                chunks = np.frombuffer(json.dumps(state).encode(), dtype=np.uint8)
+                self._dirty = False
+            with open(self._path + ".tmp", "wb") as f:  # type: ignore
+                np.savez(f, index=index, chunks=chunks)
+            os.replace(self._path + ".tmp", self._path)  # type: ignore
+
+    def _save_later(self) -> None:
+        with self._timer_lock:
+            self._save_timer = None
+        try:
+            self._save()
+        except Exception as e:
+            logger.error(f"Error saving the FAISS index to {self._path}: {e}")
+
+    async def _save_if_persisted(self) -> None:
+        """
+        Save the index save_interval seconds after the first of a series of writes, so that the
+        whole index is rewritten once for all the writes of the interval rather than after each.
+        """
+        if not self._path:
+            return
+        if self.save_interval <= 0:
+            await self._run_blocking(self._save)
+            return
+        with self._timer_lock:
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(self.save_interval, self._save_later)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def flush(self) -> None:
+        """
+        Save the writes waiting for their save now.
+        """
+        with self._timer_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+        if self._path:
+            self._save()
+
+    def close(self) -> None:
+        """
+        Save the writes waiting for their save, the datastore can still be used afterwards.
+        """
+        self.flush()
+
+    # Chunks
+
+    def _record_from_chunk(self, chunk: DocumentChunk) -> Dict[str, Any]:
+        metadata = chunk.metadata
+        record = {
+            "id": chunk.id,
+            "text": chunk.text,
+            "document_id": metadata.document_id,
+            "source": metadata.source.value if metadata.source else None,
+            "source_id": metadata.source_id,
+            "author": metadata.author,
+            "url": metadata.url,
+            "created_at": metadata.created_at,
+            # Hashes used by incremental upserts to find the chunks that changed
+            "chunk_hash": chunk.chunk_hash,
+            "document_hash": chunk.document_hash,
+        }
+        return {key: value for key, value in record.items() if value is not None}
+
+    def _add_record(self, id_: int, record: Dict[str, Any]) -> None:
+        self._records[id_] = record
+        self._id_of[record["id"]] = id_
+        for field in FILTER_FIELDS:
+            if field in record:
+                self._postings[field].setdefault(record[field], set()).add(id_)
+        if record.get("created_at"):
+            self._timestamps[id_] = to_unix_timestamp(record["created_at"])
+
+    def _remove_records(self, ids: List[int]) -> None:
+        """
+        Remove chunks from the index and from the metadata.
+        """
+        if not ids:
+            return
+        for id_ in ids:
+            record = self._records.pop(id_)
+            del self._id_of[record["id"]]
+            for field in FILTER_FIELDS:
+                if field in record:
+                    postings = self._postings[field][record[field]]
+                    postings.discard(id_)
+                    if not postings:
+                        del self._postings[field][record[field]]
+            self._timestamps.pop(id_, None)
+        if self._active_type == "hnsw":
+            self._deleted.update(ids)
+            if len(self._deleted) > HNSW_REBUILD_THRESHOLD * self._index.ntotal:
+                self._rebuild("hnsw")
+        else:
+            self._index.remove_ids(np.asarray(ids, dtype=np.int64))
+        self._dirty = True
+
+    def _add(self, chunks: List[DocumentChunk]) -> None:
+        vectors = np.stack([chunk.embedding for chunk in chunks]).astype(np.float32)  # type: ignore
+        if vectors.shape[1] != self._dimension:
+            raise ValueError(
+                f"Embeddings have {vectors.shape[1]} dimensions, the index stores {self._dimension}"
+            )
+        if embedding_profile.metric == "cosine":
+            faiss.normalize_L2(vectors)
+
+        with self._lock.write():
+            # A chunk uploaded again replaces its previous version, as does the last of duplicates in a batch
+            latest = {chunk.id: i for i, chunk in enumerate(chunks)}
+            keep = sorted(latest.values())
+            self._remove_records(
+                [self._id_of[chunk_id] for chunk_id in latest if chunk_id in self._id_of]
+            )
+            ids = np.arange(self._next_id, self._next_id + len(keep), dtype=np.int64)
+            self._next_id += len(keep)
+            self._index.add_with_ids(vectors[keep], ids)
+            for id_, i in zip(ids.tolist(), keep):
+                self._add_record(id_, self._record_from_chunk(chunks[i]))
+            self._dirty = True
+            train = (
+                self.index_type == "ivfpq"
+                and self._active_type == "flat"
+                and self._index.ntotal >= self.train_size
+                and not self._training
+            )
+            if train:
+                self._training = True
+        if train:
+            try:
+                self._train_ivfpq()
+            finally:
+                self._training = False
+
+    def _train_ivfpq(self) -> None:
+        """
+        Move the chunks of the flat index into a trained ivfpq index. Training runs outside the lock,
+        on a copy of the vectors, while the flat index keeps serving searches and writes. The writes made
+        in the meantime are applied to the new index before it replaces the flat one.
+        """
+        with self._lock.read():
+            ids, vectors = self._vectors()
+        index = self._create_index("ivfpq")
+        index.train(vectors)
+        index.add_with_ids(vectors, ids)
+
+        with self._lock.write():
+            # Ids are never reused, so the ids that appeared or disappeared are the writes made since the copy
+            current_ids, current_vectors = self._vectors()
+            added = ~np.isin(current_ids, ids)
+            removed = ids[~np.isin(ids, current_ids)]
+            if removed.size:
+                index.remove_ids(removed)
+            if added.any():
+                index.add_with_ids(current_vectors[added], current_ids[added])
+            self._index = index
+            self._active_type = "ivfpq"
+            self._dirty = True
+        logger.info(f"Trained the FAISS ivfpq index on {len(ids)} chunks")
+
+    def _matching_ids(self, query_filter: DocumentMetadataFilter) -> Set[int]:
+        """
+        Return the ids of the chunks that match a filter. A filter without any
+        field set matches nothing.
+        """
+        if not _has_conditions(query_filter):
+            return set()
+        matches: Optional[Set[int]] = None
+        for field in FILTER_FIELDS:
+            value = getattr(query_filter, field)
+            if value is None:
+                continue
+            if isinstance(value, Source):
+                value = value.value
+            postings = self._postings[field].get(value, set())
+            matches = set(postings) if matches is None else matches & postings
+        if matches is None:
+            matches = set(self._records)
+        if query_filter.start_date or query_filter.end_date:
+            start = to_unix_timestamp(query_filter.start_date) if query_filter.start_date else None
+            end = to_unix_timestamp(query_filter.end_date) if query_filter.end_date else None
+            # Chunks without a creation date never match a date range
+            matches = {
+                id_
+                for id_ in matches
+                if id_ in self._timestamps
+                and (start is None or self._timestamps[id_] >= start)
+                and (end is None or self._timestamps[id_] <= end)
+            }
+        return matches
+
+    def _search(self, queries: List[QueryWithEmbedding]) -> List[QueryResult]:
+        vectors = np.stack([query.embedding for query in queries]).astype(np.float32)  # type: ignore
+        if embedding_profile.metric == "cosine":
+            faiss.normalize_L2(vectors)
+
+        # Queries with the same filter are searched together, in one call to the index
+        groups: Dict[Optional[str], List[int]] = {}
+        for i, query in enumerate(queries):
+            groups.setdefault(query.filter.json() if query.filter else None, []).append(i)
+
+        results = [QueryResult(query=query.query, results=[]) for query in queries]
+        with self._lock.read():
+            for positions in groups.values():
+                query_filter = queries[positions[0]].filter
+                selector = None
+                if query_filter is not None and _has_conditions(query_filter):
+                    matches = self._matching_ids(query_filter)
+                    available = len(matches)
+                    selector = faiss.IDSelectorBatch(np.fromiter(matches, dtype=np.int64, count=available))
+                elif self._deleted:
+                    available = len(self._records)
+                    deleted = faiss.IDSelectorBatch(
+                        np.fromiter(self._deleted, dtype=np.int64, count=len(self._deleted))
+                    )
+                    selector = faiss.IDSelectorNot(deleted)
+                else:
+                    available = len(self._records)
+                top_k = min(max(queries[i].top_k or 0 for i in positions), available)  # type: ignore
+                if top_k == 0:
+                    continue
+                scores, ids = self._index.search(
+                    vectors[positions], top_k, params=self._search_parameters(selector)
+                )
+                for i, row_scores, row_ids in zip(positions, scores, ids):
+                    for score, id_ in list(zip(row_scores, row_ids))[: queries[i].top_k]:
+                        if id_ < 0:
+                            break
+                        record = self._records[int(id_)]
+                        results[i].results.append(
+                            DocumentChunkWithScore(
+                                id=record["id"],
+                                text=record["text"],
+                                metadata=DocumentChunkMetadata(
+                                    **{
+                                        field: record.get(field)
+                                        for field in DocumentChunkMetadata.__fields__
+                                    }
+                                ),
+                                score=float(score),
+                            )
+                        )
+        return results
+
+    # DataStore
+
+    async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
+        """
+        Takes in a list of list of document chunks and inserts them into the database.
+        Return a list of document ids.
+        """
+        chunk_list = [chunk for doc_chunks in chunks.values() for chunk in doc_chunks]
+        if chunk_list:
+            await self._run_blocking(self._add, chunk_list)
+            await self._save_if_persisted()
+        return list(chunks.keys())
+
+    async def _query(self, queries: List[QueryWithEmbedding]) -> List[QueryResult]:
+        """
+        Takes in a list of queries with embeddings and filters and returns a list of query results with matching document chunks and scores.
+        """
+        if not queries:
+            return []
+        return await self._run_blocking(self._search, queries)
+
+    async def _get_chunk_hashes(
+        self, document_ids: List[str]
+    ) -> Optional[Dict[str, Dict[str, Tuple[Optional[str], Optional[str]]]]]:
+        """
+        Returns the hashes stored with the chunks of the given documents.
+        """
+
+        def get_chunk_hashes():
+            hashes: Dict[str, Dict[str, Tuple[Optional[str], Optional[str]]]] = {}
+            with self._lock.read():
+                for document_id in document_ids:
+                    for id_ in self._postings["document_id"].get(document_id, ()):
+                        record = self._records[id_]
+                        hashes.setdefault(document_id, {})[record["id"]] = (
+                            record.get("chunk_hash"),
+                            record.get("document_hash"),
+                        )
+            return hashes
+
+        # The read lock waits for writers, which hold it in worker threads, so it is taken off the event loop
+        return await self._run_blocking(get_chunk_hashes)
+
+    async def _delete_chunks(self, chunk_ids: List[str]) -> None:
+        """
+        Removes chunks by their chunk ids.
+        """
+
+        def delete_chunks():
+            with self._lock.write():
+                self._remove_records(
+                    [self._id_of[id_] for id_ in chunk_ids if id_ in self._id_of]
+                )
+
+        await self._run_blocking(delete_chunks)
+        await self._save_if_persisted()
+
+    async def _delete_documents(self, document_ids: List[str]) -> None:
+        """
+        Removes the chunks of all the documents with a single removal from the index.
+        """
+        await self.delete(ids=document_ids)
+
+    async def delete(
+        self,
+        ids: Optional[List[str]] = None,
+        filter: Optional[DocumentMetadataFilter] = None,
+        delete_all: Optional[bool] = None,
+    ) -> bool:
+        """
+        Removes vectors by ids, filter, or everything in the datastore.
+        Multiple parameters can be used at once.
+        Returns whether the operation was successful.
+        """
+
+        def delete_matching():
+            with self._lock.write():
+                if delete_all:
+                    self._records.clear()
+                    self._id_of.clear()
+                    self._postings = {field: {} for field in FILTER_FIELDS}
+                    self._timestamps.clear()
+                    self._deleted.clear()
+                    self._active_type = self.index_type if self.index_type != "ivfpq" else "flat"
+                    self._index = self._create_index(self._active_type)
+                    self._dirty = True
+                    return
+                matches: Set[int] = set()
+                if ids:
+                    for document_id in ids:
+                        matches |= self._postings["document_id"].get(document_id, set())
+                    if filter and _has_conditions(filter):
+                        matches &= self._matching_ids(filter)
+                elif filter:
+                    matches = self._matching_ids(filter)
+                self._remove_records(sorted(matches))
+
+        await self._run_blocking(delete_matching)
+        await self._save_if_persisted()
+        return True
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 from typing import Dict, List, Optional, Type
@@ -18,6 +19,8 @@ INDEX_STRUCT_TYPE_STR = os.environ.get('LLAMA_INDEX_TYPE', IndexStructType.SIMPL
 INDEX_JSON_PATH = os.environ.get('LLAMA_INDEX_JSON_PATH', None)
 QUERY_KWARGS_JSON_PATH = os.environ.get('LLAMA_QUERY_KWARGS_JSON_PATH', None)
 RESPONSE_MODE = os.environ.get('LLAMA_RESPONSE_MODE', ResponseMode.NO_TEXT.value)
+# The number of threads running index calls, 1 by default since in-memory indices are not thread safe
+LLAMA_THREAD_POOL_SIZE = int(os.environ.get('LLAMA_THREAD_POOL_SIZE', 1))
 
 EXTERNAL_VECTOR_STORE_INDEX_STRUCT_TYPES = [
     IndexStructType.DICT,
@@ -66,7 +69,7 @@ def _doc_chunk_to_node(doc_chunk: DocumentChunk, source_doc_id: str) -> Node:
     return Node(
         doc_id=doc_chunk.id,
         text=doc_chunk.text,
-        embedding=doc_chunk.embedding,
+        embedding=doc_chunk.embedding.tolist() if doc_chunk.embedding is not None else None,
         extra_info=doc_chunk.metadata.dict(),
         relationships={
             DocumentRelationship.SOURCE: source_doc_id
@@ -76,7 +79,7 @@ def _doc_chunk_to_node(doc_chunk: DocumentChunk, source_doc_id: str) -> Node:
 def _query_with_embedding_to_query_bundle(query: QueryWithEmbedding) -> QueryBundle:
     return QueryBundle(
         query_str = query.query,
-        embedding=query.embedding,
+        embedding=query.embedding.tolist(),
     )
 
 def _source_node_to_doc_chunk_with_score(node_with_score: NodeWithScore) -> DocumentChunkWithScore:
@@ -98,6 +101,8 @@ def _response_to_query_result(response: Response, query: QueryWithEmbedding) ->
     return QueryResult(query=query.query, results=results,)
 
 class LlamaDataStore(DataStore):
+    thread_pool_size = LLAMA_THREAD_POOL_SIZE
+
     def __init__(self, index: Optional[BaseGPTIndex] = None, query_kwargs: Optional[dict] = None):
         self._index = index or _create_or_load_index()
         self._query_kwargs = query_kwargs or _create_or_load_query_kwargs()
@@ -116,7 +121,7 @@ class LlamaDataStore(DataStore):
                 for doc_chunk in doc_chunks
             ]
                 
-            self._index.insert_nodes(nodes)
+            await self._run_blocking(self._index.insert_nodes, nodes)
             doc_ids.append(doc_id)
         return doc_ids
 
@@ -128,8 +133,7 @@ class LlamaDataStore(DataStore):
         Takes in a list of queries with embeddings and filters and
         returns a list of query results with matching document chunks and scores.
         """
-        query_result_all = []
-        for query in queries:
+        async def _single_query(query: QueryWithEmbedding) -> QueryResult:
             if query.filter is not None:
                 logger.warning('Filters are not supported yet, ignoring for now.')
 
@@ -137,19 +141,25 @@ class LlamaDataStore(DataStore):
 
             # Setup query kwargs
             if self._query_kwargs is not None:
-                query_kwargs = self._query_kwargs
+                query_kwargs = dict(self._query_kwargs)
             else:
                 query_kwargs = {}
             # TODO: support top_k for other indices
             if isinstance(self._index, GPTVectorStoreIndex):
                 query_kwargs['similarity_top_k'] = query.top_k
 
-            response = await self._index.aquery(query_bundle, response_mode=RESPONSE_MODE, **query_kwargs)
-            
-            query_result = _response_to_query_result(response, query)
-            query_result_all.append(query_result)
-        
-        return query_result_all
+            response = await self._run_blocking(
+                self._index.query, query_bundle, response_mode=RESPONSE_MODE, **query_kwargs
+            )
+            return _response_to_query_result(response, query)
+
+        return await asyncio.gather(*[_single_query(query) for query in queries])
+
+    async def _delete_documents(self, document_ids: List[str]) -> None:
+        """
+        Removes the nodes of the given documents by their source document ids, since filtered deletes are not supported.
+        """
+        await self.delete(ids=document_ids)
 
     async def delete(
         self,
@@ -172,7 +182,7 @@ class LlamaDataStore(DataStore):
         if ids is not None:
             for id_ in ids:
                 try:
-                    self._index.delete(id_)
+                    await self._run_blocking(self._index.delete, id_)
                 except NotImplementedError:
                     # NOTE: some indices does not support delete yet.
                     logger.warning(f'{type(self._index)} does not support delete yet.')
@@ -17,7 +17,8 @@ from uuid import uuid4
 
 
 from services.date import to_unix_timestamp
-from datastore.datastore import DataStore
+from services.embedding_profile import embedding_profile
+from datastore.datastore import DATASTORE_THREAD_POOL_SIZE, DataStore
 from models.models import (
     DocumentChunk,
     DocumentChunkMetadata,
@@ -38,9 +39,15 @@ MILVUS_USE_SECURITY = False if MILVUS_PASSWORD is None else True
 MILVUS_INDEX_PARAMS = os.environ.get("MILVUS_INDEX_PARAMS")
 MILVUS_SEARCH_PARAMS = os.environ.get("MILVUS_SEARCH_PARAMS")
 MILVUS_CONSISTENCY_LEVEL = os.environ.get("MILVUS_CONSISTENCY_LEVEL")
+# The number of threads running Milvus client calls, so that the queries of a request are searched in parallel
+MILVUS_THREAD_POOL_SIZE = int(
+    os.environ.get("MILVUS_THREAD_POOL_SIZE", DATASTORE_THREAD_POOL_SIZE)
+)
 
 UPSERT_BATCH_SIZE = 100
-OUTPUT_DIM = 1536
+OUTPUT_DIM = embedding_profile.dimension
+# Milvus has no cosine metric, embeddings are unit length so inner product ranks the same way
+METRIC_TYPE = {"cosine": "IP", "ip": "IP", "l2": "L2"}[embedding_profile.metric]
 EMBEDDING_FIELD = "embedding"
 
 
@@ -103,6 +110,8 @@ SCHEMA_V2[4][1].is_primary = True
 
 
 class MilvusDataStore(DataStore):
+    thread_pool_size = MILVUS_THREAD_POOL_SIZE
+
     def __init__(
         self,
         create_new: Optional[bool] = False,
@@ -216,7 +225,7 @@ class MilvusDataStore(DataStore):
                     # If no index param supplied, to first create an HNSW index for Milvus
                     try:
                         i_p = {
-                            "metric_type": "IP",
+                            "metric_type": METRIC_TYPE,
                             "index_type": "HNSW",
                             "params": {"M": 8, "efConstruction": 64},
                         }
@@ -227,7 +236,7 @@ class MilvusDataStore(DataStore):
                     # If create fails, most likely due to being Zilliz Cloud instance, try to create an AutoIndex
                     except MilvusException:
                         logger.info("Attempting creation of Milvus default index")
-                        i_p = {"metric_type": "IP", "index_type": "AUTOINDEX", "params": {}}
+                        i_p = {"metric_type": METRIC_TYPE, "index_type": "AUTOINDEX", "params": {}}
                         self.col.create_index(EMBEDDING_FIELD, index_params=i_p)
                         self.index_params = i_p
                         logger.info("Creation of Milvus default index successful")
@@ -248,7 +257,7 @@ class MilvusDataStore(DataStore):
                 self.search_params = json.loads(self.search_params)
             else:
                 # The default search params
-                metric_type = "IP"
+                metric_type = METRIC_TYPE
                 if "metric_type" in self.index_params:
                     metric_type = self.index_params["metric_type"]
                 default_search_params = {
@@ -313,7 +322,7 @@ class MilvusDataStore(DataStore):
                 if len(batch[0]) != 0:
                     try:
                         logger.info(f"Upserting batch of size {len(batch[0])}")
-                        self.col.insert(batch)
+                        await self._run_blocking(self.col.insert, batch)
                         logger.info(f"Upserted batch successfully")
                     except Exception as e:
                         logger.error(f"Failed to insert batch records, error: {e}")
@@ -341,6 +350,7 @@ class MilvusDataStore(DataStore):
         # Unpack the metadata into the same dict
         meta = values.pop("metadata")
         values.update(meta)
+        values["embedding"] = chunk.embedding.tolist()
 
         # Convert date to int timestamp form
         if values["created_at"]:
@@ -389,8 +399,9 @@ class MilvusDataStore(DataStore):
 
                 # Perform our search
                 return_from = 2 if self._schema_ver == "V1" else 1
-                res = self.col.search(
-                    data=[query.embedding],
+                res = await self._run_blocking(
+                    self.col.search,
+                    data=[query.embedding.tolist()],
                     anns_field=EMBEDDING_FIELD,
                     param=self.search_params,
                     limit=query.top_k,
@@ -452,15 +463,7 @@ class MilvusDataStore(DataStore):
         """
         # If deleting all, drop and create the new collection
         if delete_all:
-            coll_name = self.col.name
-            logger.info("Delete the entire collection {} and create new one".format(coll_name))
-            # Release the collection from memory
-            self.col.release()
-            # Drop the collection
-            self.col.drop()
-            # Recreate the new collection
-            self._create_collection(coll_name, True)
-            self._create_index()
+            await self._run_blocking(self._recreate_collection)
             return True
 
         # Keep track of how many we have deleted for later printing
@@ -475,7 +478,9 @@ class MilvusDataStore(DataStore):
                 # Add quotation marks around the string format id
                 ids = ['"' + str(id) + '"' for id in ids]
                 # Query for the pk's of entries that match id's
-                ids = self.col.query(f"document_id in [{','.join(ids)}]")
+                ids = await self._run_blocking(
+                    self.col.query, f"document_id in [{','.join(ids)}]"
+                )
                 # Convert to list of pks
                 pks = [str(entry[pk_name]) for entry in ids]  # type: ignore
                 # for schema V2, the "id" is varchar, rewrite the expression
@@ -488,7 +493,9 @@ class MilvusDataStore(DataStore):
                     batch_pks = pks[:batch_size]
                     pks = pks[batch_size:]
                     # Delete the entries batch by batch
-                    res = self.col.delete(f"{pk_name} in [{','.join(batch_pks)}]")
+                    res = await self._run_blocking(
+                        self.col.delete, f"{pk_name} in [{','.join(batch_pks)}]"
+                    )
                     # Increment our deleted count
                     delete_count += int(res.delete_count)  # type: ignore
         except Exception as e:
@@ -502,7 +509,7 @@ class MilvusDataStore(DataStore):
                 # Check if there is anything to filter
                 if len(filter) != 0:  # type: ignore
                     # Query for the pk's of entries that match filter
-                    res = self.col.query(filter)  # type: ignore
+                    res = await self._run_blocking(self.col.query, filter)  # type: ignore
                     # Convert to list of pks
                     pks = [str(entry[pk_name]) for entry in res]  # type: ignore
                     # for schema V2, the "id" is varchar, rewrite the expression
@@ -513,7 +520,9 @@ class MilvusDataStore(DataStore):
                         batch_pks = pks[:batch_size]
                         pks = pks[batch_size:]
                         # Delete the entries batch by batch
-                        res = self.col.delete(f"{pk_name} in [{','.join(batch_pks)}]")  # type: ignore
+                        res = await self._run_blocking(
+                            self.col.delete, f"{pk_name} in [{','.join(batch_pks)}]"  # type: ignore
+                        )
                         # Increment our delete count
                         delete_count += int(res.delete_count)  # type: ignore
         except Exception as e:
@@ -526,6 +535,17 @@ class MilvusDataStore(DataStore):
 
         return True
 
+    def _recreate_collection(self) -> None:
+        coll_name = self.col.name
+        logger.info("Delete the entire collection {} and create new one".format(coll_name))
+        # Release the collection from memory
+        self.col.release()
+        # Drop the collection
+        self.col.drop()
+        # Recreate the new collection
+        self._create_collection(coll_name, True)
+        self._create_index()
+
     def _get_filter(self, filter: DocumentMetadataFilter) -> Optional[str]:
         """Converts a DocumentMetdataFilter to the expression that Milvus takes.
 
@@ -0,0 +1,651 @@
+"""
+In-process NumPy datastore for the ChatGPT retrieval plugin.
+
+Embeddings are kept in one contiguous float32 matrix and every query of a batch is scored with a
+single matrix multiply, so search is exact and there is no network hop. It suits small and medium
+deployments, local testing, and serves as a brute-force baseline for the other datastores.
+
+When NUMPY_DATASTORE_PATH is set the matrix is a memory-mapped file in that directory, next to an
+append-only log of the chunks' text and metadata that is replayed on startup. Deletes only mark
+rows as deleted, and the matrix and log are compacted in the background once enough rows are.
+"""
+
+import asyncio
+import json
+import os
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from datastore.datastore import DATASTORE_THREAD_POOL_SIZE, DataStore
+from models.models import (
+    DocumentChunk,
+    DocumentChunkMetadata,
+    DocumentChunkWithScore,
+    DocumentMetadataFilter,
+    QueryResult,
+    QueryWithEmbedding,
+    Source,
+)
+from services.date import to_unix_timestamp
+from services.embedding_profile import embedding_profile
+
+# Directory the embeddings and chunks are persisted to, they are kept in memory only if not set
+NUMPY_DATASTORE_PATH = os.environ.get("NUMPY_DATASTORE_PATH")
+# The fraction of deleted rows above which the datastore is compacted in the background
+NUMPY_COMPACTION_THRESHOLD = float(os.environ.get("NUMPY_COMPACTION_THRESHOLD", 0.25))
+# The minimum number of deleted rows before the datastore is compacted
+NUMPY_COMPACTION_MIN_DELETED = int(os.environ.get("NUMPY_COMPACTION_MIN_DELETED", 1024))
+# The number of threads searching and writing the matrix, searches run in parallel with each other and with writes
+NUMPY_THREAD_POOL_SIZE = int(
+    os.environ.get("NUMPY_THREAD_POOL_SIZE", DATASTORE_THREAD_POOL_SIZE)
+)
+
+# The number of rows allocated up front, doubled whenever the matrix is full
+INITIAL_CAPACITY = 1024
+
+# Metadata fields that filters match exactly, stored as integer codes into a vocabulary of their values
+FILTER_FIELDS = ("document_id", "source", "source_id", "author")
+# Fields that are only returned with results, stored as lists of strings
+STORED_FIELDS = ("id", "text", "url", "created_at", "chunk_hash", "document_hash")
+
+MANIFEST_FILE = "manifest.json"
+
+
+class _Snapshot(NamedTuple):
+    """
+    The arrays of the datastore as of one moment, searched without holding the lock.
+    Writes only append rows past size or replace the arrays, so a snapshot stays consistent.
+    """
+
+    size: int
+    live: np.ndarray
+    embeddings: np.ndarray
+    square_norms: np.ndarray
+    codes: Dict[str, np.ndarray]
+    vocabularies: Dict[str, Dict[str, int]]
+    values: Dict[str, List[str]]
+    created_at: np.ndarray
+    columns: Dict[str, List[Optional[str]]]
+
+
+class NumpyDataStore(DataStore):
+    # Results are scored by their squared euclidean distance to the query with the l2 metric, by similarity otherwise
+    score_is_distance = embedding_profile.metric == "l2"
+    thread_pool_size = NUMPY_THREAD_POOL_SIZE
+
+    def __init__(
+        self,
+        path: Optional[str] = NUMPY_DATASTORE_PATH,
+        dimension: int = embedding_profile.dimension,
+        compaction_threshold: float = NUMPY_COMPACTION_THRESHOLD,
+        compaction_min_deleted: int = NUMPY_COMPACTION_MIN_DELETED,
+    ):
+        self._path = path
+        self._dimension = dimension
+        self._metric = embedding_profile.metric
+        self.compaction_threshold = compaction_threshold
+        self.compaction_min_deleted = compaction_min_deleted
+        self._lock = threading.RLock()
+        self._compaction: Optional[asyncio.Future] = None
+        self._generation = 0
+        self._log = None
+
+        manifest = None
+        if path:
+            os.makedirs(path, exist_ok=True)
+            manifest_path = os.path.join(path, MANIFEST_FILE)
+            if os.path.exists(manifest_path):
+                with open(manifest_path) as f:
+                    manifest = json.load(f)
+        if manifest is None:
+            self._reset(0, INITIAL_CAPACITY)
+            if path:
+                self._write_manifest()
+        else:
+            if manifest["dimension"] != dimension:
+                raise ValueError(
+                    f"The datastore at {path} stores {manifest['dimension']}-dimensional embeddings, "
+                    f"not {dimension}-dimensional ones"
+                )
+            self._load(manifest["generation"])
+            logger.info(f"Loaded {len(self._row_of)} chunks from {path}")
+        # The last generation started, a compaction and a delete of everything never share one
+        self._last_generation = self._generation
+
+    # Storage
+
+    def _file(self, name: str, generation: int) -> str:
+        return os.path.join(self._path, f"{name}-{generation}")  # type: ignore
+
+    def _open_embeddings(self, generation: int, capacity: int, create: bool) -> np.ndarray:
+        if not self._path:
+            return np.zeros((capacity, self._dimension), dtype=np.float32)
+        file = self._file("embeddings.f32", generation)
+        # Growing the file keeps the rows already written, and pages are only allocated once written
+        with open(file, "wb" if create else "r+b") as f:
+            f.truncate(capacity * self._dimension * 4)
+        return np.memmap(
+            file, dtype=np.float32, mode="r+", shape=(capacity, self._dimension)
+        )
+
+    def _reset(self, generation: int, capacity: int, create: bool = True) -> None:
+        """
+        Start an empty generation of the datastore with room for capacity rows, or open the files of an
+        existing one if create is False.
+        """
+        self._generation = generation
+        self._size = 0
+        self._deleted = 0
+        self._embeddings = self._open_embeddings(generation, capacity, create)
+        self._square_norms = np.zeros(capacity, dtype=np.float32)
+        self._live = np.zeros(capacity, dtype=bool)
+        self._created_at = np.full(capacity, np.nan)
+        self._codes = {field: np.full(capacity, -1, dtype=np.int32) for field in FILTER_FIELDS}
+        self._vocabularies: Dict[str, Dict[str, int]] = {field: {} for field in FILTER_FIELDS}
+        self._values: Dict[str, List[str]] = {field: [] for field in FILTER_FIELDS}
+        self._columns: Dict[str, List[Optional[str]]] = {field: [] for field in STORED_FIELDS}
+        self._row_of: Dict[str, int] = {}
+        if self._path:
+            if self._log is not None:
+                self._log.close()
+            self._log = open(self._file("chunks.jsonl", generation), "w" if create else "a")
+
+    def _load(self, generation: int) -> None:
+        """
+        Open a persisted generation of the datastore and replay its log of chunks.
+        """
+        capacity = os.path.getsize(self._file("embeddings.f32", generation)) // (
+            self._dimension * 4
+        )
+        self._reset(generation, capacity, create=False)
+        length = 0
+        with open(self._file("chunks.jsonl", generation), "rb") as f:
+            for line in f:
+                # A line cut short by a crash is the last one, and its write was never acknowledged
+                if not line.endswith(b"\n"):
+                    break
+                length += len(line)
+                record = json.loads(line)
+                if "deleted" in record:
+                    self._delete_rows(record["deleted"], log=False)
+                else:
+                    self._set_row(record.pop("row"), record)
+        self._log.truncate(length)  # type: ignore
+        self._square_norms[: self._size] = np.einsum(
+            "ij,ij->i", self._embeddings[: self._size], self._embeddings[: self._size]
+        )
+
+    def _write_manifest(self) -> None:
+        manifest_path = os.path.join(self._path, MANIFEST_FILE)  # type: ignore
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump({"generation": self._generation, "dimension": self._dimension}, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def _remove_generation(self, generation: int) -> None:
+        for name in ("embeddings.f32", "chunks.jsonl"):
+            try:
+                os.remove(self._file(name, generation))
+            except FileNotFoundError:
+                pass
+
+    def _append_log(self, records: List[Dict[str, Any]]) -> None:
+        if self._log is None:
+            return
+        # The embeddings are flushed before the log that refers to them
+        if isinstance(self._embeddings, np.memmap):
+            self._embeddings.flush()
+        self._log.write("".join(json.dumps(record) + "\n" for record in records))
+        self._log.flush()
+
+    def _grow_columns(self, capacity: int) -> None:
+        def grown(array: np.ndarray, fill: Any) -> np.ndarray:
+            new = np.full(capacity, fill, dtype=array.dtype)
+            new[: len(array)] = array
+            return new
+
+        self._square_norms = grown(self._square_norms, 0)
+        self._live = grown(self._live, False)
+        self._created_at = grown(self._created_at, np.nan)
+        self._codes = {field: grown(codes, -1) for field, codes in self._codes.items()}
+
+    def _reserve(self, size: int) -> None:
+        """
+        Grow the arrays to hold at least size rows.
+        """
+        capacity = len(self._live)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        if self._path:
+            self._embeddings.flush()  # type: ignore
+            self._embeddings = self._open_embeddings(self._generation, capacity, create=False)
+        else:
+            embeddings = np.zeros((capacity, self._dimension), dtype=np.float32)
+            embeddings[: self._size] = self._embeddings[: self._size]
+            self._embeddings = embeddings
+        self._grow_columns(capacity)
+
+    def _set_row(self, row: int, record: Dict[str, Any]) -> None:
+        """
+        Store the text and metadata of a chunk in a row, replacing any previous row of the same chunk.
+        """
+        previous = self._row_of.get(record["id"])
+        if previous is not None:
+            self._delete_rows([previous], log=False)
+        for field in FILTER_FIELDS:
+            value = record.get(field)
+            if value is None:
+                continue
+            vocabulary = self._vocabularies[field]
+            code = vocabulary.get(value)
+            if code is None:
+                code = vocabulary[value] = len(self._values[field])
+                self._values[field].append(value)
+            self._codes[field][row] = code
+        if record.get("created_at"):
+            self._created_at[row] = to_unix_timestamp(record["created_at"])
+        columns = self._columns
+        # Rows are appended in order, except when a log is replayed after rows it did not record
+        while len(columns["id"]) <= row:
+            for values in columns.values():
+                values.append(None)
+        for field in STORED_FIELDS:
+            columns[field][row] = record.get(field)
+        self._live[row] = True
+        self._row_of[record["id"]] = row
+        self._size = max(self._size, row + 1)
+
+    def _get_record(self, row: int, snapshot: Optional[_Snapshot] = None) -> Dict[str, Any]:
+        columns = snapshot.columns if snapshot else self._columns
+        codes = snapshot.codes if snapshot else self._codes
+        values = snapshot.values if snapshot else self._values
+        record: Dict[str, Any] = {
+            field: columns[field][row] for field in STORED_FIELDS if columns[field][row] is not None
+        }
+        for field in FILTER_FIELDS:
+            code = codes[field][row]
+            if code >= 0:
+                record[field] = values[field][code]
+        return record
+
+    def _delete_rows(self, rows: List[int], log: bool = True) -> None:
+        rows = [row for row in rows if self._live[row]]
+        if not rows:
+            return
+        self._live[rows] = False
+        self._deleted += len(rows)
+        for row in rows:
+            chunk_id = self._columns["id"][row]
+            if self._row_of.get(chunk_id) == row:  # type: ignore
+                del self._row_of[chunk_id]  # type: ignore
+        if log:
+            self._append_log([{"deleted": [int(row) for row in rows]}])
+
+    def _add(self, chunks: List[DocumentChunk]) -> None:
+        matrix = np.stack([chunk.embedding for chunk in chunks]).astype(np.float32, copy=False)  # type: ignore
+        if matrix.shape[1] != self._dimension:
+            raise ValueError(
+                f"Embeddings have {matrix.shape[1]} dimensions, the datastore stores {self._dimension}"
+            )
+        if self._metric == "cosine":
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix = matrix / norms
+
+        with self._lock:
+            start = self._size
+            self._reserve(start + len(chunks))
+            self._embeddings[start : start + len(chunks)] = matrix
+            self._square_norms[start : start + len(chunks)] = np.einsum("ij,ij->i", matrix, matrix)
+            records = []
+            for row, chunk in enumerate(chunks, start):
+                record = self._record_from_chunk(chunk)
+                self._set_row(row, record)
+                records.append({"row": row, **record})
+            self._append_log(records)
+
+    def _record_from_chunk(self, chunk: DocumentChunk) -> Dict[str, Any]:
+        metadata = chunk.metadata
+        record = {
+            "id": chunk.id,
+            "text": chunk.text,
+            "document_id": metadata.document_id,
+            "source": metadata.source.value if metadata.source else None,
+            "source_id": metadata.source_id,
+            "author": metadata.author,
+            "url": metadata.url,
+            "created_at": metadata.created_at,
+            # Hashes used by incremental upserts to find the chunks that changed
+            "chunk_hash": chunk.chunk_hash,
+            "document_hash": chunk.document_hash,
+        }
+        return {key: value for key, value in record.items() if value is not None}
+
+    def _next_generation(self) -> int:
+        self._last_generation += 1
+        return self._last_generation
+
+    def _empty_generation(self, generation: int, capacity: int) -> "NumpyDataStore":
+        """
+        Return a datastore over a new, empty generation of this one's files, for a compaction to fill.
+        """
+        datastore = object.__new__(type(self))
+        datastore._path = self._path
+        datastore._dimension = self._dimension
+        datastore._metric = self._metric
+        datastore._log = None
+        datastore._reset(generation, capacity)
+        return datastore
+
+    def _copy_rows(self, target: "NumpyDataStore", rows: np.ndarray, snapshot: Optional[_Snapshot] = None) -> None:
+        """
+        Append rows of this datastore, or of a snapshot of it, to the target datastore.
+        """
+        if not len(rows):
+            return
+        embeddings = snapshot.embeddings if snapshot else self._embeddings
+        square_norms = snapshot.square_norms if snapshot else self._square_norms
+        start = target._size
+        target._reserve(start + len(rows))
+        target._embeddings[start : start + len(rows)] = embeddings[rows]
+        target._square_norms[start : start + len(rows)] = square_norms[rows]
+        records = [self._get_record(row, snapshot) for row in rows]
+        for row, record in enumerate(records, start):
+            target._set_row(row, record)
+        target._append_log([{"row": row, **record} for row, record in enumerate(records, start)])
+
+    def _compact(self) -> None:
+        """
+        Rewrite the datastore without its deleted rows, as a new generation on disk.
+
+        The new generation is built from a snapshot without holding the lock, so searches and writes
+        go on meanwhile. The lock is only taken again to replay the writes made since the snapshot
+        and swap the new generation in.
+        """
+        with self._lock:
+            if not self._deleted:
+                return
+            snapshot = self._snapshot()
+            old_generation = self._generation
+            generation = self._next_generation()
+        keep = np.flatnonzero(snapshot.live)
+        capacity = INITIAL_CAPACITY
+        while capacity < len(keep):
+            capacity *= 2
+        compacted = self._empty_generation(generation, capacity)
+        self._copy_rows(compacted, keep, snapshot)
+
+        with self._lock:
+            if self._generation != old_generation or (self._path and self._log is None):
+                # Everything was deleted or the datastore was closed in the meantime
+                if compacted._log is not None:
+                    compacted._log.close()
+                    self._remove_generation(generation)
+                return
+            # Replay the deletes of snapshot rows, then the rows added since the snapshot
+            compacted._delete_rows([int(row) for row in np.flatnonzero(~self._live[keep])])
+            self._copy_rows(
+                compacted, np.flatnonzero(self._live[snapshot.size : self._size]) + snapshot.size
+            )
+            if self._log is not None:
+                self._log.close()
+            for name in (
+                "_generation", "_size", "_deleted", "_embeddings", "_square_norms", "_live",
+                "_created_at", "_codes", "_vocabularies", "_values", "_columns", "_row_of", "_log",
+            ):
+                setattr(self, name, getattr(compacted, name))
+            if self._path:
+                # The new generation is complete on disk before the manifest points to it
+                self._write_manifest()
+                self._remove_generation(old_generation)
+            logger.info(f"Compacted the datastore to {self._size - self._deleted} chunks")
+
+    def _delete_all(self) -> None:
+        with self._lock:
+            old_generation = self._generation
+            self._reset(self._next_generation(), INITIAL_CAPACITY)
+            if self._path:
+                self._write_manifest()
+                self._remove_generation(old_generation)
+
+    def close(self) -> None:
+        """
+        Flush the datastore to disk and close its files.
+        """
+        with self._lock:
+            if isinstance(self._embeddings, np.memmap):
+                self._embeddings.flush()
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    # Search
+
+    def _snapshot(self) -> _Snapshot:
+        with self._lock:
+            size = self._size
+            return _Snapshot(
+                size=size,
+                live=self._live[:size].copy(),
+                embeddings=self._embeddings[:size],
+                square_norms=self._square_norms[:size],
+                codes={field: codes[:size] for field, codes in self._codes.items()},
+                vocabularies=self._vocabularies,
+                values=self._values,
+                created_at=self._created_at[:size],
+                columns=self._columns,
+            )
+
+    def _filter_mask(
+        self, snapshot: _Snapshot, query_filter: Optional[DocumentMetadataFilter]
+    ) -> np.ndarray:
+        """
+        Return a boolean mask of the live rows that match a filter.
+        """
+        mask = snapshot.live.copy()
+        if query_filter is None:
+            return mask
+        for field in FILTER_FIELDS:
+            value = getattr(query_filter, field)
+            if value is None:
+                continue
+            if isinstance(value, Source):
+                value = value.value
+            code = snapshot.vocabularies[field].get(value)
+            if code is None:
+                return np.zeros_like(mask)
+            mask &= snapshot.codes[field] == code
+        # Rows without a creation date never match a date range
+        if query_filter.start_date:
+            mask &= snapshot.created_at >= to_unix_timestamp(query_filter.start_date)
+        if query_filter.end_date:
+            mask &= snapshot.created_at <= to_unix_timestamp(query_filter.end_date)
+        return mask
+
+    def _search(self, queries: List[QueryWithEmbedding]) -> List[QueryResult]:
+        snapshot = self._snapshot()
+        results = [QueryResult(query=query.query, results=[]) for query in queries]
+        if not snapshot.size or not queries:
+            return results
+
+        matrix = np.stack([query.embedding for query in queries]).astype(np.float32, copy=False)  # type: ignore
+        if self._metric == "cosine":
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix = matrix / norms
+        # One matrix multiply scores every row against every query of the batch
+        scores = snapshot.embeddings @ matrix.T
+        if self._metric == "l2":
+            scores = (
+                snapshot.square_norms[:, None]
+                - 2 * scores
+                + np.einsum("ij,ij->i", matrix, matrix)[None, :]
+            )
+        else:
+            # Rank by ascending key in both cases
+            scores = -scores
+
+        candidates_by_filter: Dict[Optional[str], np.ndarray] = {}
+        for j, query in enumerate(queries):
+            filter_key = query.filter.json() if query.filter else None
+            candidates = candidates_by_filter.get(filter_key)
+            if candidates is None:
+                candidates = candidates_by_filter[filter_key] = np.flatnonzero(
+                    self._filter_mask(snapshot, query.filter)
+                )
+            k = min(query.top_k or 0, len(candidates))  # type: ignore
+            if k == 0:
+                continue
+            keys = scores[candidates, j]
+            top = np.argpartition(keys, k - 1)[:k] if k < len(keys) else np.arange(len(keys))
+            top = top[np.argsort(keys[top], kind="stable")]
+            for row, key in zip(candidates[top], keys[top]):
+                results[j].results.append(
+                    DocumentChunkWithScore(
+                        id=snapshot.columns["id"][row],
+                        text=snapshot.columns["text"][row],
+                        metadata=self._metadata_from_row(snapshot, row),
+                        score=float(key if self.score_is_distance else -key),
+                    )
+                )
+        return results
+
+    def _metadata_from_row(self, snapshot: _Snapshot, row: int) -> DocumentChunkMetadata:
+        values = {}
+        for field in FILTER_FIELDS:
+            code = snapshot.codes[field][row]
+            if code >= 0:
+                values[field] = snapshot.values[field][code]
+        return DocumentChunkMetadata(
+            **values,
+            url=snapshot.columns["url"][row],
+            created_at=snapshot.columns["created_at"][row],
+        )
+
+    def _matching_rows(
+        self,
+        document_ids: Optional[List[str]] = None,
+        query_filter: Optional[DocumentMetadataFilter] = None,
+    ) -> np.ndarray:
+        """
+        Return the live rows of the given documents that also match the filter, if any.
+        """
+        snapshot = self._snapshot()
+        mask = self._filter_mask(snapshot, query_filter)
+        if document_ids is not None:
+            vocabulary = snapshot.vocabularies["document_id"]
+            codes = [vocabulary[id_] for id_ in document_ids if id_ in vocabulary]
+            mask &= np.isin(snapshot.codes["document_id"], codes)
+        return np.flatnonzero(mask)
+
+    # DataStore
+
+    def _maybe_compact(self) -> None:
+        """
+        Compact the datastore in the background once enough of its rows are deleted.
+        """
+        if self._compaction is not None and not self._compaction.done():
+            return
+        if self._deleted < max(self.compaction_min_deleted, 1):
+            return
+        if self._deleted <= self.compaction_threshold * self._size:
+            return
+        self._compaction = asyncio.ensure_future(self._run_blocking(self._compact))
+        self._compaction.add_done_callback(self._log_compaction_error)
+
+    @staticmethod
+    def _log_compaction_error(future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Compaction failed: {future.exception()}")
+
+    async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
+        """
+        Takes in a list of list of document chunks and inserts them into the database.
+        Return a list of document ids.
+        """
+        chunk_list = [chunk for doc_chunks in chunks.values() for chunk in doc_chunks]
+        if chunk_list:
+            await self._run_blocking(self._add, chunk_list)
+            self._maybe_compact()
+        return list(chunks.keys())
+
+    async def _query(self, queries: List[QueryWithEmbedding]) -> List[QueryResult]:
+        """
+        Takes in a list of queries with embeddings and filters and returns a list of query results with matching document chunks and scores.
+        """
+        return await self._run_blocking(self._search, queries)
+
+    async def _get_chunk_hashes(
+        self, document_ids: List[str]
+    ) -> Optional[Dict[str, Dict[str, Tuple[Optional[str], Optional[str]]]]]:
+        """
+        Returns the hashes stored with the chunks of the given documents.
+        """
+
+        def get_chunk_hashes():
+            with self._lock:
+                hashes: Dict[str, Dict[str, Tuple[Optional[str], Optional[str]]]] = {}
+                for row in self._matching_rows(document_ids):
+                    record = self._get_record(row)
+                    hashes.setdefault(record["document_id"], {})[record["id"]] = (
+                        record.get("chunk_hash"),
+                        record.get("document_hash"),
+                    )
+                return hashes
+
+        return await self._run_blocking(get_chunk_hashes)
+
+    async def _delete_chunks(self, chunk_ids: List[str]) -> None:
+        """
+        Removes chunks by their chunk ids.
+        """
+
+        def delete_chunks():
+            with self._lock:
+                self._delete_rows(
+                    [self._row_of[id_] for id_ in chunk_ids if id_ in self._row_of]
+                )
+
+        await self._run_blocking(delete_chunks)
+        self._maybe_compact()
+
+    async def _delete_documents(self, document_ids: List[str]) -> None:
+        """
+        Removes the chunks of all the documents at once, with a single vectorized mask.
+        """
+        await self.delete(ids=document_ids)
+
+    async def delete(
+        self,
+        ids: Optional[List[str]] = None,
+        filter: Optional[DocumentMetadataFilter] = None,
+        delete_all: Optional[bool] = None,
+    ) -> bool:
+        """
+        Removes vectors by ids, filter, or everything in the datastore.
+        Multiple parameters can be used at once.
+        Returns whether the operation was successful.
+        """
+        if delete_all:
+            await self._run_blocking(self._delete_all)
+            return True
+
+        # A filter without any field set matches nothing, rather than every chunk
+        if filter is not None and not any(filter.dict().values()):
+            filter = None
+        if not ids and not filter:
+            return True
+
+        def delete_rows():
+            with self._lock:
+                self._delete_rows(
+                    self._matching_rows(ids or None, filter).tolist()
+                )
+
+        await self._run_blocking(delete_rows)
+        self._maybe_compact()
+        return True
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+import asyncio
 from typing import Any, Dict, List, Optional
 from datetime import datetime
 from loguru import logger
@@ -75,6 +76,7 @@ class PgVectorDataStore(DataStore):
         Takes in a dict of document_ids to list of document chunks and inserts them into the database.
         Return a list of document ids.
         """
+        rows = []
         for document_id, document_chunks in chunks.items():
             for chunk in document_chunks:
                 json = {
@@ -93,7 +95,9 @@ class PgVectorDataStore(DataStore):
                             to_unix_timestamp(chunk.metadata.created_at)
                         ),
                     )
-                await self.client.upsert("documents", json)
+                rows.append(json)
+        # The rows are upserted concurrently, by the client's threads
+        await asyncio.gather(*[self.client.upsert("documents", json) for json in rows])
 
         return list(chunks.keys())
 
@@ -101,8 +105,8 @@ class PgVectorDataStore(DataStore):
         """
         Takes in a list of queries with embeddings and filters and returns a list of query results with matching document chunks and scores.
         """
-        query_results: List[QueryResult] = []
-        for query in queries:
+
+        async def _single_query(query: QueryWithEmbedding) -> QueryResult:
             # get the top 3 documents with the highest cosine similarity using rpc function in the database called "match_page_sections"
             params = {
                 "in_embedding": query.embedding,
@@ -146,11 +150,13 @@ class PgVectorDataStore(DataStore):
                         ),
                     )
                     results.append(document_chunk)
-                query_results.append(QueryResult(query=query.query, results=results))
+                return QueryResult(query=query.query, results=results)
             except Exception as e:
                 logger.error(e)
-                query_results.append(QueryResult(query=query.query, results=[]))
-        return query_results
+                return QueryResult(query=query.query, results=[])
+
+        # The queries are sent concurrently, by the client's threads
+        return await asyncio.gather(*[_single_query(query) for query in queries])
 
     async def delete(
         self,
@@ -5,7 +5,7 @@ from tenacity import retry, wait_random_exponential, stop_after_attempt
 import asyncio
 from loguru import logger
 
-from datastore.datastore import DataStore
+from datastore.datastore import DATASTORE_THREAD_POOL_SIZE, DataStore
 from models.models import (
     DocumentChunk,
     DocumentChunkMetadata,
@@ -16,6 +16,7 @@ from models.models import (
     Source,
 )
 from services.date import to_unix_timestamp
+from services.embedding_profile import embedding_profile
 
 # Read environment variables for Pinecone configuration
 PINECONE_API_KEY = os.environ.get("PINECONE_API_KEY")
@@ -30,9 +31,20 @@ pinecone.init(api_key=PINECONE_API_KEY, environment=PINECONE_ENVIRONMENT)
 
 # Set the batch size for upserting vectors to Pinecone
 UPSERT_BATCH_SIZE = 100
+# The number of threads running Pinecone client calls, so that batches and queries are sent in parallel
+PINECONE_THREAD_POOL_SIZE = int(
+    os.environ.get("PINECONE_THREAD_POOL_SIZE", DATASTORE_THREAD_POOL_SIZE)
+)
+
+# Pinecone's name for the metric of the embedding profile
+PINECONE_METRIC = {"cosine": "cosine", "ip": "dotproduct", "l2": "euclidean"}[
+    embedding_profile.metric
+]
 
 
 class PineconeDataStore(DataStore):
+    thread_pool_size = PINECONE_THREAD_POOL_SIZE
+
     def __init__(self):
         # Check if the index name is specified and exists in Pinecone
         if PINECONE_INDEX and PINECONE_INDEX not in pinecone.list_indexes():
@@ -47,7 +59,8 @@ class PineconeDataStore(DataStore):
                 )
                 pinecone.create_index(
                     PINECONE_INDEX,
-                    dimension=1536,  # dimensionality of OpenAI ada v2 embeddings
+                    dimension=embedding_profile.dimension,
+                    metric=PINECONE_METRIC,
                     metadata_config={"indexed": fields_to_index},
                 )
                 self.index = pinecone.Index(PINECONE_INDEX)
@@ -87,7 +100,7 @@ class PineconeDataStore(DataStore):
                 # Add the text and document id to the metadata dict
                 pinecone_metadata["text"] = chunk.text
                 pinecone_metadata["document_id"] = doc_id
-                vector = (chunk.id, chunk.embedding, pinecone_metadata)
+                vector = (chunk.id, chunk.embedding.tolist(), pinecone_metadata)
                 vectors.append(vector)
 
         # Split the vectors list into batches of the specified size
@@ -95,16 +108,18 @@ class PineconeDataStore(DataStore):
             vectors[i : i + UPSERT_BATCH_SIZE]
             for i in range(0, len(vectors), UPSERT_BATCH_SIZE)
         ]
-        # Upsert each batch to Pinecone
-        for batch in batches:
+        # Upsert the batches to Pinecone in parallel
+        async def _upsert_batch(batch: List[Any]) -> None:
             try:
                 logger.info(f"Upserting batch of size {len(batch)}")
-                self.index.upsert(vectors=batch)
+                await self._run_blocking(self.index.upsert, vectors=batch)
                 logger.info(f"Upserted batch successfully")
             except Exception as e:
                 logger.error(f"Error upserting batch: {e}")
                 raise e
 
+        await asyncio.gather(*[_upsert_batch(batch) for batch in batches])
+
         return doc_ids
 
     @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(3))
@@ -125,10 +140,11 @@ class PineconeDataStore(DataStore):
 
             try:
                 # Query the index with the query embedding, filter, and top_k
-                query_response = self.index.query(
+                query_response = await self._run_blocking(
+                    self.index.query,
                     # namespace=namespace,
                     top_k=query.top_k,
-                    vector=query.embedding,
+                    vector=query.embedding.tolist(),
                     filter=pinecone_filter,
                     include_metadata=True,
                 )
@@ -165,7 +181,7 @@ class PineconeDataStore(DataStore):
                 query_results.append(result)
             return QueryResult(query=query.query, results=query_results)
 
-        # Use asyncio.gather to run multiple _single_query coroutines concurrently and collect their results
+        # Use asyncio.gather to run multiple _single_query coroutines in parallel, in the thread pool, and collect their results
         results: List[QueryResult] = await asyncio.gather(
             *[_single_query(query) for query in queries]
         )
@@ -186,7 +202,7 @@ class PineconeDataStore(DataStore):
         if delete_all:
             try:
                 logger.info(f"Deleting all vectors from index")
-                self.index.delete(delete_all=True)
+                await self._run_blocking(self.index.delete, delete_all=True)
                 logger.info(f"Deleted all vectors successfully")
                 return True
             except Exception as e:
@@ -199,7 +215,7 @@ class PineconeDataStore(DataStore):
         if pinecone_filter != {}:
             try:
                 logger.info(f"Deleting vectors with filter {pinecone_filter}")
-                self.index.delete(filter=pinecone_filter)
+                await self._run_blocking(self.index.delete, filter=pinecone_filter)
                 logger.info(f"Deleted vectors with filter successfully")
             except Exception as e:
                 logger.error(f"Error deleting vectors with filter: {e}")
@@ -210,7 +226,7 @@ class PineconeDataStore(DataStore):
             try:
                 logger.info(f"Deleting vectors with ids {ids}")
                 pinecone_filter = {"document_id": {"$in": ids}}
-                self.index.delete(filter=pinecone_filter)  # type: ignore
+                await self._run_blocking(self.index.delete, filter=pinecone_filter)  # type: ignore
                 logger.info(f"Deleted vectors with ids successfully")
             except Exception as e:
                 logger.error(f"Error deleting vectors with ids: {e}")
@@ -1,13 +1,15 @@
 import os
-from typing import Any, List
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Iterator, List
 from datetime import datetime
 import numpy as np
 
-from psycopg2 import connect
 from psycopg2.extras import DictCursor
+from psycopg2.pool import ThreadedConnectionPool
 from pgvector.psycopg2 import register_vector
 
 from services.date import to_unix_timestamp
+from datastore.datastore import DATASTORE_THREAD_POOL_SIZE
 from datastore.providers.pgvector_datastore import PGClient, PgVectorDataStore
 from models.models import (
     DocumentMetadataFilter,
@@ -18,34 +20,79 @@ PG_PORT = int(os.environ.get("PG_PORT", 5432))
 PG_DB = os.environ.get("PG_DB", "postgres")
 PG_USER = os.environ.get("PG_USER", "postgres")
 PG_PASSWORD = os.environ.get("PG_PASSWORD", "postgres")
+# The number of threads running queries, each with its own connection from the pool
+POSTGRES_THREAD_POOL_SIZE = int(
+    os.environ.get("POSTGRES_THREAD_POOL_SIZE", DATASTORE_THREAD_POOL_SIZE)
+)
 
 
 # class that implements the DataStore interface for Postgres Datastore provider
 class PostgresDataStore(PgVectorDataStore):
+    thread_pool_size = POSTGRES_THREAD_POOL_SIZE
+
     def create_db_client(self):
-        return PostgresClient()
+        return PostgresClient(self._run_blocking, self.thread_pool_size)
 
 
 class PostgresClient(PGClient):
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        run_blocking: Callable[..., Awaitable[Any]],
+        max_connections: int = POSTGRES_THREAD_POOL_SIZE,
+    ) -> None:
+        """
+        Args:
+            run_blocking: Runs a blocking call off the event loop, the datastore's _run_blocking.
+            max_connections: The size of the connection pool, at least the number of threads calls run in.
+        """
         super().__init__()
-        self.client = connect(
-            dbname=PG_DB, user=PG_USER, password=PG_PASSWORD, host=PG_HOST, port=PG_PORT
+        self._run_blocking = run_blocking
+        self.pool = ThreadedConnectionPool(
+            1,
+            max_connections,
+            dbname=PG_DB,
+            user=PG_USER,
+            password=PG_PASSWORD,
+            host=PG_HOST,
+            port=PG_PORT,
         )
-        register_vector(self.client)
+        # The connections the vector type was registered on, it is registered once per connection
+        self._vector_connections: set = set()
 
     def __del__(self):
-        # close the connection when the client is destroyed
-        self.client.close()
+        # close the connections when the client is destroyed
+        self.pool.closeall()
+
+    @contextmanager
+    def _cursor(self, **kwargs) -> Iterator[Any]:
+        """
+        Yield a cursor on a connection from the pool, committing once the block is done.
+        """
+        conn = self.pool.getconn()
+        try:
+            if conn not in self._vector_connections:
+                register_vector(conn)
+                self._vector_connections.add(conn)
+            with conn.cursor(**kwargs) as cur:
+                yield cur
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
 
     async def upsert(self, table: str, json: dict[str, Any]):
         """
         Takes in a list of documents and inserts them into the table.
         """
-        with self.client.cursor() as cur:
+        await self._run_blocking(self._upsert, table, json)
+
+    def _upsert(self, table: str, json: dict[str, Any]):
+        with self._cursor() as cur:
             if not json.get("created_at"):
                 json["created_at"] = datetime.now()
-            json["embedding"] = np.array(json["embedding"])
+            json["embedding"] = np.asarray(json["embedding"])
             cur.execute(
                 f"INSERT INTO {table} (id, content, embedding, document_id, source, source_id, url, author, created_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT (id) DO UPDATE SET content = %s, embedding = %s, document_id = %s, source = %s, source_id = %s, url = %s, author = %s, created_at = %s",
                 (
@@ -68,18 +115,19 @@ class PostgresClient(PGClient):
                     json["created_at"],
                 ),
             )
-            self.client.commit()
 
     async def rpc(self, function_name: str, params: dict[str, Any]):
         """
         Calls a stored procedure in the database with the given parameters.
         """
+        return await self._run_blocking(self._rpc, function_name, params)
+
+    def _rpc(self, function_name: str, params: dict[str, Any]):
         data = []
-        params["in_embedding"] = np.array(params["in_embedding"])
-        with self.client.cursor(cursor_factory=DictCursor) as cur:
+        params["in_embedding"] = np.asarray(params["in_embedding"])
+        with self._cursor(cursor_factory=DictCursor) as cur:
             cur.callproc(function_name, params)
             rows = cur.fetchall()
-            self.client.commit()
             for row in rows:
                 row["created_at"] = to_unix_timestamp(row["created_at"])
                 data.append(dict(row))
@@ -89,23 +137,21 @@ class PostgresClient(PGClient):
         """
         Deletes rows in the table that match the pattern.
         """
-        with self.client.cursor() as cur:
-            cur.execute(
-                f"DELETE FROM {table} WHERE {column} LIKE %s",
-                (f"%{pattern}%",),
-            )
-            self.client.commit()
+        await self._run_blocking(
+            self._execute,
+            f"DELETE FROM {table} WHERE {column} LIKE %s",
+            (f"%{pattern}%",),
+        )
 
     async def delete_in(self, table: str, column: str, ids: List[str]):
         """
         Deletes rows in the table that match the ids.
         """
-        with self.client.cursor() as cur:
-            cur.execute(
-                f"DELETE FROM {table} WHERE {column} IN %s",
-                (tuple(ids),),
-            )
-            self.client.commit()
+        await self._run_blocking(
+            self._execute,
+            f"DELETE FROM {table} WHERE {column} IN %s",
+            (tuple(ids),),
+        )
 
     async def delete_by_filters(self, table: str, filter: DocumentMetadataFilter):
         """
@@ -127,6 +173,8 @@ class PostgresClient(PGClient):
             filters += f" created_at <= '{filter.end_date}' AND"
         filters = filters[:-4]
 
-        with self.client.cursor() as cur:
-            cur.execute(f"DELETE FROM {table} {filters}")
-            self.client.commit()
+        await self._run_blocking(self._execute, f"DELETE FROM {table} {filters}")
+
+    def _execute(self, query: str, params: Any = None):
+        with self._cursor() as cur:
+            cur.execute(query, params)
@@ -6,7 +6,7 @@ from grpc._channel import _InactiveRpcError
 from qdrant_client.http.exceptions import UnexpectedResponse
 from qdrant_client.http.models import PayloadSchemaType
 
-from datastore.datastore import DataStore
+from datastore.datastore import DATASTORE_THREAD_POOL_SIZE, DataStore
 from models.models import (
     DocumentChunk,
     DocumentMetadataFilter,
@@ -19,22 +19,32 @@ from qdrant_client.http import models as rest
 import qdrant_client
 
 from services.date import to_unix_timestamp
+from services.embedding_profile import embedding_profile
 
 QDRANT_URL = os.environ.get("QDRANT_URL", "http://localhost")
 QDRANT_PORT = os.environ.get("QDRANT_PORT", "6333")
 QDRANT_GRPC_PORT = os.environ.get("QDRANT_GRPC_PORT", "6334")
 QDRANT_API_KEY = os.environ.get("QDRANT_API_KEY")
 QDRANT_COLLECTION = os.environ.get("QDRANT_COLLECTION", "document_chunks")
+# The number of threads running Qdrant client calls
+QDRANT_THREAD_POOL_SIZE = int(
+    os.environ.get("QDRANT_THREAD_POOL_SIZE", DATASTORE_THREAD_POOL_SIZE)
+)
+# Qdrant's name for the metric of the embedding profile
+QDRANT_DISTANCE = {"cosine": "Cosine", "ip": "Dot", "l2": "Euclid"}[
+    embedding_profile.metric
+]
 
 
 class QdrantDataStore(DataStore):
     UUID_NAMESPACE = uuid.UUID("3896d314-1e95-4a3a-b45a-945f9f0b541d")
+    thread_pool_size = QDRANT_THREAD_POOL_SIZE
 
     def __init__(
         self,
         collection_name: Optional[str] = None,
-        vector_size: int = 1536,
-        distance: str = "Cosine",
+        vector_size: int = embedding_profile.dimension,
+        distance: str = QDRANT_DISTANCE,
         recreate_collection: bool = False,
     ):
         """
@@ -68,7 +78,8 @@ class QdrantDataStore(DataStore):
             for _, chunks in chunks.items()
             for chunk in chunks
         ]
-        self.client.upsert(
+        await self._run_blocking(
+            self.client.upsert,
             collection_name=self.collection_name,
             points=points,  # type: ignore
             wait=True,
@@ -85,7 +96,8 @@ class QdrantDataStore(DataStore):
         search_requests = [
             self._convert_query_to_search_request(query) for query in queries
         ]
-        results = self.client.search_batch(
+        results = await self._run_blocking(
+            self.client.search_batch,
             collection_name=self.collection_name,
             requests=search_requests,
         )
@@ -122,7 +134,8 @@ class QdrantDataStore(DataStore):
                 filter, ids
             )
 
-        response = self.client.delete(
+        response = await self._run_blocking(
+            self.client.delete,
             collection_name=self.collection_name,
             points_selector=points_selector,  # type: ignore
         )
@@ -138,7 +151,7 @@ class QdrantDataStore(DataStore):
         )
         return rest.PointStruct(
             id=self._create_document_chunk_id(document_chunk.id),
-            vector=document_chunk.embedding,  # type: ignore
+            vector=document_chunk.embedding.tolist(),  # type: ignore
             payload={
                 "id": document_chunk.id,
                 "text": document_chunk.text,
@@ -156,7 +169,7 @@ class QdrantDataStore(DataStore):
         self, query: QueryWithEmbedding
     ) -> rest.SearchRequest:
         return rest.SearchRequest(
-            vector=query.embedding,
+            vector=query.embedding.tolist(),
             filter=self._convert_metadata_filter_to_qdrant_filter(query.filter),
             limit=query.top_k,  # type: ignore
             with_payload=True,
@@ -171,17 +184,16 @@ class QdrantDataStore(DataStore):
         if metadata_filter is None and ids is None:
             return None
 
-        must_conditions, should_conditions = [], []
+        must_conditions = []
 
-        # Filtering by document ids
+        # Filtering by document ids, with a single condition however many ids there are
         if ids and len(ids) > 0:
-            for document_id in ids:
-                should_conditions.append(
-                    rest.FieldCondition(
-                        key="metadata.document_id",
-                        match=rest.MatchValue(value=document_id),
-                    )
+            must_conditions.append(
+                rest.FieldCondition(
+                    key="metadata.document_id",
+                    match=rest.MatchAny(any=ids),
                 )
+            )
 
         # Equality filters for the payload attributes
         if metadata_filter:
@@ -223,10 +235,10 @@ class QdrantDataStore(DataStore):
                     )
                 )
 
-        if 0 == len(must_conditions) and 0 == len(should_conditions):
+        if 0 == len(must_conditions):
             return None
 
-        return rest.Filter(must=must_conditions, should=should_conditions)
+        return rest.Filter(must=must_conditions)
 
     def _convert_scored_point_to_document_chunk_with_score(
         self, scored_point: rest.ScoredPoint
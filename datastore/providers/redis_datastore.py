@@ -1,4 +1,3 @@
-import asyncio
 import os
 import re
 import json
@@ -15,7 +14,7 @@ from redis.commands.search.field import (
 )
 from loguru import logger
 from typing import Dict, List, Optional
-from datastore.datastore import DataStore
+from datastore.datastore import DataStore, get_id_batches
 from models.models import (
     DocumentChunk,
     DocumentMetadataFilter,
@@ -25,6 +24,7 @@ from models.models import (
     QueryWithEmbedding,
 )
 from services.date import to_unix_timestamp
+from services.embedding_profile import embedding_profile
 
 # Read environment variables for Redis
 REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
@@ -32,12 +32,16 @@ REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
 REDIS_PASSWORD = os.environ.get("REDIS_PASSWORD")
 REDIS_INDEX_NAME = os.environ.get("REDIS_INDEX_NAME", "index")
 REDIS_DOC_PREFIX = os.environ.get("REDIS_DOC_PREFIX", "doc")
-REDIS_DISTANCE_METRIC = os.environ.get("REDIS_DISTANCE_METRIC", "COSINE")
+REDIS_DISTANCE_METRIC = os.environ.get(
+    "REDIS_DISTANCE_METRIC",
+    {"cosine": "COSINE", "ip": "IP", "l2": "L2"}[embedding_profile.metric],
+)
 REDIS_INDEX_TYPE = os.environ.get("REDIS_INDEX_TYPE", "FLAT")
 assert REDIS_INDEX_TYPE in ("FLAT", "HNSW")
 
-# OpenAI Ada Embeddings Dimension
-VECTOR_DIMENSION = 1536
+# Embedding dimension and vector element type, from the embedding profile (FLOAT16 needs RediSearch >= 2.10)
+VECTOR_DIMENSION = embedding_profile.dimension
+VECTOR_TYPE = embedding_profile.dtype.upper()
 
 # RediSearch constants
 REDIS_REQUIRED_MODULES = [
@@ -45,6 +49,9 @@ REDIS_REQUIRED_MODULES = [
     {"name": "ReJSON", "ver": 20404}
 ]
 
+# The number of chunk keys a delete finds with each search, RediSearch returns at most 10000 by default
+REDIS_DELETE_PAGE_SIZE = 10000
+
 REDIS_DEFAULT_ESCAPED_CHARS = re.compile(r"[,.<>{}\[\]\\\"\':;!@#$%^&()\-+=~\/ ]")
 
 # Helper functions
@@ -65,8 +72,44 @@ async def _check_redis_module_exist(client: redis.Redis, modules: List[dict]):
             logger.error(error_message)
             raise AttributeError(error_message)
 
+def _check_vector_field(index_info: dict, vector_type: str, dim: int):
+    """
+    Fail if an existing index stores embeddings with a different element type or dimension,
+    RediSearch would otherwise silently leave every document written with the new layout unindexed.
+    """
+    for attribute in index_info.get("attributes", []):
+        values = [v.decode() if isinstance(v, bytes) else str(v) for v in attribute]
+        keys = [v.lower() for v in values]
+        if "embedding" not in values or "vector" not in keys:
+            continue
+        found = {
+            key: values[keys.index(key) + 1].upper()
+            for key in ("data_type", "dim")
+            if key in keys[:-1]
+        }
+        if not found:
+            logger.warning(
+                f"Could not read the embedding field of RediSearch index {REDIS_INDEX_NAME}, "
+                f"make sure it is a {vector_type} vector of dimension {dim}"
+            )
+            return
+        if found.get("data_type", vector_type) != vector_type or int(found.get("dim", dim)) != dim:
+            error_message = (
+                f"RediSearch index {REDIS_INDEX_NAME} stores {found.get('data_type', vector_type)} "
+                f"embeddings of dimension {found.get('dim', dim)}, but {vector_type} embeddings of "
+                f"dimension {dim} are configured. Drop the index with "
+                f"`FT.DROPINDEX {REDIS_INDEX_NAME}` (without DD, which keeps the documents) and restart "
+                f"to recreate and re-index it, or set REDIS_INDEX_NAME to a new index."
+            )
+            logger.error(error_message)
+            raise ValueError(error_message)
+        return
+
 
 class RedisDataStore(DataStore):
+    # Results are scored by their distance to the query
+    score_is_distance = True
+
     def __init__(self, client: redis.Redis, redisearch_schema: dict):
         self.client = client
         self._schema = redisearch_schema
@@ -107,7 +150,7 @@ class RedisDataStore(DataStore):
                 "$.embedding",
                 REDIS_INDEX_TYPE,
                 {
-                    "TYPE": "FLOAT64",
+                    "TYPE": VECTOR_TYPE,
                     "DIM": dim,
                     "DISTANCE_METRIC": REDIS_DISTANCE_METRIC,
                 },
@@ -116,7 +159,7 @@ class RedisDataStore(DataStore):
         }
         try:
             # Check for existence of RediSearch Index
-            await client.ft(REDIS_INDEX_NAME).info()
+            index_info = await client.ft(REDIS_INDEX_NAME).info()
             logger.info(f"RediSearch index {REDIS_INDEX_NAME} already exists")
         except:
             # Create the RediSearch Index
@@ -129,6 +172,8 @@ class RedisDataStore(DataStore):
             await client.ft(REDIS_INDEX_NAME).create_index(
                 fields=fields, definition=definition
             )
+        else:
+            _check_vector_field(index_info, VECTOR_TYPE, dim)
         return cls(client, redisearch_schema)
 
     @staticmethod
@@ -178,6 +223,8 @@ class RedisDataStore(DataStore):
         data = chunk.__dict__
         metadata = chunk.metadata.__dict__
         data["chunk_id"] = data.pop("id")
+        # RedisJSON stores the embedding as a JSON array
+        data["embedding"] = chunk.embedding.tolist()
 
         # Prep Redis Metadata
         redis_metadata = dict(self._default_metadata)
@@ -258,8 +305,41 @@ class RedisDataStore(DataStore):
         Args:
             keys (List[str]): List of keys to delete.
         """
-        # Delete the keys
-        await asyncio.gather(*[self.client.delete(key) for key in keys])
+        # Delete the keys with one command per batch rather than one round trip per key
+        for batch in get_id_batches(keys):
+            await self.client.delete(*batch)
+
+    async def _delete_document_chunks(self, document_ids: List[str]) -> int:
+        """
+        Delete the chunks of a batch of documents, finding their keys with one search
+        on the document_id tag and removing them with one pipelined DEL per page of keys.
+
+        Args:
+            document_ids (List[str]): Document ids, at most DELETE_BATCH_SIZE of them.
+
+        Returns:
+            int: The number of keys deleted.
+        """
+        tags = "|".join(self._escape(document_id) for document_id in document_ids)
+        query = (
+            RediSearchQuery(f"@document_id:{{{tags}}}")
+            .no_content()
+            .paging(0, REDIS_DELETE_PAGE_SIZE)
+            .dialect(2)
+        )
+        deleted = 0
+        # Deleted keys leave the index, so each search returns the next page of keys
+        while True:
+            response = await self.client.ft(REDIS_INDEX_NAME).search(query)
+            keys = [doc.id for doc in response.docs]
+            if keys:
+                async with self.client.pipeline(transaction=False) as pipe:
+                    for batch in get_id_batches(keys):
+                        await pipe.delete(*batch)
+                    await pipe.execute()
+                deleted += len(keys)
+            if len(keys) < REDIS_DELETE_PAGE_SIZE:
+                return deleted
 
     #######
 
@@ -307,7 +387,8 @@ class RedisDataStore(DataStore):
 
             # Extract Redis query
             redis_query: RediSearchQuery = self._get_redis_query(query)
-            embedding = np.array(query.embedding, dtype=np.float64).tobytes()
+            # Hand over the raw bytes of the embedding in the index's vector type, without a copy for float32
+            embedding = query.embedding.astype(embedding_profile.numpy_dtype, copy=False).tobytes()
 
             # Perform vector search
             query_response = await self.client.ft(REDIS_INDEX_NAME).search(
@@ -374,16 +455,10 @@ class RedisDataStore(DataStore):
         if ids:
             try:
                 logger.info(f"Deleting document ids {ids}")
-                keys = []
-                # find all keys associated with the document ids
-                for document_id in ids:
-                    doc_keys = await self._find_keys(
-                        pattern=f"{REDIS_DOC_PREFIX}:{document_id}:*"
-                    )
-                    keys.extend(doc_keys)
-                # delete all keys
-                logger.info(f"Deleting {len(keys)} keys from Redis")
-                await self._redis_delete(keys)
+                deleted = 0
+                for batch in get_id_batches(ids):
+                    deleted += await self._delete_document_chunks(batch)
+                logger.info(f"Deleted {deleted} keys from Redis")
             except Exception as e:
                 logger.error(f"Error deleting ids: {e}")
                 raise e
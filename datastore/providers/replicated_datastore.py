@@ -0,0 +1,228 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+
+import numpy as np
+from loguru import logger
+
+from datastore.datastore import DataStore
+from models.models import (
+    DocumentChunk,
+    DocumentMetadataFilter,
+    QueryResult,
+    QueryWithEmbedding,
+)
+from services.metrics import (
+    REPLICATED_HEDGE_DELAY_SECONDS,
+    REPLICATED_HEDGE_WINS,
+    REPLICATED_HEDGES,
+    REPLICATED_QUERIES,
+)
+
+T = TypeVar("T")
+
+# The primary datastore, a datastore name or an object such as {"datastore": "redis", "env": {"REDIS_HOST": "redis-0"}}
+REPLICATED_DATASTORE_PRIMARY = os.environ.get("REPLICATED_DATASTORE_PRIMARY", "null")
+# A JSON list of the replica datastores, in the same format as the primary
+REPLICATED_DATASTORE_REPLICAS = os.environ.get("REPLICATED_DATASTORE_REPLICAS", "[]")
+# The percentile of recent primary query latencies after which a replica is queried too
+REPLICATED_DATASTORE_HEDGE_PERCENTILE = float(
+    os.environ.get("REPLICATED_DATASTORE_HEDGE_PERCENTILE", 95)
+)
+# The minimum delay before a replica is queried, in milliseconds, also used until enough latencies are known
+REPLICATED_DATASTORE_HEDGE_MIN_DELAY_MS = float(
+    os.environ.get("REPLICATED_DATASTORE_HEDGE_MIN_DELAY_MS", 50)
+)
+# The number of recent primary query latencies the hedge delay is computed from
+REPLICATED_DATASTORE_LATENCY_WINDOW = int(
+    os.environ.get("REPLICATED_DATASTORE_LATENCY_WINDOW", 1000)
+)
+
+# The number of latencies needed before the percentile is used instead of the minimum delay
+MIN_LATENCY_SAMPLES = 20
+
+
+class ReplicatedDataStore(DataStore):
+    """
+    A datastore keeping the same documents in a primary and one or more replica datastores.
+
+    Writes go to every datastore. Queries go to the primary, and if it has not answered once the
+    hedge delay has passed, to the next replica as well: whichever answers first is returned and the
+    other query cancelled. The hedge delay is a percentile of the recent primary latencies, so only
+    the slowest queries are sent twice.
+    """
+
+    def __init__(
+        self,
+        primary: DataStore,
+        replicas: List[DataStore],
+        hedge_percentile: float = REPLICATED_DATASTORE_HEDGE_PERCENTILE,
+        hedge_min_delay_ms: float = REPLICATED_DATASTORE_HEDGE_MIN_DELAY_MS,
+        latency_window: int = REPLICATED_DATASTORE_LATENCY_WINDOW,
+    ):
+        if not replicas:
+            raise ValueError("A replicated datastore needs at least one replica")
+        if any(
+            replica.score_is_distance != primary.score_is_distance
+            for replica in replicas
+        ):
+            raise ValueError(
+                "All replicas must score results the same way, either by similarity or by distance"
+            )
+        self.primary = primary
+        self.replicas = replicas
+        self.score_is_distance = primary.score_is_distance
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay_ms = hedge_min_delay_ms
+        self._latencies: Deque[float] = deque(maxlen=latency_window)
+        self._next_replica = itertools.cycle(replicas)
+        self.queries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @classmethod
+    async def init(
+        cls,
+        primary: str = REPLICATED_DATASTORE_PRIMARY,
+        replicas: str = REPLICATED_DATASTORE_REPLICAS,
+        **kwargs,
+    ):
+        """
+        Create the datastores described by REPLICATED_DATASTORE_PRIMARY and REPLICATED_DATASTORE_REPLICAS with the datastore factory.
+        """
+        from datastore.factory import get_datastore_from_spec
+
+        primary_spec = json.loads(primary)
+        if not primary_spec:
+            raise ValueError("REPLICATED_DATASTORE_PRIMARY must describe the primary datastore")
+        logger.info(f"Creating primary: {primary_spec}")
+        primary_datastore = await get_datastore_from_spec(primary_spec)
+
+        replica_datastores = []
+        for spec in json.loads(replicas):
+            logger.info(f"Creating replica {len(replica_datastores)}: {spec}")
+            replica_datastores.append(await get_datastore_from_spec(spec))
+        return cls(primary_datastore, replica_datastores, **kwargs)
+
+    @property
+    def datastores(self) -> List[DataStore]:
+        return [self.primary, *self.replicas]
+
+    def get_hedge_delay(self) -> float:
+        """
+        Return how long to wait for the primary before querying a replica, in seconds.
+        """
+        if len(self._latencies) < MIN_LATENCY_SAMPLES:
+            return self.hedge_min_delay_ms / 1000
+        delay = float(np.percentile(self._latencies, self.hedge_percentile))
+        return max(delay, self.hedge_min_delay_ms / 1000)
+
+    async def _hedged(
+        self,
+        primary_call: Callable[[], Awaitable[T]],
+        replica_call: Callable[[DataStore], Awaitable[T]],
+    ) -> T:
+        """
+        Run primary_call, and replica_call on the next replica if the primary is slower than the hedge delay
+        or fails. Return the first successful result, cancelling the other call.
+        """
+        self.queries += 1
+        REPLICATED_QUERIES.inc()
+        hedge_delay = self.get_hedge_delay()
+        REPLICATED_HEDGE_DELAY_SECONDS.set(hedge_delay)
+        start = time.monotonic()
+        primary = asyncio.ensure_future(primary_call())
+        done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+        if done and primary.exception() is None:
+            self._latencies.append(time.monotonic() - start)
+            return primary.result()
+
+        self.hedges += 1
+        REPLICATED_HEDGES.inc()
+        replica = asyncio.ensure_future(replica_call(next(self._next_replica)))
+        pending = {primary, replica}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is not None:
+                        logger.warning(f"Hedged query failed: {task.exception()}")
+                        continue
+                    if task is replica:
+                        self.hedge_wins += 1
+                        REPLICATED_HEDGE_WINS.inc()
+                    return task.result()
+            # Both failed, raise the error of the primary
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            # A primary that was overtaken still took at least this long
+            self._latencies.append(time.monotonic() - start)
+
+    async def _query(self, queries: List[QueryWithEmbedding]) -> List[QueryResult]:
+        """
+        Takes in a list of queries with embeddings and filters and returns a list of query results with matching document chunks and scores,
+        from the primary or from a replica if the primary is slow.
+        """
+        return await self._hedged(
+            lambda: self.primary._query(queries),
+            lambda replica: replica._query(queries),
+        )
+
+    async def _delete_documents(self, document_ids: List[str]) -> None:
+        """
+        Removes the chunks of the given documents from the primary and every replica, before they are upserted again.
+        """
+        await asyncio.gather(
+            *[
+                datastore._delete_documents(document_ids)
+                for datastore in self.datastores
+            ]
+        )
+
+    async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
+        """
+        Takes in a list of list of document chunks and inserts them into the primary and every replica,
+        so that documents are chunked and embedded once however many replicas there are.
+        Return a list of document ids.
+        """
+        await asyncio.gather(
+            *[datastore._upsert(chunks) for datastore in self.datastores]
+        )
+        return list(chunks.keys())
+
+    async def delete(
+        self,
+        ids: Optional[List[str]] = None,
+        filter: Optional[DocumentMetadataFilter] = None,
+        delete_all: Optional[bool] = None,
+    ) -> bool:
+        """
+        Removes vectors by ids, filter, or everything from the primary and every replica.
+        Returns whether the operation was successful on all of them.
+        """
+        results = await asyncio.gather(
+            *[
+                datastore.delete(ids=ids, filter=filter, delete_all=delete_all)
+                for datastore in self.datastores
+            ]
+        )
+        return all(results)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Return the number of queries, how many were hedged and how many of those a replica answered first.
+        """
+        return {
+            "queries": self.queries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_delay_ms": self.get_hedge_delay() * 1000,
+        }
@@ -0,0 +1,186 @@
+import asyncio
+import bisect
+import hashlib
+import json
+import os
+import uuid
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from datastore.datastore import DataStore
+from models.models import (
+    Document,
+    DocumentChunk,
+    DocumentMetadataFilter,
+    QueryResult,
+    QueryWithEmbedding,
+)
+
+# A JSON list of the shards, each a datastore name or an object such as {"datastore": "redis", "env": {"REDIS_HOST": "redis-0"}}
+SHARDED_DATASTORE_SHARDS = os.environ.get("SHARDED_DATASTORE_SHARDS", "[]")
+# The number of points each shard gets on the hash ring, more points spread documents more evenly
+SHARDED_DATASTORE_VIRTUAL_NODES = int(
+    os.environ.get("SHARDED_DATASTORE_VIRTUAL_NODES", 64)
+)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    A consistent hash ring mapping keys to shard indexes.
+
+    Each shard owns virtual_nodes points on the ring and a key belongs to the shard of the first
+    point after its hash, so adding a shard only moves about 1/num_shards of the keys.
+    """
+
+    def __init__(
+        self, num_shards: int, virtual_nodes: int = SHARDED_DATASTORE_VIRTUAL_NODES
+    ):
+        if num_shards <= 0:
+            raise ValueError("A hash ring needs at least one shard")
+        points = sorted(
+            (_hash(f"shard-{shard}:{i}"), shard)
+            for shard in range(num_shards)
+            for i in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def get_shard(self, key: str) -> int:
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._shards[i]
+
+
+class ShardedDataStore(DataStore):
+    """
+    A datastore partitioning documents across several backend datastores.
+
+    Each document is stored in the shard that its id maps to on a consistent hash ring. Queries are
+    sent to every shard concurrently and the per-shard results merged by score, and deletes are
+    broadcast to every shard.
+    """
+
+    def __init__(
+        self,
+        shards: List[DataStore],
+        virtual_nodes: int = SHARDED_DATASTORE_VIRTUAL_NODES,
+    ):
+        if len({shard.score_is_distance for shard in shards}) > 1:
+            raise ValueError(
+                "All shards must score results the same way, either by similarity or by distance"
+            )
+        self.shards = shards
+        self.score_is_distance = shards[0].score_is_distance
+        self._ring = HashRing(len(shards), virtual_nodes)
+
+    @classmethod
+    async def init(cls, shards: str = SHARDED_DATASTORE_SHARDS, **kwargs):
+        """
+        Create the shards described by SHARDED_DATASTORE_SHARDS with the datastore factory.
+        """
+        from datastore.factory import get_datastore_from_spec
+
+        specs = json.loads(shards)
+        if not specs:
+            raise ValueError("SHARDED_DATASTORE_SHARDS must list at least one shard")
+
+        datastores = []
+        for spec in specs:
+            logger.info(f"Creating shard {len(datastores)}: {spec}")
+            datastores.append(await get_datastore_from_spec(spec))
+        return cls(datastores, **kwargs)
+
+    def get_shard(self, document_id: str) -> DataStore:
+        """
+        Return the shard storing the document with the given id.
+        """
+        return self.shards[self._ring.get_shard(document_id)]
+
+    async def _upsert_documents(
+        self, documents: List[Document], chunk_token_size: Optional[int] = None
+    ) -> List[str]:
+        """
+        Upserts each document into its shard, the shards concurrently. Return a list of document ids.
+        """
+        # Documents need an id to be routed to a shard
+        documents = [
+            document if document.id else document.copy(update={"id": str(uuid.uuid4())})
+            for document in documents
+        ]
+        shard_documents: Dict[int, List[Document]] = {}
+        for document in documents:
+            shard_documents.setdefault(
+                self._ring.get_shard(document.id), []  # type: ignore
+            ).append(document)
+
+        await asyncio.gather(
+            *[
+                self.shards[shard].upsert(shard_docs, chunk_token_size)
+                for shard, shard_docs in shard_documents.items()
+            ]
+        )
+        return [document.id for document in documents]  # type: ignore
+
+    async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
+        """
+        Takes in a list of list of document chunks and inserts each document's chunks into its shard.
+        Return a list of document ids.
+        """
+        shard_chunks: Dict[int, Dict[str, List[DocumentChunk]]] = {}
+        for doc_id, doc_chunks in chunks.items():
+            shard_chunks.setdefault(self._ring.get_shard(doc_id), {})[doc_id] = doc_chunks
+
+        await asyncio.gather(
+            *[
+                self.shards[shard]._upsert(shard_doc_chunks)
+                for shard, shard_doc_chunks in shard_chunks.items()
+            ]
+        )
+        return list(chunks.keys())
+
+    async def _query(self, queries: List[QueryWithEmbedding]) -> List[QueryResult]:
+        """
+        Takes in a list of queries with embeddings and filters and returns a list of query results with matching document chunks and scores,
+        the best top_k results of all the shards for each query.
+        """
+        shard_results = await asyncio.gather(
+            *[shard._query(queries) for shard in self.shards]
+        )
+
+        query_results = []
+        for i, query in enumerate(queries):
+            results = [
+                result for results in shard_results for result in results[i].results
+            ]
+            results.sort(
+                key=lambda result: result.score,
+                reverse=not self.score_is_distance,
+            )
+            query_results.append(
+                QueryResult(query=query.query, results=results[: query.top_k])
+            )
+        return query_results
+
+    async def delete(
+        self,
+        ids: Optional[List[str]] = None,
+        filter: Optional[DocumentMetadataFilter] = None,
+        delete_all: Optional[bool] = None,
+    ) -> bool:
+        """
+        Removes vectors by ids, filter, or everything from every shard.
+        Documents are deleted from all the shards, rather than only the one their id maps to, so that
+        copies left on other shards after the shards changed are removed too.
+        Returns whether the operation was successful on every shard.
+        """
+        results = await asyncio.gather(
+            *[
+                shard.delete(ids=ids, filter=filter, delete_all=delete_all)
+                for shard in self.shards
+            ]
+        )
+        return all(results)
@@ -1,9 +1,10 @@
 import os
-from typing import Any, List
+from typing import Any, Awaitable, Callable, List
 from datetime import datetime
 
 from supabase import Client
 
+from datastore.datastore import DATASTORE_THREAD_POOL_SIZE
 from datastore.providers.pgvector_datastore import PGClient, PgVectorDataStore
 from models.models import (
     DocumentMetadataFilter,
@@ -17,17 +18,28 @@ SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
 assert (
     SUPABASE_ANON_KEY is not None or SUPABASE_SERVICE_ROLE_KEY is not None
 ), "SUPABASE_ANON_KEY or SUPABASE_SERVICE_ROLE_KEY must be set"
+# The number of threads running Supabase client calls
+SUPABASE_THREAD_POOL_SIZE = int(
+    os.environ.get("SUPABASE_THREAD_POOL_SIZE", DATASTORE_THREAD_POOL_SIZE)
+)
 
 
 # class that implements the DataStore interface for Supabase Datastore provider
 class SupabaseDataStore(PgVectorDataStore):
+    thread_pool_size = SUPABASE_THREAD_POOL_SIZE
+
     def create_db_client(self):
-        return SupabaseClient()
+        return SupabaseClient(self._run_blocking)
 
 
 class SupabaseClient(PGClient):
-    def __init__(self) -> None:
+    def __init__(self, run_blocking: Callable[..., Awaitable[Any]]) -> None:
+        """
+        Args:
+            run_blocking: Runs a blocking call off the event loop, the datastore's _run_blocking.
+        """
         super().__init__()
+        self._run_blocking = run_blocking
         if not SUPABASE_SERVICE_ROLE_KEY:
             self.client = Client(SUPABASE_URL, SUPABASE_ANON_KEY)
         else:
@@ -39,8 +51,10 @@ class SupabaseClient(PGClient):
         """
         if "created_at" in json:
             json["created_at"] = json["created_at"][0].isoformat()
+        # PostgREST takes JSON, so send the embedding as a list of numbers
+        json["embedding"] = json["embedding"].tolist()
 
-        self.client.table(table).upsert(json).execute()
+        await self._run_blocking(self.client.table(table).upsert(json).execute)
 
     async def rpc(self, function_name: str, params: dict[str, Any]):
         """
@@ -50,21 +64,28 @@ class SupabaseClient(PGClient):
             params["in_start_date"] = params["in_start_date"].isoformat()
         if "in_end_date" in params:
             params["in_end_date"] = params["in_end_date"].isoformat()
+        params["in_embedding"] = params["in_embedding"].tolist()
 
-        response = self.client.rpc(function_name, params=params).execute()
+        response = await self._run_blocking(
+            self.client.rpc(function_name, params=params).execute
+        )
         return response.data
 
     async def delete_like(self, table: str, column: str, pattern: str):
         """
         Deletes rows in the table that match the pattern.
         """
-        self.client.table(table).delete().like(column, pattern).execute()
+        await self._run_blocking(
+            self.client.table(table).delete().like(column, pattern).execute
+        )
 
     async def delete_in(self, table: str, column: str, ids: List[str]):
         """
         Deletes rows in the table that match the ids.
         """
-        self.client.table(table).delete().in_(column, ids).execute()
+        await self._run_blocking(
+            self.client.table(table).delete().in_(column, ids).execute
+        )
 
     async def delete_by_filters(self, table: str, filter: DocumentMetadataFilter):
         """
@@ -92,4 +113,4 @@ class SupabaseClient(PGClient):
                 "created_at",
                 filter.end_date[0].isoformat(),
             )
-        builder.execute()
+        await self._run_blocking(builder.execute)
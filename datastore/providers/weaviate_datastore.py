@@ -1,6 +1,7 @@
 import asyncio
 import os
 import re
+import threading
 import uuid
 from typing import Dict, List, Optional
 
@@ -9,7 +10,7 @@ from loguru import logger
 from weaviate import Client
 from weaviate.util import generate_uuid5
 
-from datastore.datastore import DataStore
+from datastore.datastore import DATASTORE_THREAD_POOL_SIZE, DataStore
 from models.models import (
     DocumentChunk,
     DocumentChunkMetadata,
@@ -19,6 +20,7 @@ from models.models import (
     QueryWithEmbedding,
     Source,
 )
+from services.embedding_profile import embedding_profile
 
 WEAVIATE_URL_DEFAULT = "http://localhost:8080"
 WEAVIATE_CLASS = os.environ.get("WEAVIATE_CLASS", "OpenAIDocument")
@@ -27,6 +29,10 @@ WEAVIATE_BATCH_SIZE = int(os.environ.get("WEAVIATE_BATCH_SIZE", 20))
 WEAVIATE_BATCH_DYNAMIC = os.environ.get("WEAVIATE_BATCH_DYNAMIC", False)
 WEAVIATE_BATCH_TIMEOUT_RETRIES = int(os.environ.get("WEAVIATE_TIMEOUT_RETRIES", 3))
 WEAVIATE_BATCH_NUM_WORKERS = int(os.environ.get("WEAVIATE_BATCH_NUM_WORKERS", 1))
+# The number of threads running Weaviate client calls
+WEAVIATE_THREAD_POOL_SIZE = int(
+    os.environ.get("WEAVIATE_THREAD_POOL_SIZE", DATASTORE_THREAD_POOL_SIZE)
+)
 
 SCHEMA = {
     "class": WEAVIATE_CLASS,
@@ -73,6 +79,11 @@ SCHEMA = {
             "description": "Document author",
         },
     ],
+    "vectorIndexConfig": {
+        "distance": {"cosine": "cosine", "ip": "dot", "l2": "l2-squared"}[
+            embedding_profile.metric
+        ],
+    },
 }
 
 
@@ -83,6 +94,8 @@ def extract_schema_properties(schema):
 
 
 class WeaviateDataStore(DataStore):
+    thread_pool_size = WEAVIATE_THREAD_POOL_SIZE
+
     def handle_errors(self, results: Optional[List[dict]]) -> List[str]:
         if not self or not results:
             return []
@@ -110,6 +123,8 @@ class WeaviateDataStore(DataStore):
             f"Connecting to weaviate instance at {url} with credential type {type(auth_credentials).__name__}"
         )
         self.client = Client(url, auth_client_secret=auth_credentials)
+        # The client has a single batch, which concurrent upserts take turns to use
+        self._batch_lock = threading.Lock()
         self.client.batch.configure(
             batch_size=WEAVIATE_BATCH_SIZE,
             dynamic=WEAVIATE_BATCH_DYNAMIC,  # type: ignore
@@ -151,9 +166,12 @@ class WeaviateDataStore(DataStore):
         Takes in a list of list of document chunks and inserts them into the database.
         Return a list of document ids.
         """
+        return await self._run_blocking(self._upsert_batch, chunks)
+
+    def _upsert_batch(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
         doc_ids = []
 
-        with self.client.batch as batch:
+        with self._batch_lock, self.client.batch as batch:
             for doc_id, doc_chunks in chunks.items():
                 logger.debug(f"Upserting {doc_id} with {len(doc_chunks)} chunks")
                 for doc_chunk in doc_chunks:
@@ -210,10 +228,9 @@ class WeaviateDataStore(DataStore):
                             "author",
                         ],
                     )
-                    .with_hybrid(query=query.query, alpha=0.5, vector=query.embedding)
+                    .with_hybrid(query=query.query, alpha=0.5, vector=query.embedding.tolist())
                     .with_limit(query.top_k)  # type: ignore
                     .with_additional(["score", "vector"])
-                    .do()
                 )
             else:
                 filters_ = self.build_filters(query.filter)
@@ -231,12 +248,12 @@ class WeaviateDataStore(DataStore):
                             "author",
                         ],
                     )
-                    .with_hybrid(query=query.query, alpha=0.5, vector=query.embedding)
+                    .with_hybrid(query=query.query, alpha=0.5, vector=query.embedding.tolist())
                     .with_where(filters_)
                     .with_limit(query.top_k)  # type: ignore
                     .with_additional(["score", "vector"])
-                    .do()
                 )
+            result = await self._run_blocking(result.do)
 
             query_results: List[DocumentChunkWithScore] = []
             response = result["data"]["Get"][WEAVIATE_CLASS]
@@ -274,7 +291,7 @@ class WeaviateDataStore(DataStore):
         """
         if delete_all:
             logger.debug(f"Deleting all vectors in index {WEAVIATE_CLASS}")
-            self.client.schema.delete_all()
+            await self._run_blocking(self.client.schema.delete_all)
             return True
 
         if ids:
@@ -286,8 +303,11 @@ class WeaviateDataStore(DataStore):
             where_clause = {"operator": "Or", "operands": operands}
 
             logger.debug(f"Deleting vectors from index {WEAVIATE_CLASS} with ids {ids}")
-            result = self.client.batch.delete_objects(
-                class_name=WEAVIATE_CLASS, where=where_clause, output="verbose"
+            result = await self._run_blocking(
+                self.client.batch.delete_objects,
+                class_name=WEAVIATE_CLASS,
+                where=where_clause,
+                output="verbose",
             )
 
             if not bool(result["results"]["successful"]):
@@ -301,8 +321,10 @@ class WeaviateDataStore(DataStore):
             logger.debug(
                 f"Deleting vectors from index {WEAVIATE_CLASS} with filter {where_clause}"
             )
-            result = self.client.batch.delete_objects(
-                class_name=WEAVIATE_CLASS, where=where_clause
+            result = await self._run_blocking(
+                self.client.batch.delete_objects,
+                class_name=WEAVIATE_CLASS,
+                where=where_clause,
             )
 
             if not bool(result["results"]["successful"]):
@@ -8,6 +8,7 @@ from pymilvus import (
 from uuid import uuid4
 
 from datastore.providers.milvus_datastore import (
+    METRIC_TYPE,
     MilvusDataStore,
 )
 
@@ -54,11 +55,11 @@ class ZillizDataStore(MilvusDataStore):
         try:
             # If no index on the collection, create one
             if len(self.col.indexes) == 0:
-                self.index_params = {"metric_type": "IP", "index_type": "AUTOINDEX", "params": {}}
+                self.index_params = {"metric_type": METRIC_TYPE, "index_type": "AUTOINDEX", "params": {}}
                 self.col.create_index("embedding", index_params=self.index_params)
 
             self.col.load()
-            self.search_params = {"metric_type": "IP", "params": {}}
+            self.search_params = {"metric_type": METRIC_TYPE, "params": {}}
         except Exception as e:
             logger.error("Failed to create index, error: {}".format(e))
 
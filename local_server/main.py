@@ -13,8 +13,13 @@ from models.api import (
     UpsertRequest,
     UpsertResponse,
 )
+from datastore.datastore import shutdown_datastore_thread_pools
 from datastore.factory import get_datastore
+from services.embedding_provider import get_embedding_provider
 from services.file import get_document_from_file
+from services.chunks import shutdown_chunking_pool
+from services.openai import close_aiosession
+from services.query_cache import set_query_cache_endpoint
 
 from starlette.responses import FileResponse
 
@@ -104,6 +109,7 @@ async def upsert(
 
 @app.post("/query", response_model=QueryResponse)
 async def query_main(request: QueryRequest = Body(...)):
+    set_query_cache_endpoint("/query")
     try:
         results = await datastore.query(
             request.queries,
@@ -141,8 +147,17 @@ async def delete(
 @app.on_event("startup")
 async def startup():
     global datastore
+    # Load the embedding model up front, failing early if it does not fit EMBEDDING_DIMENSION
+    get_embedding_provider()
     datastore = await get_datastore()
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    await close_aiosession()
+    shutdown_chunking_pool()
+    shutdown_datastore_thread_pools()
+
+
 def start():
     uvicorn.run("local_server.main:app", host="localhost", port=PORT, reload=True)
@@ -1,6 +1,8 @@
 from models.models import (
     Document,
     DocumentMetadataFilter,
+    EMBEDDING_JSON_ENCODERS,
+    EmbeddingModel,
     Query,
     QueryResult,
 )
@@ -20,9 +22,12 @@ class QueryRequest(BaseModel):
     queries: List[Query]
 
 
-class QueryResponse(BaseModel):
+class QueryResponse(EmbeddingModel):
     results: List[QueryResult]
 
+    class Config:
+        json_encoders = EMBEDDING_JSON_ENCODERS
+
 
 class DeleteRequest(BaseModel):
     ids: Optional[List[str]] = None
@@ -32,3 +37,11 @@ class DeleteRequest(BaseModel):
 
 class DeleteResponse(BaseModel):
     success: bool
+
+
+class JobResponse(BaseModel):
+    id: str
+    status: str
+    attempts: int = 0
+    error: Optional[str] = None
+    ids: Optional[List[str]] = None
@@ -1,7 +1,62 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field
+from typing import Any, Callable, Dict, Iterator, List, Optional
 from enum import Enum
 
+import numpy as np
+
+
+class Embedding(np.ndarray):
+    """
+    An embedding vector, stored as a contiguous 1-D float32 NumPy array.
+
+    Accepts any sequence of numbers and converts it once, so chunks and queries carry a single
+    compact buffer instead of a list of Python floats. Serialized to JSON as a list of numbers.
+    """
+
+    @classmethod
+    def __get_validators__(cls) -> Iterator[Callable[[Any], np.ndarray]]:
+        yield cls.validate
+
+    @classmethod
+    def validate(cls, value: Any) -> np.ndarray:
+        try:
+            array = np.ascontiguousarray(value, dtype=np.float32)
+        except (TypeError, ValueError) as e:
+            raise TypeError("embedding must be a sequence of numbers") from e
+        if array.ndim != 1:
+            raise ValueError("embedding must be one-dimensional")
+        return array
+
+    @classmethod
+    def __modify_schema__(cls, field_schema: Dict[str, Any]) -> None:
+        field_schema.update(type="array", items={"type": "number"})
+
+
+# Serializes embeddings in .json() and in API responses
+EMBEDDING_JSON_ENCODERS = {np.ndarray: lambda array: array.tolist()}
+
+
+def _values_equal(a: Any, b: Any) -> bool:
+    """
+    Compare values of a model's dict() that may contain embedding arrays, which == compares elementwise.
+    """
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return isinstance(a, np.ndarray) and isinstance(b, np.ndarray) and np.array_equal(a, b)
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_values_equal(a[key], b[key]) for key in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(map(_values_equal, a, b))
+    return a == b
+
+
+class EmbeddingModel(BaseModel):
+    """
+    A model that holds embeddings, directly or in nested models, and compares them by value.
+    """
+
+    def __eq__(self, other: Any) -> bool:
+        return _values_equal(self.dict(), other.dict() if isinstance(other, BaseModel) else other)
+
 
 class Source(str, Enum):
     email = "email"
@@ -21,11 +76,19 @@ class DocumentChunkMetadata(DocumentMetadata):
     document_id: Optional[str] = None
 
 
-class DocumentChunk(BaseModel):
+class DocumentChunk(EmbeddingModel):
     id: Optional[str] = None
     text: str
     metadata: DocumentChunkMetadata
-    embedding: Optional[List[float]] = None
+    embedding: Optional[Embedding] = None
+    # Content hashes stored by datastores that support incremental upserts, left out of the API
+    chunk_hash: Optional[str] = Field(None, exclude=True)
+    document_hash: Optional[str] = Field(None, exclude=True)
+
+    class Config:
+        json_encoders = EMBEDDING_JSON_ENCODERS
+        # Embeddings assigned after construction are converted too
+        validate_assignment = True
 
 
 class DocumentChunkWithScore(DocumentChunk):
@@ -38,7 +101,7 @@ class Document(BaseModel):
     metadata: Optional[DocumentMetadata] = None
 
 
-class DocumentWithChunks(Document):
+class DocumentWithChunks(Document, EmbeddingModel):
     chunks: List[DocumentChunk]
 
 
@@ -57,10 +120,16 @@ class Query(BaseModel):
     top_k: Optional[int] = 3
 
 
-class QueryWithEmbedding(Query):
-    embedding: List[float]
+class QueryWithEmbedding(Query, EmbeddingModel):
+    embedding: Embedding
 
+    class Config:
+        json_encoders = EMBEDDING_JSON_ENCODERS
 
-class QueryResult(BaseModel):
+
+class QueryResult(EmbeddingModel):
     query: str
     results: List[DocumentChunkWithScore]
+
+    class Config:
+        json_encoders = EMBEDDING_JSON_ENCODERS
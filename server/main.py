@@ -1,21 +1,54 @@
+import json
 import os
-from typing import Optional
+from typing import Optional, Union
 import uvicorn
-from fastapi import FastAPI, File, Form, HTTPException, Depends, Body, UploadFile
+from fastapi import (
+    FastAPI,
+    File,
+    Form,
+    HTTPException,
+    Depends,
+    Body,
+    Request,
+    Response,
+    UploadFile,
+)
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
+from starlette.routing import Match, Mount
 from loguru import logger
 
 from models.api import (
     DeleteRequest,
     DeleteResponse,
+    JobResponse,
     QueryRequest,
     QueryResponse,
     UpsertRequest,
     UpsertResponse,
 )
+from datastore.datastore import shutdown_datastore_thread_pools
 from datastore.factory import get_datastore
+from services.embedding_provider import get_embedding_provider
 from services.file import get_document_from_file
+from services.jobs import (
+    JOB_PENDING,
+    JOB_UPSERT,
+    JOB_UPSERT_FILE,
+    get_job_queue,
+    start_job_workers,
+    stop_job_workers,
+)
+from services.chunks import shutdown_chunking_pool
+from services.metrics import (
+    CONTENT_TYPE,
+    REQUESTS,
+    REQUESTS_IN_FLIGHT,
+    REQUEST_SECONDS,
+    render_metrics,
+)
+from services.openai import close_aiosession
+from services.query_cache import set_query_cache_endpoint
 
 from models.models import DocumentMetadata, Source
 
@@ -44,13 +77,57 @@ sub_app = FastAPI(
 app.mount("/sub", sub_app)
 
 
+def get_route_path(routes, scope, prefix: str = "") -> str:
+    # Label requests by route template rather than raw path, so that /jobs/{job_id} is a single series
+    for route in routes:
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            if isinstance(route, Mount) and route.routes:
+                return get_route_path(
+                    route.routes, {**scope, **child_scope}, prefix + route.path
+                )
+            return prefix + route.path
+    return "unmatched"
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    path = get_route_path(app.routes, request.scope)
+    status = 500
+    with REQUESTS_IN_FLIGHT.track_in_progress(path=path), REQUEST_SECONDS.time(
+        method=request.method, path=path
+    ):
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            REQUESTS.inc(method=request.method, path=path, status=str(status))
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
+
+
+def get_job_queue_or_400():
+    queue = get_job_queue()
+    if queue is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Background upserts are disabled, set INGEST_JOBS_PATH to enable them",
+        )
+    return queue
+
+
 @app.post(
     "/upsert-file",
-    response_model=UpsertResponse,
+    response_model=Union[UpsertResponse, JobResponse],
 )
 async def upsert_file(
     file: UploadFile = File(...),
     metadata: Optional[str] = Form(None),
+    background: bool = False,
 ):
     try:
         metadata_obj = (
@@ -61,6 +138,15 @@ async def upsert_file(
     except:
         metadata_obj = DocumentMetadata(source=Source.file)
 
+    if background:
+        queue = get_job_queue_or_400()
+        job_id = await queue.enqueue(
+            JOB_UPSERT_FILE,
+            {"metadata": metadata_obj.dict(), "mimetype": file.content_type},
+            file=await file.read(),
+        )
+        return JobResponse(id=job_id, status=JOB_PENDING)
+
     document = await get_document_from_file(file, metadata_obj)
 
     try:
@@ -73,11 +159,17 @@ async def upsert_file(
 
 @app.post(
     "/upsert",
-    response_model=UpsertResponse,
+    response_model=Union[UpsertResponse, JobResponse],
 )
 async def upsert(
     request: UpsertRequest = Body(...),
+    background: bool = False,
 ):
+    if background:
+        queue = get_job_queue_or_400()
+        job_id = await queue.enqueue(JOB_UPSERT, json.loads(request.json()))
+        return JobResponse(id=job_id, status=JOB_PENDING)
+
     try:
         ids = await datastore.upsert(request.documents)
         return UpsertResponse(ids=ids)
@@ -86,6 +178,17 @@ async def upsert(
         raise HTTPException(status_code=500, detail="Internal Service Error")
 
 
+@app.get(
+    "/jobs/{job_id}",
+    response_model=JobResponse,
+)
+async def get_job(job_id: str):
+    job = await get_job_queue_or_400().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobResponse(**job)
+
+
 @app.post(
     "/query",
     response_model=QueryResponse,
@@ -93,6 +196,7 @@ async def upsert(
 async def query_main(
     request: QueryRequest = Body(...),
 ):
+    set_query_cache_endpoint("/query")
     try:
         results = await datastore.query(
             request.queries,
@@ -112,6 +216,7 @@ async def query_main(
 async def query(
     request: QueryRequest = Body(...),
 ):
+    set_query_cache_endpoint("/sub/query")
     try:
         results = await datastore.query(
             request.queries,
@@ -149,7 +254,18 @@ async def delete(
 @app.on_event("startup")
 async def startup():
     global datastore
+    # Load the embedding model up front, failing early if it does not fit EMBEDDING_DIMENSION
+    get_embedding_provider()
     datastore = await get_datastore()
+    start_job_workers(datastore.upsert)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stop_job_workers()
+    await close_aiosession()
+    shutdown_chunking_pool()
+    shutdown_datastore_thread_pools()
 
 
 def start():
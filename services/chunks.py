@@ -1,11 +1,22 @@
-from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+import asyncio
+import hashlib
+import itertools
+import json
+import multiprocessing
+import re
 import uuid
 import os
 from models.models import Document, DocumentChunk, DocumentChunkMetadata
 
+import numpy as np
 import tiktoken
 
-from services.openai import get_embeddings
+from services.embedding_cache import get_embeddings_with_cache
+from services.embedding_profile import embedding_profile
+from services.embedding_provider import get_embedding_provider
+from services.metrics import CHUNKS, STAGE_ERRORS, STAGE_SECONDS
 
 # Global variables
 tokenizer = tiktoken.get_encoding(
@@ -16,8 +27,21 @@ tokenizer = tiktoken.get_encoding(
 CHUNK_SIZE = 200  # The target size of each text chunk in tokens
 MIN_CHUNK_SIZE_CHARS = 350  # The minimum size of each text chunk in characters
 MIN_CHUNK_LENGTH_TO_EMBED = 5  # Discard chunks shorter than this
-EMBEDDINGS_BATCH_SIZE = int(os.environ.get("OPENAI_EMBEDDING_BATCH_SIZE", 128))  # The number of embeddings to request at a time
-MAX_NUM_CHUNKS = 10000  # The maximum number of chunks to generate from a text
+EMBEDDINGS_BATCH_SIZE = int(os.environ.get("OPENAI_EMBEDDING_BATCH_SIZE", 2048))  # The maximum number of embeddings to request at a time
+EMBEDDINGS_BATCH_TOKENS = int(os.environ.get("OPENAI_EMBEDDING_BATCH_TOKENS", 100000))  # The maximum number of tokens to embed in a single request
+EMBEDDINGS_MAX_CONCURRENCY = int(os.environ.get("OPENAI_EMBEDDING_MAX_CONCURRENCY", 8))  # The number of embedding requests in flight at a time
+CHUNKING_SEGMENT_CHARS = int(os.environ.get("CHUNKING_SEGMENT_CHARS", 65536))  # The number of characters of a text tokenized at a time
+UPSERT_MAX_CHUNKS_IN_MEMORY = int(os.environ.get("UPSERT_MAX_CHUNKS_IN_MEMORY", 10000))  # The maximum number of chunks held in memory by an upsert, across the batches being chunked, embedded and written
+UPSERT_PIPELINE_DEPTH = int(os.environ.get("UPSERT_PIPELINE_DEPTH", 1))  # The number of batches queued between the chunking, embedding and writing stages of an upsert
+CHUNKING_PROCESSES = int(os.environ.get("CHUNKING_PROCESSES", 0))  # The number of worker processes used to chunk large upserts, 0 to chunk in a thread
+CHUNKING_PROCESS_MIN_DOCUMENTS = int(os.environ.get("CHUNKING_PROCESS_MIN_DOCUMENTS", 32))  # The minimum number of documents for which the worker processes are used
+
+# The number of chunks in each batch of the upsert pipeline. A batch can be in each of the three stages and in each of
+# the two queues between them, so the batches are sized for all of those in flight to hold UPSERT_MAX_CHUNKS_IN_MEMORY chunks
+UPSERT_BATCH_CHUNKS = max(1, UPSERT_MAX_CHUNKS_IN_MEMORY // (2 * UPSERT_PIPELINE_DEPTH + 3))
+
+# The pool of worker processes, created on first use
+_chunking_pool: Optional[ProcessPoolExecutor] = None
 
 
 def get_text_chunks(text: str, chunk_token_size: Optional[int]) -> List[str]:
@@ -31,34 +55,150 @@ def get_text_chunks(text: str, chunk_token_size: Optional[int]) -> List[str]:
     Returns:
         A list of text chunks, each of which is a string of ~CHUNK_SIZE tokens.
     """
-    # Return an empty list if the text is empty or whitespace
-    if not text or text.isspace():
-        return []
+    return [
+        chunk_text
+        for chunk_text, _ in get_text_chunks_with_token_counts(text, chunk_token_size)
+    ]
+
+
+def get_text_chunks_with_token_counts(
+    text: str, chunk_token_size: Optional[int], tokens: Optional[List[int]] = None
+) -> List[Tuple[str, int]]:
+    """
+    Split a text into chunks like get_text_chunks, keeping the number of tokens of each chunk.
+
+    Args:
+        text: The text to split into chunks.
+        chunk_token_size: The target size of each chunk in tokens, or None to use the default CHUNK_SIZE.
+        tokens: The tokens of the text if they are already known, otherwise the text is tokenized.
+
+    Returns:
+        A list of (chunk_text, num_tokens) tuples, where num_tokens is the number of tokens the chunk was cut from.
+    """
+    return list(iter_text_chunks(text, chunk_token_size, tokens))
+
+
+# A space between two letters, which always starts a new token
+_word_boundary = re.compile(r"(?<=[^\W\d_]) (?=[^\W\d_])")
+
+
+def _find_segment_end(text: str) -> Optional[int]:
+    """
+    Find the last position in text at which the text can be split without changing its tokens.
 
-    # Tokenize the text
-    tokens = tokenizer.encode(text, disallowed_special=())
+    The tokenizer never merges characters across a newline followed by a non-whitespace character,
+    or across a space between two letters, so the text on either side of such a position tokenizes
+    the same on its own as it does as part of the whole text.
+    """
+    position = text.rfind("\n", 0, len(text) - 1)
+    while position != -1:
+        if not text[position + 1].isspace():
+            return position + 1
+        position = text.rfind("\n", 0, position)
 
-    # Initialize an empty list of chunks
-    chunks = []
+    word_boundary = None
+    for match in _word_boundary.finditer(text):
+        word_boundary = match.start()
+    return word_boundary
 
+
+def iter_text_segments(
+    text: Union[str, Iterable[str]], segment_chars: int = CHUNKING_SEGMENT_CHARS
+) -> Iterator[str]:
+    """
+    Split a text into segments of about segment_chars characters that can be tokenized independently.
+
+    Args:
+        text: The text, or an iterable of consecutive pieces of a text such as the lines of a file.
+        segment_chars: The target size of each segment in characters.
+
+    Returns:
+        An iterator of segments, whose tokens joined together are the tokens of the whole text.
+        A run of more than 4 * segment_chars characters without any newline or space between words
+        is cut arbitrarily, which may change a few tokens around the cut.
+    """
+    pieces = (
+        (text[i : i + segment_chars] for i in range(0, len(text), segment_chars))
+        if isinstance(text, str)
+        else text
+    )
+    pending = ""
+    for piece in pieces:
+        pending += piece
+        if len(pending) < segment_chars:
+            continue
+        segment_end = _find_segment_end(pending)
+        if segment_end:
+            yield pending[:segment_end]
+            pending = pending[segment_end:]
+        elif len(pending) >= 4 * segment_chars:
+            yield pending
+            pending = ""
+    if pending:
+        yield pending
+
+
+def iter_text_chunks(
+    text: Union[str, Iterable[str]],
+    chunk_token_size: Optional[int],
+    tokens: Optional[List[int]] = None,
+) -> Iterator[Tuple[str, int]]:
+    """
+    Lazily split a text into chunks of ~CHUNK_SIZE tokens, based on punctuation and newline boundaries.
+
+    The text is tokenized one segment at a time and only the tokens of the next couple of chunks are
+    kept in memory, so texts of any size can be chunked in bounded memory.
+
+    Args:
+        text: The text to split into chunks, or an iterable of consecutive pieces of a text.
+        chunk_token_size: The target size of each chunk in tokens, or None to use the default CHUNK_SIZE.
+        tokens: The tokens of the whole text if they are already known, otherwise the text is tokenized.
+
+    Returns:
+        An iterator of (chunk_text, num_tokens) tuples, where num_tokens is the number of tokens the chunk was cut from.
+    """
     # Use the provided chunk token size or the default one
     chunk_size = chunk_token_size or CHUNK_SIZE
 
-    # Initialize a counter for the number of chunks
-    num_chunks = 0
+    # The tokens of the text, one segment at a time
+    token_segments: Iterator[List[int]] = (
+        iter([tokens])
+        if tokens is not None
+        else (
+            tokenizer.encode(segment, disallowed_special=())
+            for segment in iter_text_segments(text)
+        )
+    )
+
+    # The tokens read so far that have not been consumed, chunks are cut from them by moving a cursor forward
+    buffer: List[int] = []
+    cursor = 0
+    exhausted = False
 
-    # Loop until all tokens are consumed
-    while tokens and num_chunks < MAX_NUM_CHUNKS:
-        # Take the first chunk_size tokens as a chunk
-        chunk = tokens[:chunk_size]
+    while True:
+        # Keep at least two chunks worth of tokens ahead of the cursor, until the text is exhausted
+        while not exhausted and len(buffer) - cursor < 2 * chunk_size:
+            segment_tokens = next(token_segments, None)
+            if segment_tokens is None:
+                exhausted = True
+            else:
+                buffer = buffer[cursor:] + segment_tokens
+                cursor = 0
+
+        # Stop when all tokens are consumed
+        if cursor >= len(buffer):
+            return
+
+        # Take the next chunk_size tokens as a chunk
+        chunk = buffer[cursor : cursor + chunk_size]
 
         # Decode the chunk into text
         chunk_text = tokenizer.decode(chunk)
 
         # Skip the chunk if it is empty or whitespace
         if not chunk_text or chunk_text.isspace():
-            # Remove the tokens corresponding to the chunk text from the remaining tokens
-            tokens = tokens[len(chunk) :]
+            # Move past the tokens corresponding to the chunk text
+            cursor += len(chunk)
             # Continue to the next iteration of the loop
             continue
 
@@ -78,23 +218,16 @@ def get_text_chunks(text: str, chunk_token_size: Optional[int]) -> List[str]:
         # Remove any newline characters and strip any leading or trailing whitespace
         chunk_text_to_append = chunk_text.replace("\n", " ").strip()
 
-        if len(chunk_text_to_append) > MIN_CHUNK_LENGTH_TO_EMBED:
-            # Append the chunk text to the list of chunks
-            chunks.append(chunk_text_to_append)
-
-        # Remove the tokens corresponding to the chunk text from the remaining tokens
-        tokens = tokens[len(tokenizer.encode(chunk_text, disallowed_special=())) :]
-
-        # Increment the number of chunks
-        num_chunks += 1
+        # Count the tokens corresponding to the chunk text. The text is at most chunk_size tokens
+        # long, so this stays linear in the length of the document
+        num_chunk_tokens = len(tokenizer.encode(chunk_text, disallowed_special=()))
 
-    # Handle the remaining tokens
-    if tokens:
-        remaining_text = tokenizer.decode(tokens).replace("\n", " ").strip()
-        if len(remaining_text) > MIN_CHUNK_LENGTH_TO_EMBED:
-            chunks.append(remaining_text)
+        if len(chunk_text_to_append) > MIN_CHUNK_LENGTH_TO_EMBED:
+            # Yield the chunk text
+            yield chunk_text_to_append, num_chunk_tokens
 
-    return chunks
+        # Move past the tokens corresponding to the chunk text
+        cursor += num_chunk_tokens
 
 
 def create_document_chunks(
@@ -111,15 +244,54 @@ def create_document_chunks(
         A tuple of (doc_chunks, doc_id), where doc_chunks is a list of document chunks, each of which is a DocumentChunk object with an id, a document_id, a text, and a metadata attribute,
         and doc_id is the id of the document object, generated if not provided. The id of each chunk is generated from the document id and a sequential number, and the metadata is copied from the document object.
     """
-    # Check if the document text is empty or whitespace
-    if not doc.text or doc.text.isspace():
-        return [], doc.id or str(uuid.uuid4())
+    doc_chunks, _, doc_id = _create_document_chunks_with_token_counts(
+        doc, chunk_token_size
+    )
+    return doc_chunks, doc_id
+
 
+def _create_document_chunks_with_token_counts(
+    doc: Document, chunk_token_size: Optional[int], tokens: Optional[List[int]] = None
+) -> Tuple[List[DocumentChunk], List[int], str]:
+    """
+    Create document chunks like create_document_chunks, also returning the number of tokens of each chunk.
+    """
     # Generate a document id if not provided
     doc_id = doc.id or str(uuid.uuid4())
 
-    # Split the document text into chunks
-    text_chunks = get_text_chunks(doc.text, chunk_token_size)
+    doc_chunks_with_token_counts = list(
+        iter_document_chunks(doc, doc_id, chunk_token_size, tokens)
+    )
+
+    # Return the list of chunks, their token counts and the document id
+    return (
+        [doc_chunk for doc_chunk, _ in doc_chunks_with_token_counts],
+        [num_tokens for _, num_tokens in doc_chunks_with_token_counts],
+        doc_id,
+    )
+
+
+def iter_document_chunks(
+    doc: Document,
+    doc_id: str,
+    chunk_token_size: Optional[int],
+    tokens: Optional[List[int]] = None,
+) -> Iterator[Tuple[DocumentChunk, int]]:
+    """
+    Lazily create the chunks of a document, together with the number of tokens of each chunk.
+
+    Args:
+        doc: The document object to create chunks from.
+        doc_id: The id of the document, used as the document_id of the chunks and as the prefix of their ids.
+        chunk_token_size: The target size of each chunk in tokens, or None to use the default CHUNK_SIZE.
+        tokens: The tokens of the document text if they are already known, otherwise the text is tokenized.
+
+    Returns:
+        An iterator of (doc_chunk, num_tokens) tuples, in the order of the chunks in the document.
+    """
+    # Check if the document text is empty or whitespace
+    if not doc.text or doc.text.isspace():
+        return
 
     metadata = (
         DocumentChunkMetadata(**doc.metadata.__dict__)
@@ -129,75 +301,362 @@ def create_document_chunks(
 
     metadata.document_id = doc_id
 
-    # Initialize an empty list of chunks for this document
-    doc_chunks = []
-
     # Assign each chunk a sequential number and create a DocumentChunk object
-    for i, text_chunk in enumerate(text_chunks):
+    for i, (text_chunk, num_tokens) in enumerate(
+        iter_text_chunks(doc.text, chunk_token_size, tokens)
+    ):
         chunk_id = f"{doc_id}_{i}"
         doc_chunk = DocumentChunk(
             id=chunk_id,
             text=text_chunk,
             metadata=metadata,
         )
-        # Append the chunk object to the list of chunks for this document
-        doc_chunks.append(doc_chunk)
+        yield doc_chunk, num_tokens
 
-    # Return the list of chunks and the document id
-    return doc_chunks, doc_id
 
+def _iter_chunks_of_documents(
+    documents: List[Document], chunk_token_size: Optional[int]
+) -> Iterator[Tuple[str, Iterator[Tuple[DocumentChunk, int]]]]:
+    """
+    Lazily create the chunks of several documents, yielding (doc_id, chunks) for each document.
 
-def get_document_chunks(
+    Documents no longer than CHUNKING_SEGMENT_CHARS are tokenized together in one multi-threaded
+    batch, longer ones are tokenized a segment at a time as their chunks are consumed.
+    """
+    small_documents = [
+        i for i, doc in enumerate(documents) if len(doc.text) <= CHUNKING_SEGMENT_CHARS
+    ]
+    all_tokens = dict(
+        zip(
+            small_documents,
+            tokenizer.encode_batch(
+                [documents[i].text for i in small_documents], disallowed_special=()
+            ),
+        )
+    )
+    for i, doc in enumerate(documents):
+        # Generate a document id if not provided
+        doc_id = doc.id or str(uuid.uuid4())
+        yield doc_id, iter_document_chunks(
+            doc, doc_id, chunk_token_size, all_tokens.pop(i, None)
+        )
+
+
+def _chunk_documents(
     documents: List[Document], chunk_token_size: Optional[int]
-) -> Dict[str, List[DocumentChunk]]:
+) -> List[Tuple[List[DocumentChunk], List[int], str]]:
     """
-    Convert a list of documents into a dictionary from document id to list of document chunks.
+    Create the chunks of several documents, tokenizing small documents together in one batch.
+    """
+    results = []
+    for doc_id, doc_chunks_with_token_counts in _iter_chunks_of_documents(
+        documents, chunk_token_size
+    ):
+        doc_chunks, token_counts = [], []
+        for doc_chunk, num_tokens in doc_chunks_with_token_counts:
+            doc_chunks.append(doc_chunk)
+            token_counts.append(num_tokens)
+        results.append((doc_chunks, token_counts, doc_id))
+    return results
+
+
+def _get_chunking_pool() -> ProcessPoolExecutor:
+    global _chunking_pool
+    if _chunking_pool is None:
+        # Spawn rather than fork, the server process runs threads that a fork would copy mid-flight
+        _chunking_pool = ProcessPoolExecutor(
+            max_workers=CHUNKING_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _chunking_pool
+
+
+def shutdown_chunking_pool() -> None:
+    """
+    Stop the chunking worker processes, if they were started.
+    """
+    global _chunking_pool
+    if _chunking_pool is not None:
+        _chunking_pool.shutdown()
+        _chunking_pool = None
+
+
+async def chunk_documents(
+    documents: List[Document], chunk_token_size: Optional[int]
+) -> List[Tuple[List[DocumentChunk], List[int], str]]:
+    """
+    Create the chunks of documents without blocking the event loop.
+
+    Documents are chunked in a worker thread, or split across CHUNKING_PROCESSES worker processes
+    when there are at least CHUNKING_PROCESS_MIN_DOCUMENTS of them.
 
     Args:
-        documents: The list of documents to convert.
+        documents: The list of documents to chunk.
         chunk_token_size: The target size of each chunk in tokens, or None to use the default CHUNK_SIZE.
 
     Returns:
-        A dictionary mapping each document id to a list of document chunks, each of which is a DocumentChunk object
-        with text, metadata, and embedding attributes.
+        A list of (doc_chunks, token_counts, doc_id) tuples, one per document and in the same order.
     """
-    # Initialize an empty dictionary of lists of chunks
-    chunks: Dict[str, List[DocumentChunk]] = {}
+    loop = asyncio.get_running_loop()
+    if CHUNKING_PROCESSES <= 0 or len(documents) < CHUNKING_PROCESS_MIN_DOCUMENTS:
+        return await loop.run_in_executor(None, _chunk_documents, documents, chunk_token_size)
+
+    # Give each worker process one contiguous slice of the documents
+    pool = _get_chunking_pool()
+    slice_size = -(-len(documents) // CHUNKING_PROCESSES)
+    results = await asyncio.gather(
+        *[
+            loop.run_in_executor(
+                pool, _chunk_documents, documents[i : i + slice_size], chunk_token_size
+            )
+            for i in range(0, len(documents), slice_size)
+        ]
+    )
+    return [result for slice_results in results for result in slice_results]
 
-    # Initialize an empty list of all chunks
-    all_chunks: List[DocumentChunk] = []
 
-    # Loop over each document and create chunks
-    for doc in documents:
-        doc_chunks, doc_id = create_document_chunks(doc, chunk_token_size)
+def get_embedding_batches(
+    token_counts: List[int],
+    max_batch_tokens: int = EMBEDDINGS_BATCH_TOKENS,
+    max_batch_size: int = EMBEDDINGS_BATCH_SIZE,
+) -> List[Tuple[int, int]]:
+    """
+    Pack consecutive texts into embedding requests by their total number of tokens.
 
-        # Append the chunks for this document to the list of all chunks
-        all_chunks.extend(doc_chunks)
+    Args:
+        token_counts: The number of tokens of each text, in order.
+        max_batch_tokens: The maximum total number of tokens of a batch.
+        max_batch_size: The maximum number of texts in a batch.
 
-        # Add the list of chunks for this document to the dictionary with the document id as the key
-        chunks[doc_id] = doc_chunks
+    Returns:
+        A list of (start, end) index ranges, one per batch. A text larger than max_batch_tokens gets a batch of its own.
+    """
+    batches: List[Tuple[int, int]] = []
+    start, batch_tokens = 0, 0
+    for i, num_tokens in enumerate(token_counts):
+        if i > start and (
+            batch_tokens + num_tokens > max_batch_tokens or i - start >= max_batch_size
+        ):
+            batches.append((start, i))
+            start, batch_tokens = i, 0
+        batch_tokens += num_tokens
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+    return batches
+
+
+def _get_content_hash(*parts: str) -> str:
+    # Chunks embedded by another model, or stored with another dimension, must not match
+    provider = get_embedding_provider()
+    content = "\0".join(
+        (provider.model_name, str(embedding_profile.dimension), *parts)
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
 
-    # Check if there are no chunks
-    if not all_chunks:
-        return {}
 
-    # Get all the embeddings for the document chunks in batches, using get_embeddings
-    embeddings: List[List[float]] = []
-    for i in range(0, len(all_chunks), EMBEDDINGS_BATCH_SIZE):
-        # Get the text of the chunks in the current batch
-        batch_texts = [
-            chunk.text for chunk in all_chunks[i : i + EMBEDDINGS_BATCH_SIZE]
-        ]
+def get_chunk_hash(chunk: DocumentChunk) -> str:
+    """
+    Hash the content of a chunk, its text and metadata, together with the embedding model and dimension.
+    """
+    return _get_content_hash(chunk.text, chunk.metadata.json(sort_keys=True))
+
+
+def get_document_hash(doc: Document, chunk_token_size: Optional[int]) -> str:
+    """
+    Hash the content of a document together with the chunk size and the embedding model and dimension.
+
+    Two uploads with the same document hash produce the same chunks and embeddings.
+    """
+    metadata = doc.metadata.json(sort_keys=True) if doc.metadata is not None else ""
+    return _get_content_hash(str(chunk_token_size or CHUNK_SIZE), metadata, doc.text)
+
+
+def _take_chunks(
+    chunks: Iterator[Tuple[str, Optional[DocumentChunk], int]], max_chunks: int
+) -> List[Tuple[str, Optional[DocumentChunk], int]]:
+    """
+    Take items from chunks until max_chunks chunks are taken or chunks is exhausted.
+    """
+    items = []
+    num_chunks = 0
+    for item in chunks:
+        items.append(item)
+        if item[1] is not None:
+            num_chunks += 1
+            if num_chunks >= max_chunks:
+                break
+    return items
 
-        # Get the embeddings for the batch texts
-        batch_embeddings = get_embeddings(batch_texts)
 
-        # Append the batch embeddings to the embeddings list
-        embeddings.extend(batch_embeddings)
+async def _embed_chunks(chunks: List[DocumentChunk], token_counts: List[int]) -> None:
+    """
+    Embed chunks in batches packed by token count, reusing cached embeddings where possible.
+    """
+    # Batches are embedded concurrently, with at most EMBEDDINGS_MAX_CONCURRENCY requests in flight
+    semaphore = asyncio.Semaphore(EMBEDDINGS_MAX_CONCURRENCY)
+
+    async def embed_batch(batch_texts: List[str], batch_token_counts: List[int]) -> List[List[float]]:
+        async with semaphore:
+            return await get_embeddings_with_cache(batch_texts, token_counts=batch_token_counts)
+
+    batch_results = await asyncio.gather(
+        *[
+            embed_batch([chunk.text for chunk in chunks[start:end]], token_counts[start:end])
+            for start, end in get_embedding_batches(token_counts)
+        ]
+    )
+
+    # Stack the batch results, which asyncio.gather returns in the order of the batches, into a single
+    # float32 matrix fitted to the embedding profile. Each chunk gets a row of it, a view that shares the matrix's buffer
+    embeddings = embedding_profile.apply(
+        np.concatenate(
+            [np.asarray(batch_embeddings, dtype=np.float32) for batch_embeddings in batch_results]
+        )
+    )
 
     # Update the document chunk objects with the embeddings
-    for i, chunk in enumerate(all_chunks):
-        # Assign the embedding from the embeddings list to the chunk object
+    for i, chunk in enumerate(chunks):
+        # Assign the embedding row to the chunk object
         chunk.embedding = embeddings[i]
 
+
+async def iter_document_chunk_batches(
+    documents: List[Document],
+    chunk_token_size: Optional[int],
+    max_chunks: int = UPSERT_BATCH_CHUNKS,
+    skip_chunk: Optional[Callable[[DocumentChunk], bool]] = None,
+) -> AsyncIterator[Dict[str, List[DocumentChunk]]]:
+    """
+    Chunk and embed documents in batches of at most max_chunks chunks, so that memory stays bounded however large the documents are.
+
+    Chunking and embedding run as two pipelined stages, connected by queues of UPSERT_PIPELINE_DEPTH batches:
+    while the caller writes a batch, the next one is embedded and the one after it is chunked.
+    Chunks are created lazily in a worker thread, one batch at a time. When the documents are chunked
+    in worker processes (see chunk_documents), all of them are chunked up front and only the
+    embedding is batched.
+
+    Args:
+        documents: The list of documents to convert.
+        chunk_token_size: The target size of each chunk in tokens, or None to use the default CHUNK_SIZE.
+        max_chunks: The maximum number of chunks in a batch.
+        skip_chunk: Called with every chunk, after its chunk_hash is set. Chunks for which it returns True are
+            neither embedded nor yielded.
+
+    Returns:
+        An async iterator of dictionaries mapping document ids to lists of embedded document chunks.
+        The chunks of a large document can be spread over consecutive batches, and documents without
+        chunks are mapped to an empty list.
+    """
+    loop = asyncio.get_running_loop()
+    # Each queue holds batches, then None once its stage is done, or the exception that stopped the pipeline
+    chunked: asyncio.Queue = asyncio.Queue(maxsize=UPSERT_PIPELINE_DEPTH)
+    embedded: asyncio.Queue = asyncio.Queue(maxsize=UPSERT_PIPELINE_DEPTH)
+
+    async def chunk_stage() -> None:
+        try:
+            # Flatten the chunks of all documents into (doc_id, chunk, num_tokens) items, with a leading
+            # (doc_id, None, 0) item for each document so that documents without chunks are reported too
+            all_chunks: Iterator[Tuple[str, Optional[DocumentChunk], int]]
+            if CHUNKING_PROCESSES > 0 and len(documents) >= CHUNKING_PROCESS_MIN_DOCUMENTS:
+                with STAGE_SECONDS.time(STAGE_ERRORS, stage="chunk"):
+                    chunked_documents = await chunk_documents(documents, chunk_token_size)
+                all_chunks = (
+                    item
+                    for doc_chunks, token_counts, doc_id in chunked_documents
+                    for item in itertools.chain(
+                        [(doc_id, None, 0)],
+                        ((doc_id, chunk, n) for chunk, n in zip(doc_chunks, token_counts)),
+                    )
+                )
+            else:
+                all_chunks = (
+                    item
+                    for doc_id, doc_chunks in _iter_chunks_of_documents(documents, chunk_token_size)
+                    for item in itertools.chain(
+                        [(doc_id, None, 0)],
+                        ((doc_id, chunk, n) for chunk, n in doc_chunks),
+                    )
+                )
+
+            while True:
+                # Create the next batch of chunks off the event loop
+                with STAGE_SECONDS.time(STAGE_ERRORS, stage="chunk"):
+                    items = await loop.run_in_executor(None, _take_chunks, all_chunks, max_chunks)
+                if not items:
+                    break
+
+                chunks: Dict[str, List[DocumentChunk]] = {}
+                batch_chunks: List[DocumentChunk] = []
+                batch_token_counts: List[int] = []
+                for doc_id, chunk, num_tokens in items:
+                    doc_chunks = chunks.setdefault(doc_id, [])
+                    if chunk is not None:
+                        chunk.chunk_hash = get_chunk_hash(chunk)
+                        if skip_chunk is not None and skip_chunk(chunk):
+                            continue
+                        doc_chunks.append(chunk)
+                        batch_chunks.append(chunk)
+                        batch_token_counts.append(num_tokens)
+                CHUNKS.inc(len(batch_chunks))
+                await chunked.put((chunks, batch_chunks, batch_token_counts))
+        except Exception as e:
+            await chunked.put(e)
+        else:
+            await chunked.put(None)
+
+    async def embed_stage() -> None:
+        try:
+            while True:
+                batch = await chunked.get()
+                if batch is None or isinstance(batch, Exception):
+                    await embedded.put(batch)
+                    return
+                chunks, batch_chunks, batch_token_counts = batch
+                if batch_chunks:
+                    await _embed_chunks(batch_chunks, batch_token_counts)
+                await embedded.put(chunks)
+        except Exception as e:
+            await embedded.put(e)
+
+    stages = [asyncio.ensure_future(chunk_stage()), asyncio.ensure_future(embed_stage())]
+    try:
+        while True:
+            chunks = await embedded.get()
+            if chunks is None:
+                return
+            if isinstance(chunks, Exception):
+                raise chunks
+            # The stages keep working on the next batches while the caller handles this one
+            yield chunks
+    finally:
+        # Stop the stages if the caller stops early or fails
+        for stage in stages:
+            stage.cancel()
+
+
+async def get_document_chunks(
+    documents: List[Document], chunk_token_size: Optional[int]
+) -> Dict[str, List[DocumentChunk]]:
+    """
+    Convert a list of documents into a dictionary from document id to list of document chunks.
+
+    Args:
+        documents: The list of documents to convert.
+        chunk_token_size: The target size of each chunk in tokens, or None to use the default CHUNK_SIZE.
+
+    Returns:
+        A dictionary mapping each document id to a list of document chunks, each of which is a DocumentChunk object
+        with text, metadata, and embedding attributes.
+    """
+    # Initialize an empty dictionary of lists of chunks
+    chunks: Dict[str, List[DocumentChunk]] = {}
+
+    async for batch in iter_document_chunk_batches(documents, chunk_token_size):
+        for doc_id, doc_chunks in batch.items():
+            chunks.setdefault(doc_id, []).extend(doc_chunks)
+
+    # Check if there are no chunks
+    if not any(chunks.values()):
+        return {}
+
     return chunks
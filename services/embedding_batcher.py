@@ -0,0 +1,114 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+
+from services.embedding_provider import get_embedding_provider
+
+# How long to wait for more query texts before sending a batch, in milliseconds
+QUERY_EMBEDDING_BATCH_WAIT_MS = float(os.environ.get("QUERY_EMBEDDING_BATCH_WAIT_MS", 5))
+# The maximum number of query texts sent in a single embeddings request
+QUERY_EMBEDDING_BATCH_MAX_SIZE = int(os.environ.get("QUERY_EMBEDDING_BATCH_MAX_SIZE", 64))
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces texts from concurrent callers into shared embeddings requests.
+
+    Texts are collected until max_wait_ms has passed since the first pending text, or until
+    max_batch_size texts are pending, and are then embedded with a single call to embed.
+    Each caller receives the embeddings of its own texts, or the exception raised by the request.
+    If every caller of a batch passes num_tokens, embed is called with their total as num_tokens.
+    """
+
+    def __init__(
+        self,
+        embed: Callable[..., Awaitable[List[List[float]]]],
+        max_wait_ms: float = QUERY_EMBEDDING_BATCH_WAIT_MS,
+        max_batch_size: int = QUERY_EMBEDDING_BATCH_MAX_SIZE,
+    ):
+        self._embed = embed
+        self.max_wait_ms = max_wait_ms
+        self.max_batch_size = max_batch_size
+        self._pending: List[Tuple[List[str], Optional[int], asyncio.Future]] = []
+        self._pending_size = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Keep references to in-flight requests so they are not garbage collected
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def embed(
+        self, texts: List[str], num_tokens: Optional[int] = None
+    ) -> List[List[float]]:
+        """
+        Embed texts as part of the next batch.
+
+        Args:
+            texts: The list of texts to embed.
+            num_tokens: The total number of tokens of texts, if it is already known.
+
+        Returns:
+            A list of embeddings, each of which is a list of floats, in the same order as texts.
+        """
+        if not texts:
+            return []
+
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Pending texts and timers belong to the loop they were created on
+            self._pending, self._pending_size, self._timer = [], 0, None
+            self._loop = loop
+
+        future = loop.create_future()
+        self._pending.append((texts, num_tokens, future))
+        self._pending_size += len(texts)
+
+        if self._pending_size >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        pending, self._pending, self._pending_size = self._pending, [], 0
+        if pending:
+            task = asyncio.ensure_future(self._send(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(
+        self, pending: List[Tuple[List[str], Optional[int], asyncio.Future]]
+    ) -> None:
+        texts = [text for batch_texts, _, _ in pending for text in batch_texts]
+        token_counts = [num_tokens for _, num_tokens, _ in pending]
+        try:
+            if None in token_counts:
+                embeddings = await self._embed(texts)
+            else:
+                embeddings = await self._embed(texts, num_tokens=sum(token_counts))
+        except Exception as e:
+            for _, _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Fan the embeddings back out to the callers, in the order their texts were added
+        offset = 0
+        for batch_texts, _, future in pending:
+            if not future.done():
+                future.set_result(embeddings[offset : offset + len(batch_texts)])
+            offset += len(batch_texts)
+
+
+async def _embed_with_provider(
+    texts: List[str], num_tokens: Optional[int] = None
+) -> List[List[float]]:
+    return await get_embedding_provider().embed(texts, num_tokens=num_tokens)
+
+
+# Batches the query embeddings of concurrent DataStore.query calls
+query_embedding_batcher = EmbeddingBatcher(_embed_with_provider)
@@ -0,0 +1,257 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+from services.embedding_provider import get_embedding_provider
+from services.metrics import (
+    EMBEDDED_TOKENS,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_CACHE_ENTRIES,
+    EMBEDDING_CACHE_LOOKUPS,
+    STAGE_ERRORS,
+    STAGE_SECONDS,
+)
+from services.openai import tokenizer
+
+# Path of the SQLite file used to persist embeddings, the cache is disabled if not set
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH")
+# The maximum number of embeddings to keep before evicting the least recently used ones
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 100000))
+
+# The number of cache hits whose access times are kept in memory before they are written together
+ACCESS_TIME_FLUSH_SIZE = 1000
+
+
+class EmbeddingCache:
+    """
+    A persistent, content-addressed cache of embeddings.
+
+    Embeddings are keyed on a hash of the model name and the text, stored as float32 blobs in
+    a local SQLite database and evicted in least recently used order once max_entries is exceeded.
+    The access times of hits are written in batches, before evictions or once ACCESS_TIME_FLUSH_SIZE
+    of them are pending, rather than with a write per lookup. Lookups and stores are blocking, see
+    get_embeddings_with_cache for how they are kept off the event loop.
+    """
+
+    def __init__(self, path: str, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # The access times of hits not written yet, by key
+        self._accessed: Dict[bytes, int] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key BLOB PRIMARY KEY,
+                embedding BLOB NOT NULL,
+                last_access INTEGER NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access_idx ON embeddings (last_access)"
+        )
+        self._conn.commit()
+        (self._size,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        EMBEDDING_CACHE_ENTRIES.set(self._size)
+
+    @staticmethod
+    def _key(model: str, text: str) -> bytes:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest()
+
+    def _flush_access_times(self) -> None:
+        """
+        Write the pending access times, the caller holds the lock and commits.
+        """
+        if self._accessed:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(now, key) for key, now in self._accessed.items()],
+            )
+            self._accessed.clear()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Look up the embeddings of texts, returning None for each text that is not cached.
+        """
+        keys = [self._key(model, text) for text in texts]
+        found: Dict[bytes, bytes] = {}
+        with self._lock:
+            # Query in slices to stay below SQLite's limit on the number of bound parameters
+            for i in range(0, len(keys), 500):
+                batch = keys[i : i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, embedding FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                found.update(rows)
+            # Counted under the lock, lookups run concurrently in worker threads
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+            if found:
+                now = time.time_ns()
+                self._accessed.update((key, now) for key in found)
+                if len(self._accessed) >= ACCESS_TIME_FLUSH_SIZE:
+                    self._flush_access_times()
+                    self._conn.commit()
+
+        results = [
+            np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None
+            for key in keys
+        ]
+        EMBEDDING_CACHE_LOOKUPS.inc(hits, result="hit")
+        EMBEDDING_CACHE_LOOKUPS.inc(len(results) - hits, result="miss")
+        return results
+
+    def put_many(
+        self, model: str, texts: List[str], embeddings: List[List[float]]
+    ) -> None:
+        """
+        Store the embeddings of texts, evicting the least recently used entries if the cache is full.
+        """
+        now = time.time_ns()
+        rows = {
+            self._key(model, text): np.asarray(embedding, dtype=np.float32).tobytes()
+            for text, embedding in zip(texts, embeddings)
+        }
+        keys = list(rows)
+        with self._lock:
+            # Keep a running count of the entries, rather than counting them after every store
+            existing = 0
+            for i in range(0, len(keys), 500):
+                batch = keys[i : i + 500]
+                (count,) = self._conn.execute(
+                    f"SELECT COUNT(*) FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchone()
+                existing += count
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, embedding, last_access) VALUES (?, ?, ?)",
+                [(key, embedding, now) for key, embedding in rows.items()],
+            )
+            self._size += len(rows) - existing
+            if self._size > self.max_entries:
+                # Evict by up to date access times
+                self._flush_access_times()
+                deleted = self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                    (self._size - self.max_entries,),
+                ).rowcount
+                self._size -= deleted
+            self._conn.commit()
+        EMBEDDING_CACHE_ENTRIES.set(self._size)
+
+    def clear(self) -> None:
+        """
+        Remove every embedding from the cache and reset the counters.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._accessed.clear()
+            self._size = 0
+        EMBEDDING_CACHE_ENTRIES.set(0)
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Return the hit and miss counters of the cache.
+        """
+        with self._lock:
+            hits, misses, entries = self.hits, self.misses, self._size
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    Return the process wide embedding cache, or None if EMBEDDING_CACHE_PATH is not set.
+    """
+    global _embedding_cache
+    if _embedding_cache is None and EMBEDDING_CACHE_PATH:
+        logger.info(f"Using embedding cache at {EMBEDDING_CACHE_PATH}")
+        _embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+    return _embedding_cache
+
+
+async def get_embeddings_with_cache(
+    texts: List[str],
+    embed: Optional[Callable[..., Awaitable[List[List[float]]]]] = None,
+    token_counts: Optional[List[int]] = None,
+) -> List[List[float]]:
+    """
+    Embed texts with the configured embedding provider, reusing cached embeddings and only embedding cache misses.
+
+    Args:
+        texts: The list of texts to embed.
+        embed: The function used to embed cache misses, or None to call the embedding provider directly.
+            It is called with the texts to embed and their total number of tokens as num_tokens.
+        token_counts: The number of tokens of each text if they are already known, otherwise the
+            texts to embed are tokenized once here and not again by the embedding provider.
+
+    Returns:
+        A list of embeddings, each of which is a list of floats, in the same order as texts.
+    """
+    provider = get_embedding_provider()
+    embed_texts = embed or provider.embed
+    text_tokens = dict(zip(texts, token_counts)) if token_counts is not None else None
+
+    async def embed(texts: List[str]) -> List[List[float]]:
+        if text_tokens is None:
+            num_tokens = sum(len(tokens) for tokens in tokenizer.encode_ordinary_batch(texts))
+        else:
+            num_tokens = sum(text_tokens[text] for text in texts)
+        EMBEDDING_BATCH_SIZE.observe(len(texts))
+        with STAGE_SECONDS.time(STAGE_ERRORS, stage="embed"):
+            embeddings = await embed_texts(texts, num_tokens=num_tokens)
+        # Only the tokens sent to the provider are counted, not those of cache hits
+        EMBEDDED_TOKENS.inc(num_tokens)
+        return embeddings
+
+    cache = get_embedding_cache()
+    if cache is None:
+        return await embed(texts)
+
+    # SQLite calls block, keep them off the event loop
+    loop = asyncio.get_running_loop()
+    model = provider.model_name
+    embeddings = await loop.run_in_executor(None, cache.get_many, model, texts)
+
+    # Embed each distinct missing text only once
+    missing_texts = list(
+        dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None)
+    )
+    if missing_texts:
+        new_embeddings = dict(zip(missing_texts, await embed(missing_texts)))
+        await loop.run_in_executor(
+            None, cache.put_many, model, missing_texts, list(new_embeddings.values())
+        )
+        embeddings = [
+            embedding if embedding is not None else new_embeddings[text]
+            for text, embedding in zip(texts, embeddings)
+        ]
+
+    logger.debug(f"Embedding cache: {cache.stats()}")
+    return embeddings  # type: ignore
@@ -0,0 +1,84 @@
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+# The number of dimensions stored and searched, embeddings wider than this are truncated
+EMBEDDING_DIMENSION = int(os.environ.get("EMBEDDING_DIMENSION", 1536))
+# The element type of stored vectors, one of float32 or float16, where the datastore supports it
+EMBEDDING_DTYPE = os.environ.get("EMBEDDING_DTYPE", "float32")
+# The similarity used to compare vectors, one of cosine, ip (inner product) or l2
+EMBEDDING_METRIC = os.environ.get("EMBEDDING_METRIC", "cosine")
+
+SUPPORTED_DTYPES = ("float32", "float16")
+SUPPORTED_METRICS = ("cosine", "ip", "l2")
+
+
+@dataclass(frozen=True)
+class EmbeddingProfile:
+    """
+    The shape, storage type and similarity metric of the embeddings, shared by every datastore.
+
+    Datastores read the profile when they create their collections and indexes, so that all of
+    them agree with each other and with the embeddings produced by apply.
+    """
+
+    dimension: int = EMBEDDING_DIMENSION
+    dtype: str = EMBEDDING_DTYPE
+    metric: str = EMBEDDING_METRIC
+
+    def __post_init__(self):
+        if self.dimension <= 0:
+            raise ValueError(f"Embedding dimension must be positive, got {self.dimension}")
+        if self.dtype not in SUPPORTED_DTYPES:
+            raise ValueError(
+                f"Unsupported embedding dtype: {self.dtype}. "
+                f"Try one of the following: {', '.join(SUPPORTED_DTYPES)}"
+            )
+        if self.metric not in SUPPORTED_METRICS:
+            raise ValueError(
+                f"Unsupported embedding metric: {self.metric}. "
+                f"Try one of the following: {', '.join(SUPPORTED_METRICS)}"
+            )
+
+    @property
+    def numpy_dtype(self) -> np.dtype:
+        """
+        The NumPy type of stored vectors.
+        """
+        return np.dtype(self.dtype)
+
+    def apply(self, embeddings) -> np.ndarray:
+        """
+        Fit a batch of embeddings to the profile.
+
+        Embeddings wider than the profile are truncated to its dimension and renormalized to unit
+        length, which keeps cosine and inner product scores meaningful for models trained to
+        support shortened embeddings.
+
+        Args:
+            embeddings: A sequence of embeddings, or a 2-D array with one embedding per row.
+
+        Returns:
+            A (len(embeddings), dimension) float32 matrix.
+        """
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.size == 0:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        if matrix.ndim != 2:
+            raise ValueError("Expected a batch of embeddings")
+        if matrix.shape[1] < self.dimension:
+            raise ValueError(
+                f"Embeddings have {matrix.shape[1]} dimensions, "
+                f"fewer than the configured EMBEDDING_DIMENSION of {self.dimension}"
+            )
+        if matrix.shape[1] == self.dimension:
+            return matrix
+
+        matrix = np.ascontiguousarray(matrix[:, : self.dimension])
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+embedding_profile = EmbeddingProfile()
@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import os
+import re
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+import numpy as np
+from loguru import logger
+
+from services.embedding_profile import EMBEDDING_DIMENSION
+from services.openai import aget_embeddings, get_embedding_model_name
+
+# The dimension of OpenAI's ada embeddings
+OPENAI_EMBEDDING_DIMENSION = 1536
+
+LOCAL_EMBEDDING_MODEL = os.environ.get(
+    "LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"
+)
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.environ.get("LOCAL_EMBEDDING_BATCH_SIZE", 64))
+LOCAL_EMBEDDING_DEVICE = os.environ.get("LOCAL_EMBEDDING_DEVICE", "cpu")
+
+# Defaults to the profile dimension so hashed embeddings fit the configured indexes
+HASH_EMBEDDING_DIMENSION = int(
+    os.environ.get("HASH_EMBEDDING_DIMENSION", EMBEDDING_DIMENSION)
+)
+
+
+class EmbeddingProvider(ABC):
+    """
+    A backend that turns texts into embeddings.
+    """
+
+    @property
+    @abstractmethod
+    def model_name(self) -> str:
+        """
+        The name of the model, used to tell apart the embeddings of different models.
+        """
+        raise NotImplementedError
+
+    @property
+    @abstractmethod
+    def dimension(self) -> int:
+        """
+        The number of dimensions of the embeddings.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def embed(
+        self, texts: List[str], num_tokens: Optional[int] = None
+    ) -> List[List[float]]:
+        """
+        Embed texts, returning one embedding per text in the same order.
+
+        num_tokens is the total number of tokens of the texts when the caller already counted them,
+        for providers that need it.
+        """
+        raise NotImplementedError
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """
+    Embeds texts with OpenAI's ada model, or the configured Azure OpenAI deployment.
+    """
+
+    @property
+    def model_name(self) -> str:
+        return get_embedding_model_name()
+
+    @property
+    def dimension(self) -> int:
+        return OPENAI_EMBEDDING_DIMENSION
+
+    async def embed(
+        self, texts: List[str], num_tokens: Optional[int] = None
+    ) -> List[List[float]]:
+        return await aget_embeddings(texts, num_tokens)
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """
+    Embeds texts on the local CPU with a sentence-transformers model.
+
+    Requires the sentence-transformers package. Encoding runs in a worker thread so that it
+    does not block the event loop, in batches of LOCAL_EMBEDDING_BATCH_SIZE texts.
+    """
+
+    def __init__(
+        self,
+        model_name: str = LOCAL_EMBEDDING_MODEL,
+        batch_size: int = LOCAL_EMBEDDING_BATCH_SIZE,
+        device: str = LOCAL_EMBEDDING_DEVICE,
+    ):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                "The local embedding provider requires sentence-transformers, "
+                "install it with `poetry install --extras local-embeddings`"
+            ) from e
+
+        logger.info(f"Loading local embedding model {model_name} on {device}")
+        self._model_name = model_name
+        self._batch_size = batch_size
+        self._model = SentenceTransformer(model_name, device=device)
+
+    @property
+    def model_name(self) -> str:
+        return self._model_name
+
+    @property
+    def dimension(self) -> int:
+        return self._model.get_sentence_embedding_dimension()
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        embeddings: np.ndarray = self._model.encode(
+            texts,
+            batch_size=self._batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+        return embeddings.astype(np.float32).tolist()
+
+    async def embed(
+        self, texts: List[str], num_tokens: Optional[int] = None
+    ) -> List[List[float]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._encode, texts)
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    A deterministic embedder for tests and benchmarks, which needs neither a network nor a model.
+
+    Each lowercased word is hashed to a signed position in a fixed size vector (the hashing trick)
+    and the vector is normalized to unit length, so texts sharing words have similar embeddings.
+    """
+
+    _word_pattern = re.compile(r"\w+")
+
+    def __init__(self, dimension: int = HASH_EMBEDDING_DIMENSION):
+        self._dimension = dimension
+
+    @property
+    def model_name(self) -> str:
+        return f"hashing-{self._dimension}"
+
+    @property
+    def dimension(self) -> int:
+        return self._dimension
+
+    @staticmethod
+    def _hash(word: str) -> int:
+        return int.from_bytes(
+            hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little"
+        )
+
+    def embed_sync(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed texts into a (len(texts), dimension) float32 matrix.
+        """
+        rows, columns, signs = [], [], []
+        for row, text in enumerate(texts):
+            for word in self._word_pattern.findall(text.lower()):
+                h = self._hash(word)
+                rows.append(row)
+                columns.append(h % self._dimension)
+                signs.append(1.0 if (h >> 63) & 1 else -1.0)
+
+        matrix = np.zeros((len(texts), self._dimension), dtype=np.float32)
+        np.add.at(matrix, (np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64)), signs)
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        # Texts without any words get a fixed unit vector rather than a zero vector
+        matrix[norms[:, 0] == 0, 0] = 1.0
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    async def embed(
+        self, texts: List[str], num_tokens: Optional[int] = None
+    ) -> List[List[float]]:
+        return self.embed_sync(texts).tolist()
+
+
+_embedding_provider: Optional[EmbeddingProvider] = None
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """
+    Return the process wide embedding provider selected by the EMBEDDING_PROVIDER environment variable.
+    Raises a ValueError if its embeddings are narrower than EMBEDDING_DIMENSION.
+    """
+    global _embedding_provider
+    if _embedding_provider is not None:
+        return _embedding_provider
+
+    provider = os.environ.get("EMBEDDING_PROVIDER", "openai")
+    match provider:
+        case "openai":
+            embedder: EmbeddingProvider = OpenAIEmbeddingProvider()
+        case "local":
+            embedder = LocalEmbeddingProvider()
+        case "hash":
+            embedder = HashingEmbeddingProvider()
+        case _:
+            raise ValueError(
+                f"Unsupported embedding provider: {provider}. "
+                f"Try one of the following: openai, local, hash"
+            )
+
+    # Embeddings can be truncated to the configured dimension, but not padded to it
+    if embedder.dimension < EMBEDDING_DIMENSION:
+        raise ValueError(
+            f"The {provider} embedding provider ({embedder.model_name}) produces "
+            f"{embedder.dimension}-dimensional embeddings, fewer than the configured "
+            f"EMBEDDING_DIMENSION of {EMBEDDING_DIMENSION}. "
+            f"Set EMBEDDING_DIMENSION={embedder.dimension} or lower."
+        )
+    _embedding_provider = embedder
+    return _embedding_provider
@@ -10,6 +10,7 @@ import pptx
 from loguru import logger
 
 from models.models import Document, DocumentMetadata
+from services.metrics import STAGE_ERRORS, STAGE_SECONDS
 
 
 async def get_document_from_file(
@@ -36,7 +37,9 @@ def extract_text_from_filepath(filepath: str, mimetype: Optional[str] = None) ->
             raise Exception("Unsupported file type")
 
     try:
-        with open(filepath, "rb") as file:
+        with open(filepath, "rb") as file, STAGE_SECONDS.time(
+            STAGE_ERRORS, stage="extract_text"
+        ):
             extracted_text = extract_text_from_file(file, mimetype)
     except Exception as e:
         logger.error(e)
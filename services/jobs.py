@@ -0,0 +1,364 @@
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from models.models import Document, DocumentMetadata
+
+# Path of the SQLite file ingest jobs are persisted to, background upserts are disabled if not set
+INGEST_JOBS_PATH = os.environ.get("INGEST_JOBS_PATH")
+# The number of background workers running ingest jobs concurrently
+INGEST_JOB_WORKERS = int(os.environ.get("INGEST_JOB_WORKERS", 2))
+# The number of times a job is attempted before it is marked as failed
+INGEST_JOB_MAX_ATTEMPTS = int(os.environ.get("INGEST_JOB_MAX_ATTEMPTS", 3))
+# The delay before the first retry of a failed job, doubled after each further attempt
+INGEST_JOB_RETRY_DELAY_SECONDS = float(
+    os.environ.get("INGEST_JOB_RETRY_DELAY_SECONDS", 5)
+)
+
+# How long a claimed job is reserved for its worker, which renews the lease while the job runs.
+# Jobs whose lease expired, because their process stopped, are claimed again by any worker
+INGEST_JOB_LEASE_SECONDS = float(os.environ.get("INGEST_JOB_LEASE_SECONDS", 60))
+
+# How often idle workers look for jobs whose retry delay has passed
+POLL_INTERVAL_SECONDS = 1.0
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+JOB_UPSERT = "upsert"
+JOB_UPSERT_FILE = "upsert-file"
+
+
+class JobQueue:
+    """
+    A durable queue of ingest jobs stored in a local SQLite database.
+
+    Jobs survive restarts: a claimed job is leased to its worker for lease_seconds, and the lease
+    is renewed while the job runs. Jobs whose lease expired, because the process running them
+    stopped, are claimed again by the next worker, in this or another process sharing the file.
+    A job that fails is retried with exponential backoff until it has been attempted
+    max_attempts times.
+
+    The public methods run their SQLite statements in the default executor, off the event loop.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_attempts: int = INGEST_JOB_MAX_ATTEMPTS,
+        retry_delay_seconds: float = INGEST_JOB_RETRY_DELAY_SECONDS,
+        lease_seconds: float = INGEST_JOB_LEASE_SECONDS,
+    ):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_delay_seconds = retry_delay_seconds
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                file BLOB,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                result TEXT,
+                run_after REAL NOT NULL,
+                lease_until REAL NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_status_run_after_idx ON jobs (status, run_after)"
+        )
+        # Queues created before leases have none, their running jobs are claimed again
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "lease_until" not in columns:
+            self._conn.execute(
+                "ALTER TABLE jobs ADD COLUMN lease_until REAL NOT NULL DEFAULT 0"
+            )
+        self._conn.commit()
+        self._job_added = asyncio.Event()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def enqueue(
+        self, kind: str, payload: dict, file: Optional[bytes] = None
+    ) -> str:
+        """
+        Persist a new job and return its id.
+        """
+        job_id = await self._run(self._enqueue, kind, payload, file)
+        self._job_added.set()
+        return job_id
+
+    def _enqueue(self, kind: str, payload: dict, file: Optional[bytes]) -> str:
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, payload, file, status, run_after, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), file, JOB_PENDING, now, now, now),
+            )
+            self._conn.commit()
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        """
+        Return the status of a job, or None if there is no job with this id.
+        """
+        return await self._run(self._get, job_id)
+
+    def _get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, kind, status, attempts, error, result, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["ids"] = json.loads(job.pop("result")) if job["result"] else None
+        return job
+
+    async def claim(self) -> Optional[Dict]:
+        """
+        Lease the oldest job that is due to the caller and return it, or None if no job is due.
+        Due jobs are pending jobs whose retry delay has passed, and running jobs whose lease expired.
+        """
+        return await self._run(self._claim)
+
+    def _claim(self) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            # Take the database write lock first, so that two processes cannot claim the same job
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs interrupted max_attempts times are given up on rather than run again
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, file = NULL, updated_at = ? "
+                    "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                    (
+                        JOB_FAILED,
+                        "Interrupted before it finished",
+                        now,
+                        JOB_RUNNING,
+                        now,
+                        self.max_attempts,
+                    ),
+                )
+                rows = self._conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, updated_at = ? "
+                    "WHERE id = (SELECT id FROM jobs WHERE (status = ? AND run_after <= ?) "
+                    "OR (status = ? AND lease_until < ?) ORDER BY run_after LIMIT 1) RETURNING *",
+                    (
+                        JOB_RUNNING,
+                        now + self.lease_seconds,
+                        now,
+                        JOB_PENDING,
+                        now,
+                        JOB_RUNNING,
+                        now,
+                    ),
+                ).fetchall()
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        if not rows:
+            return None
+        job = dict(rows[0])
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    async def renew(self, job_id: str) -> None:
+        """
+        Extend the lease of a running job by lease_seconds.
+        """
+        await self._run(self._renew, job_id)
+
+    def _renew(self, job_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ?",
+                (time.time() + self.lease_seconds, job_id, JOB_RUNNING),
+            )
+            self._conn.commit()
+
+    async def complete(self, job_id: str, ids: List[str]) -> None:
+        """
+        Mark a job as succeeded with the ids of the upserted documents, dropping its uploaded file.
+        """
+        await self._run(self._complete, job_id, ids)
+
+    def _complete(self, job_id: str, ids: List[str]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = NULL, file = NULL, updated_at = ? WHERE id = ?",
+                (JOB_SUCCEEDED, json.dumps(ids), time.time(), job_id),
+            )
+            self._conn.commit()
+
+    async def fail(self, job_id: str, attempts: int, error: str) -> None:
+        """
+        Record the error of a failed attempt, and either schedule a retry or mark the job as failed.
+        """
+        await self._run(self._fail, job_id, attempts, error)
+
+    def _fail(self, job_id: str, attempts: int, error: str) -> None:
+        now = time.time()
+        with self._lock:
+            if attempts < self.max_attempts:
+                delay = self.retry_delay_seconds * 2 ** (attempts - 1)
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, run_after = ?, updated_at = ? WHERE id = ?",
+                    (JOB_PENDING, error, now + delay, now, job_id),
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, file = NULL, updated_at = ? WHERE id = ?",
+                    (JOB_FAILED, error, now, job_id),
+                )
+            self._conn.commit()
+
+    async def wait_for_job(self, timeout: float = POLL_INTERVAL_SECONDS) -> None:
+        """
+        Wait until a job is enqueued or the timeout has passed.
+        """
+        try:
+            await asyncio.wait_for(self._job_added.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._job_added.clear()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _extract_text(file: bytes, mimetype: Optional[str]) -> str:
+    from services.file import extract_text_from_filepath
+
+    with tempfile.NamedTemporaryFile() as temp_file:
+        temp_file.write(file)
+        temp_file.flush()
+        return extract_text_from_filepath(temp_file.name, mimetype)
+
+
+async def run_job(
+    job: Dict, upsert: Callable[[List[Document]], Awaitable[List[str]]]
+) -> List[str]:
+    """
+    Run an ingest job, extracting the text of an uploaded file first if needed.
+
+    Args:
+        job: A job returned by JobQueue.claim.
+        upsert: The function used to upsert the documents, such as datastore.upsert.
+
+    Returns:
+        The ids of the upserted documents.
+    """
+    payload = job["payload"]
+    if job["kind"] == JOB_UPSERT:
+        documents = [Document(**document) for document in payload["documents"]]
+    elif job["kind"] == JOB_UPSERT_FILE:
+        # Extracting text is CPU bound, keep it off the event loop
+        text = await asyncio.get_running_loop().run_in_executor(
+            None, _extract_text, job["file"], payload.get("mimetype")
+        )
+        documents = [
+            Document(text=text, metadata=DocumentMetadata(**payload["metadata"]))
+        ]
+    else:
+        raise ValueError(f"Unknown job kind: {job['kind']}")
+    return await upsert(documents)
+
+
+async def _renew_lease(queue: JobQueue, job_id: str) -> None:
+    while True:
+        await asyncio.sleep(queue.lease_seconds / 3)
+        try:
+            await queue.renew(job_id)
+        except Exception as e:
+            logger.error(f"Failed to renew the lease of job {job_id}: {e}")
+
+
+async def _work(
+    queue: JobQueue, upsert: Callable[[List[Document]], Awaitable[List[str]]]
+) -> None:
+    while True:
+        job = await queue.claim()
+        if job is None:
+            await queue.wait_for_job()
+            continue
+        logger.info(f"Running {job['kind']} job {job['id']}, attempt {job['attempts']}")
+        renewal = asyncio.create_task(_renew_lease(queue, job["id"]))
+        try:
+            ids = await run_job(job, upsert)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job {job['id']} failed: {e}")
+            await queue.fail(job["id"], job["attempts"], str(e))
+        else:
+            await queue.complete(job["id"], ids)
+        finally:
+            renewal.cancel()
+
+
+_job_queue: Optional[JobQueue] = None
+_workers: List[asyncio.Task] = []
+
+
+def get_job_queue() -> Optional[JobQueue]:
+    """
+    Return the process wide job queue, or None if INGEST_JOBS_PATH is not set.
+    """
+    global _job_queue
+    if _job_queue is None and INGEST_JOBS_PATH:
+        logger.info(f"Using ingest job queue at {INGEST_JOBS_PATH}")
+        _job_queue = JobQueue(INGEST_JOBS_PATH)
+    return _job_queue
+
+
+def start_job_workers(
+    upsert: Callable[[List[Document]], Awaitable[List[str]]],
+    num_workers: int = INGEST_JOB_WORKERS,
+) -> None:
+    """
+    Start the background workers draining the job queue, if it is enabled.
+    """
+    queue = get_job_queue()
+    if queue is None:
+        return
+    _workers.extend(
+        asyncio.create_task(_work(queue, upsert)) for _ in range(num_workers)
+    )
+
+
+async def stop_job_workers() -> None:
+    """
+    Cancel the background workers. Jobs they were running are run again once their lease expires.
+    """
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
@@ -0,0 +1,293 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# The content type of the Prometheus text exposition format, the charset is added by the response
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Latency buckets in seconds, the Prometheus client defaults
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+# Buckets for the number of items in a batch
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+_metrics: List["Metric"] = []
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        for value in values
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class Metric:
+    """
+    A metric with a value for each combination of label values, rendered in the Prometheus text format.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> Iterator[Tuple[str, Sequence[str], Sequence[str], float]]:
+        """
+        Yield (name, label names, label values, value) for each sample of the metric.
+        """
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            lines.extend(
+                f"{name}{_format_labels(names, values)} {_format_value(value)}"
+                for name, names, values, value in self._samples()
+            )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    A count that only goes up, such as a number of errors.
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        # Metrics without labels are exported from the start, as 0
+        self._values: Dict[Tuple[str, ...], float] = {} if self.labelnames else {(): 0}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield self.name, self.labelnames, key, value
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down, such as a number of requests in flight.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        # Metrics without labels are exported from the start, as 0
+        self._values: Dict[Tuple[str, ...], float] = {} if self.labelnames else {(): 0}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    @contextmanager
+    def track_in_progress(self, **labels: str) -> Iterator[None]:
+        """
+        Count the block as in progress while it runs.
+        """
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield self.name, self.labelnames, key, value
+
+
+class Histogram(Metric):
+    """
+    A distribution of observations, such as latencies, counted in cumulative buckets.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # For each label values, the count of each bucket (not cumulative), the sum and the count of observations
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        if not self.labelnames:
+            self._values[()] = ([0] * len(self.buckets), [0.0, 0])
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.setdefault(
+                key, ([0] * len(self.buckets), [0.0, 0])
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            total[0] += value
+            total[1] += 1
+
+    def get_count(self, **labels: str) -> int:
+        values = self._values.get(self._key(labels))
+        return int(values[1][1]) if values else 0
+
+    @contextmanager
+    def time(self, errors: Optional[Counter] = None, **labels: str) -> Iterator[None]:
+        """
+        Observe how long the block takes, in seconds, and count it in errors if it raises an exception.
+        Blocks that are cancelled, such as the slower of hedged queries, are neither observed nor counted.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            if errors is not None:
+                errors.inc(**labels)
+            self.observe(time.perf_counter() - start, **labels)
+            raise
+        else:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        bucket_labelnames = self.labelnames + ("le",)
+        for key, (counts, (total, count)) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", bucket_labelnames, key + (_format_value(bound),), cumulative
+            yield f"{self.name}_sum", self.labelnames, key, total
+            yield f"{self.name}_count", self.labelnames, key, count
+
+
+def render_metrics() -> str:
+    """
+    Return every metric in the Prometheus text exposition format.
+    """
+    return "\n".join(metric.render() for metric in _metrics) + "\n"
+
+
+REQUEST_SECONDS = Histogram(
+    "retrieval_request_seconds",
+    "Time spent handling HTTP requests, including serializing the response.",
+    ["method", "path"],
+)
+REQUESTS = Counter(
+    "retrieval_requests_total",
+    "Number of HTTP requests handled.",
+    ["method", "path", "status"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "retrieval_requests_in_flight",
+    "Number of HTTP requests being handled.",
+    ["path"],
+)
+DATASTORE_SECONDS = Histogram(
+    "retrieval_datastore_seconds",
+    "Time spent in datastore operations, upsert and query including chunking and embedding, _upsert, _query and delete only the datastore.",
+    ["datastore", "operation"],
+)
+DATASTORE_ERRORS = Counter(
+    "retrieval_datastore_errors_total",
+    "Number of datastore operations that raised an error.",
+    ["datastore", "operation"],
+)
+DATASTORE_BATCH_SIZE = Histogram(
+    "retrieval_datastore_batch_size",
+    "Number of chunks written by each _upsert and of queries answered by each _query.",
+    ["datastore", "operation"],
+    buckets=SIZE_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "retrieval_stage_seconds",
+    "Time spent extracting text from files, chunking documents and embedding texts.",
+    ["stage"],
+)
+STAGE_ERRORS = Counter(
+    "retrieval_stage_errors_total",
+    "Number of text extractions, chunkings and embedding requests that raised an error.",
+    ["stage"],
+)
+EMBEDDING_BATCH_SIZE = Histogram(
+    "retrieval_embedding_batch_size",
+    "Number of texts sent to the embedding provider in each request.",
+    buckets=SIZE_BUCKETS,
+)
+CHUNKS = Counter(
+    "retrieval_chunks_total",
+    "Number of chunks produced from upserted documents.",
+)
+EMBEDDED_TOKENS = Counter(
+    "retrieval_embedded_tokens_total",
+    "Number of tokens sent to the embedding provider, for document chunks and queries that missed the embedding cache.",
+)
+QUERY_CACHE_LOOKUPS = Counter(
+    "retrieval_query_cache_lookups_total",
+    "Number of queries looked up in the query result caches, by cache, endpoint and result (hit or miss).",
+    ["cache", "endpoint", "result"],
+)
+EMBEDDING_CACHE_LOOKUPS = Counter(
+    "retrieval_embedding_cache_lookups_total",
+    "Number of texts looked up in the embedding cache, by result (hit or miss).",
+    ["result"],
+)
+EMBEDDING_CACHE_ENTRIES = Gauge(
+    "retrieval_embedding_cache_entries",
+    "Number of embeddings stored in the embedding cache.",
+)
+REPLICATED_QUERIES = Counter(
+    "retrieval_replicated_queries_total",
+    "Number of queries answered by replicated datastores.",
+)
+REPLICATED_HEDGES = Counter(
+    "retrieval_replicated_hedges_total",
+    "Number of queries of replicated datastores also sent to a replica, because the primary was slow or failed.",
+)
+REPLICATED_HEDGE_WINS = Counter(
+    "retrieval_replicated_hedge_wins_total",
+    "Number of hedged queries of replicated datastores answered first by the replica.",
+)
+REPLICATED_HEDGE_DELAY_SECONDS = Gauge(
+    "retrieval_replicated_hedge_delay_seconds",
+    "How long replicated datastores currently wait for the primary before querying a replica.",
+)
@@ -1,10 +1,78 @@
-from typing import List
+from typing import List, Optional
+import asyncio
+import aiohttp
 import openai
 import os
+import tiktoken
 from loguru import logger
 
 from tenacity import retry, wait_random_exponential, stop_after_attempt
 
+from services.rate_limiter import RateLimiter
+
+# The OpenAI model used to embed texts, unless an Azure OpenAI deployment is configured
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# The maximum number of pooled keep-alive connections to the OpenAI API
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 100))
+
+# Rate limits of the embeddings endpoint, enforced client side for all async embedding calls
+EMBEDDING_REQUESTS_PER_MINUTE = int(
+    os.environ.get("OPENAI_EMBEDDING_REQUESTS_PER_MINUTE", 3000)
+)
+EMBEDDING_TOKENS_PER_MINUTE = int(
+    os.environ.get("OPENAI_EMBEDDING_TOKENS_PER_MINUTE", 1000000)
+)
+
+embedding_rate_limiter = RateLimiter(
+    EMBEDDING_REQUESTS_PER_MINUTE, EMBEDDING_TOKENS_PER_MINUTE
+)
+
+tokenizer = tiktoken.get_encoding(
+    "cl100k_base"
+)  # The encoding used by the embedding model, to count the tokens of each request
+
+# Shared aiohttp session used for all async OpenAI calls, bound to the event loop that created it
+_aiosession: Optional[aiohttp.ClientSession] = None
+_aiosession_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _get_aiosession() -> aiohttp.ClientSession:
+    """
+    Return the shared aiohttp session for the running event loop, creating it if needed.
+
+    openai only reuses connections across requests when a session is provided through
+    openai.aiosession, otherwise it opens (and closes) a new session for every call.
+    """
+    global _aiosession, _aiosession_loop
+    loop = asyncio.get_running_loop()
+    if _aiosession is None or _aiosession.closed or _aiosession_loop is not loop:
+        _aiosession = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=OPENAI_MAX_CONNECTIONS, keepalive_timeout=60
+            )
+        )
+        _aiosession_loop = loop
+    return _aiosession
+
+
+def get_embedding_model_name() -> str:
+    """
+    Return the name of the model (or Azure OpenAI deployment) used to embed texts.
+    """
+    return os.environ.get("OPENAI_EMBEDDINGMODEL_DEPLOYMENTID") or EMBEDDING_MODEL
+
+
+async def close_aiosession() -> None:
+    """
+    Close the shared aiohttp session, if one was created.
+    """
+    global _aiosession, _aiosession_loop
+    if _aiosession is not None and not _aiosession.closed:
+        await _aiosession.close()
+    _aiosession = None
+    _aiosession_loop = None
+
 
 @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(3))
 def get_embeddings(texts: List[str]) -> List[List[float]]:
@@ -26,7 +94,7 @@ def get_embeddings(texts: List[str]) -> List[List[float]]:
 
     response = {}
     if deployment == None:
-        response = openai.Embedding.create(input=texts, model="text-embedding-ada-002")
+        response = openai.Embedding.create(input=texts, model=EMBEDDING_MODEL)
     else:
         response = openai.Embedding.create(input=texts, deployment_id=deployment)
 
@@ -37,6 +105,54 @@ def get_embeddings(texts: List[str]) -> List[List[float]]:
     return [result["embedding"] for result in data]
 
 
+@retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(3))
+async def aget_embeddings(
+    texts: List[str], num_tokens: Optional[int] = None
+) -> List[List[float]]:
+    """
+    Embed texts using OpenAI's ada model without blocking the event loop.
+
+    Requests are sent over a pooled keep-alive HTTP session shared by all callers on the event loop,
+    and are delayed as needed to stay within the configured requests and tokens per minute.
+
+    Args:
+        texts: The list of texts to embed.
+        num_tokens: The total number of tokens of the texts if it is already known, otherwise the texts are tokenized.
+
+    Returns:
+        A list of embeddings, each of which is a list of floats.
+
+    Raises:
+        Exception: If the OpenAI API call fails.
+    """
+    # Wait for capacity under the requests and tokens per minute limits
+    if num_tokens is None:
+        num_tokens = sum(len(tokens) for tokens in tokenizer.encode_ordinary_batch(texts))
+    await embedding_rate_limiter.acquire(num_tokens)
+
+    # Route the request through the shared session so connections are reused
+    openai.aiosession.set(_get_aiosession())
+
+    # NOTE: Azure Open AI requires deployment id
+    deployment = os.environ.get("OPENAI_EMBEDDINGMODEL_DEPLOYMENTID")
+
+    response = {}
+    if deployment == None:
+        response = await openai.Embedding.acreate(
+            input=texts, model=EMBEDDING_MODEL
+        )
+    else:
+        response = await openai.Embedding.acreate(
+            input=texts, deployment_id=deployment
+        )
+
+    # Extract the embedding data from the response
+    data = response["data"]  # type: ignore
+
+    # Return the embeddings as a list of lists of floats
+    return [result["embedding"] for result in data]
+
+
 @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(3))
 def get_chat_completion(
     messages,
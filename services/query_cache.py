@@ -0,0 +1,360 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from models.models import Query, QueryResult, QueryWithEmbedding
+from services.metrics import QUERY_CACHE_LOOKUPS
+
+# The maximum number of query results kept in memory, the cache is disabled if 0
+QUERY_CACHE_MAX_ENTRIES = int(os.environ.get("QUERY_CACHE_MAX_ENTRIES", 0))
+# How long a cached query result can be served, in seconds
+QUERY_CACHE_TTL_SECONDS = float(os.environ.get("QUERY_CACHE_TTL_SECONDS", 300))
+# If set, query results are cached in this Redis instance and shared by every server process
+QUERY_CACHE_REDIS_URL = os.environ.get("QUERY_CACHE_REDIS_URL")
+# The number of recent query embeddings compared against new queries, the semantic cache is disabled if 0
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", 0))
+# The minimum cosine similarity between two query embeddings for one to be answered with the results of the other
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.95))
+
+# The endpoint that hits and misses are counted under, set by the server for each request
+_query_cache_endpoint: ContextVar[str] = ContextVar(
+    "query_cache_endpoint", default="datastore"
+)
+
+
+def set_query_cache_endpoint(endpoint: str) -> None:
+    """
+    Count the query cache hits and misses of the current request under the given endpoint.
+    """
+    _query_cache_endpoint.set(endpoint)
+
+
+def _count_lookups(
+    counters: Dict[str, Dict[str, int]], cache: str, hits: int, misses: int
+) -> None:
+    endpoint = _query_cache_endpoint.get()
+    endpoint_counters = counters.setdefault(endpoint, {"hits": 0, "misses": 0})
+    endpoint_counters["hits"] += hits
+    endpoint_counters["misses"] += misses
+    QUERY_CACHE_LOOKUPS.inc(hits, cache=cache, endpoint=endpoint, result="hit")
+    QUERY_CACHE_LOOKUPS.inc(misses, cache=cache, endpoint=endpoint, result="miss")
+
+
+def _get_stats(counters: Dict[str, Dict[str, int]]) -> Dict[str, Dict[str, float]]:
+    stats: Dict[str, Dict[str, float]] = {}
+    for endpoint, endpoint_counters in counters.items():
+        lookups = endpoint_counters["hits"] + endpoint_counters["misses"]
+        stats[endpoint] = {
+            "hits": endpoint_counters["hits"],
+            "misses": endpoint_counters["misses"],
+            "hit_rate": endpoint_counters["hits"] / lookups if lookups else 0.0,
+        }
+    return stats
+
+
+class QueryCache:
+    """
+    An in-process cache of query results, keyed on the query text, filter and top_k.
+
+    Every write to the datastore bumps a generation counter, and only results computed in the
+    current generation are served, so an upsert or delete invalidates the whole cache at once.
+    Results expire after ttl_seconds and are evicted in least recently used order once
+    max_entries is exceeded.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = QUERY_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = QUERY_CACHE_TTL_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._generation = 0
+        self._entries: "OrderedDict[str, Tuple[float, QueryResult]]" = OrderedDict()
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def _key(query: Query) -> str:
+        content = query.json(include={"query", "filter", "top_k"}, sort_keys=True)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    async def get_generation(self) -> int:
+        return self._generation
+
+    async def invalidate(self) -> None:
+        """
+        Start a new generation, so that every result cached so far is no longer served.
+        """
+        self._generation += 1
+        self._entries.clear()
+
+    async def _get_many(
+        self, keys: List[str], generation: int
+    ) -> List[Optional[QueryResult]]:
+        now = time.monotonic()
+        results: List[Optional[QueryResult]] = []
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+            results.append(entry[1] if entry is not None else None)
+        return results
+
+    async def _put_many(
+        self, keys: List[str], results: List[QueryResult], generation: int
+    ) -> None:
+        # Results computed while a write was in progress may already be stale
+        if generation != self._generation:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds
+        for key, result in zip(keys, results):
+            self._entries[key] = (expires_at, result)
+            self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_query(
+        self,
+        queries: List[Query],
+        run_queries: Callable[[List[Query]], Awaitable[List[QueryResult]]],
+    ) -> List[QueryResult]:
+        """
+        Answer queries from the cache, running only the queries that are not cached.
+
+        Args:
+            queries: The list of queries to answer.
+            run_queries: Called with the queries that missed the cache, returns their results in the same order.
+
+        Returns:
+            A list of query results, in the same order as queries.
+        """
+        generation = await self.get_generation()
+        keys = [self._key(query) for query in queries]
+        results = await self._get_many(keys, generation)
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        _count_lookups(self._counters, "exact", len(queries) - len(missing), len(missing))
+
+        if missing:
+            new_results = await run_queries([queries[i] for i in missing])
+            for i, result in zip(missing, new_results):
+                results[i] = result
+            await self._put_many([keys[i] for i in missing], new_results, generation)
+
+        return results  # type: ignore
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Return the hit and miss counters of the cache, for each endpoint.
+        """
+        return _get_stats(self._counters)
+
+
+class RedisQueryCache(QueryCache):
+    """
+    A query cache stored in Redis and shared by every server process.
+
+    The generation counter is a Redis key, so a write in one process invalidates the results
+    cached by all of them. Keys include the generation and expire after ttl_seconds, while the
+    size of the cache is bounded by the maxmemory policy of the Redis instance.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        ttl_seconds: float = QUERY_CACHE_TTL_SECONDS,
+        prefix: str = "query_cache",
+    ):
+        import redis.asyncio as redis
+
+        super().__init__(max_entries=0, ttl_seconds=ttl_seconds)
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+        self._generation_key = f"{prefix}:generation"
+
+    async def get_generation(self) -> int:
+        generation = await self.client.get(self._generation_key)
+        self._generation = int(generation or 0)
+        return self._generation
+
+    async def invalidate(self) -> None:
+        self._generation = await self.client.incr(self._generation_key)
+
+    async def _get_many(
+        self, keys: List[str], generation: int
+    ) -> List[Optional[QueryResult]]:
+        values = await self.client.mget(
+            [f"{self.prefix}:{generation}:{key}" for key in keys]
+        )
+        return [
+            QueryResult.parse_raw(value) if value is not None else None
+            for value in values
+        ]
+
+    async def _put_many(
+        self, keys: List[str], results: List[QueryResult], generation: int
+    ) -> None:
+        if generation != await self.get_generation():
+            return
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key, result in zip(keys, results):
+                pipe.set(
+                    f"{self.prefix}:{generation}:{key}",
+                    result.json(),
+                    px=int(self.ttl_seconds * 1000),
+                )
+            await pipe.execute()
+
+
+class SemanticCache:
+    """
+    A cache answering queries with the results of earlier queries that have nearly the same embedding.
+
+    The normalized embeddings of the last max_entries queries are kept in the rows of a matrix, which
+    is compared against new query embeddings with a single matrix product. A query is answered from
+    the cache when the cosine similarity with a cached query reaches threshold and both have the same
+    filter and top_k. Like QueryCache, results expire after ttl_seconds and every write invalidates them.
+    """
+
+    def __init__(
+        self,
+        dimension: int,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        ttl_seconds: float = QUERY_CACHE_TTL_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self._generation = 0
+        self._embeddings = np.zeros((max_entries, dimension), dtype=np.float32)
+        # Rows that are empty, expired or invalidated expire at -inf
+        self._expires_at = np.full(max_entries, -np.inf)
+        self._keys = np.empty(max_entries, dtype=object)
+        self._results: List[Optional[QueryResult]] = [None] * max_entries
+        # The row overwritten by the next result, rows are reused oldest first
+        self._next = 0
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def _key(query: Query) -> str:
+        return query.json(include={"filter", "top_k"}, sort_keys=True)
+
+    @staticmethod
+    def _normalize(embeddings: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return embeddings / norms
+
+    def invalidate(self) -> None:
+        self._generation += 1
+        self._expires_at[:] = -np.inf
+        self._results = [None] * self.max_entries
+
+    async def get_or_query(
+        self,
+        queries: List[QueryWithEmbedding],
+        run_queries: Callable[[List[QueryWithEmbedding]], Awaitable[List[QueryResult]]],
+    ) -> List[QueryResult]:
+        """
+        Answer queries with the results of similar cached queries, running only the queries without one.
+
+        Args:
+            queries: The list of queries to answer, with their embeddings.
+            run_queries: Called with the queries that missed the cache, returns their results in the same order.
+
+        Returns:
+            A list of query results, in the same order as queries.
+        """
+        generation = self._generation
+        embeddings = self._normalize(np.stack([query.embedding for query in queries]))
+        similarities = embeddings @ self._embeddings.T
+        similarities[:, self._expires_at <= time.monotonic()] = -np.inf
+
+        keys = [self._key(query) for query in queries]
+        results: List[Optional[QueryResult]] = []
+        for query, key, row in zip(queries, keys, similarities):
+            row[self._keys != key] = -np.inf
+            best = int(np.argmax(row))
+            if row[best] >= self.threshold:
+                # The cached results, reported under the text of the new query
+                results.append(self._results[best].copy(update={"query": query.query}))  # type: ignore
+            else:
+                results.append(None)
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        _count_lookups(self._counters, "semantic", len(queries) - len(missing), len(missing))
+
+        if missing:
+            new_results = await run_queries([queries[i] for i in missing])
+            for i, result in zip(missing, new_results):
+                results[i] = result
+            # Results computed while a write was in progress may already be stale
+            if generation == self._generation:
+                expires_at = time.monotonic() + self.ttl_seconds
+                for i, result in zip(missing, new_results):
+                    self._embeddings[self._next] = embeddings[i]
+                    self._expires_at[self._next] = expires_at
+                    self._keys[self._next] = keys[i]
+                    self._results[self._next] = result
+                    self._next = (self._next + 1) % self.max_entries
+
+        return results  # type: ignore
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Return the hit and miss counters of the cache, for each endpoint.
+        """
+        return _get_stats(self._counters)
+
+
+_query_cache: Optional[QueryCache] = None
+_semantic_cache: Optional[SemanticCache] = None
+
+
+def get_query_cache() -> Optional[QueryCache]:
+    """
+    Return the process wide query cache, or None if neither QUERY_CACHE_MAX_ENTRIES nor QUERY_CACHE_REDIS_URL is set.
+    """
+    global _query_cache
+    if _query_cache is None:
+        if QUERY_CACHE_REDIS_URL:
+            logger.info("Using query cache in Redis")
+            _query_cache = RedisQueryCache(QUERY_CACHE_REDIS_URL)
+        elif QUERY_CACHE_MAX_ENTRIES > 0:
+            logger.info(f"Using query cache of {QUERY_CACHE_MAX_ENTRIES} entries")
+            _query_cache = QueryCache()
+    return _query_cache
+
+
+def get_semantic_cache(dimension: int) -> Optional[SemanticCache]:
+    """
+    Return the process wide semantic cache of query embeddings of the given dimension, or None if SEMANTIC_CACHE_MAX_ENTRIES is 0.
+    """
+    global _semantic_cache
+    if _semantic_cache is None and SEMANTIC_CACHE_MAX_ENTRIES > 0:
+        logger.info(
+            f"Using semantic cache of {SEMANTIC_CACHE_MAX_ENTRIES} entries with threshold {SEMANTIC_CACHE_THRESHOLD}"
+        )
+        _semantic_cache = SemanticCache(dimension)
+    return _semantic_cache
+
+
+async def invalidate_query_cache() -> None:
+    """
+    Invalidate the cached query results, exact and semantic, after a write to the datastore.
+    """
+    cache = get_query_cache()
+    if cache is not None:
+        await cache.invalidate()
+    if _semantic_cache is not None:
+        _semantic_cache.invalidate()
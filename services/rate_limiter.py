@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+
+class RateLimiter:
+    """
+    A token bucket rate limiter tracking both requests per minute and tokens per minute.
+
+    Each call to acquire reserves capacity immediately and then sleeps until the buckets have
+    refilled enough to cover the reservation, so concurrent callers are admitted in arrival order.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._available_requests = float(requests_per_minute)
+        self._available_tokens = float(tokens_per_minute)
+        self._updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self._available_requests = min(
+            self.requests_per_minute,
+            self._available_requests + elapsed * self.requests_per_minute / 60,
+        )
+        self._available_tokens = min(
+            self.tokens_per_minute,
+            self._available_tokens + elapsed * self.tokens_per_minute / 60,
+        )
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """
+        Wait until one request of the given number of tokens can be sent without exceeding the limits.
+        """
+        self._refill()
+
+        # A single request larger than the token limit can never fit, only wait for a full bucket
+        tokens = min(tokens, self.tokens_per_minute)
+        self._available_requests -= 1
+        self._available_tokens -= tokens
+
+        delay = max(
+            -self._available_requests * 60 / self.requests_per_minute,
+            -self._available_tokens * 60 / self.tokens_per_minute,
+            0,
+        )
+        if delay > 0:
+            await asyncio.sleep(delay)
@@ -1,16 +1,23 @@
 import shutil
+import threading
 from typing import Dict, List
 import pytest
 import random
 
+import datastore.datastore as datastore_module
 from datastore.providers.chroma_datastore import ChromaDataStore
 from models.models import (
+    Document,
     DocumentChunk,
     DocumentChunkMetadata,
     DocumentMetadataFilter,
+    Query,
     QueryWithEmbedding,
     Source,
 )
+from services import embedding_provider, query_cache
+from services.embedding_provider import HashingEmbeddingProvider
+from services.query_cache import QueryCache
 
 TEST_PERSISTENCE_DIR = "chroma_test_datastore"
 COLLECTION_NAME = "documents"
@@ -291,3 +298,144 @@ async def test_delete_by_id(document_chunks):
                 for result in query_results[0].results
             ]
         )
+
+
+@pytest.mark.asyncio
+async def test_delete_documents_in_batches(monkeypatch):
+    monkeypatch.setattr(datastore_module, "DELETE_BATCH_SIZE", 2)
+    document_chunks = {
+        f"doc-{i}": [
+            DocumentChunk(
+                id=f"doc-{i}_0",
+                text=f"Chunk of document {i}",
+                metadata=DocumentChunkMetadata(document_id=f"doc-{i}"),
+                embedding=create_embedding(TEST_EMBEDDING_DIM),
+            )
+        ]
+        for i in range(6)
+    }
+
+    for datastore in get_chroma_datastore():
+        await datastore.delete(delete_all=True)
+        await datastore._upsert(document_chunks)
+
+        deleted_batches = []
+        delete = datastore.delete
+
+        async def record_delete(ids=None, filter=None, delete_all=None):
+            deleted_batches.append(ids)
+            return await delete(ids=ids, filter=filter, delete_all=delete_all)
+
+        monkeypatch.setattr(datastore, "delete", record_delete)
+        await datastore._delete_documents([f"doc-{i}" for i in range(5)])
+
+        assert deleted_batches == [["doc-0", "doc-1"], ["doc-2", "doc-3"], ["doc-4"]]
+        assert datastore._collection.get()["ids"] == ["doc-5_0"]
+
+
+class CountingEmbeddingProvider(HashingEmbeddingProvider):
+    def __init__(self):
+        super().__init__()
+        self.texts: List[str] = []
+
+    async def embed(self, texts: List[str], num_tokens=None) -> List[List[float]]:
+        self.texts.extend(texts)
+        return await super().embed(texts, num_tokens)
+
+
+def stored_chunk_texts(datastore: ChromaDataStore) -> Dict[str, str]:
+    result = datastore._collection.get(include=["documents"])
+    return dict(zip(result["ids"], result["documents"]))
+
+
+@pytest.mark.asyncio
+async def test_incremental_upsert(monkeypatch):
+    provider = CountingEmbeddingProvider()
+    monkeypatch.setattr(embedding_provider, "_embedding_provider", provider)
+    paragraphs = [
+        f"Paragraph {i} of the manual. " + "It explains one more setting in detail. " * 12
+        for i in range(6)
+    ]
+
+    for datastore in get_chroma_datastore():
+        await datastore.delete(delete_all=True)
+        provider.texts.clear()
+
+        document = Document(id="manual", text="\n".join(paragraphs))
+        assert await datastore.upsert([document], chunk_token_size=50) == ["manual"]
+        first_chunks = stored_chunk_texts(datastore)
+        assert len(first_chunks) > 4
+        assert len(provider.texts) == len(first_chunks)
+
+        # A byte-identical upload is skipped entirely
+        provider.texts.clear()
+        assert await datastore.upsert([document], chunk_token_size=50) == ["manual"]
+        assert provider.texts == []
+
+        # Editing the end of the document only embeds the changed chunks, and the first chunk
+        provider.texts.clear()
+        edited = Document(id="manual", text="\n".join(paragraphs[:-1] + ["A short ending."]))
+        await datastore.upsert([edited], chunk_token_size=50)
+        edited_chunks = stored_chunk_texts(datastore)
+        assert 1 < len(provider.texts) < len(edited_chunks)
+        assert edited_chunks["manual_0"] == first_chunks["manual_0"]
+        assert "A short ending." in edited_chunks[max(edited_chunks, key=lambda id_: int(id_.split("_")[1]))]
+        # Chunks past the end of the shorter document are deleted
+        assert len(edited_chunks) < len(first_chunks)
+        assert sorted(edited_chunks) == sorted(f"manual_{i}" for i in range(len(edited_chunks)))
+
+
+@pytest.mark.asyncio
+async def test_query_cache_is_invalidated_by_writes(monkeypatch):
+    monkeypatch.setattr(embedding_provider, "_embedding_provider", HashingEmbeddingProvider())
+    monkeypatch.setattr(query_cache, "_query_cache", QueryCache(max_entries=10))
+    datastore = ephemeral_chroma_datastore()
+    await datastore.delete(delete_all=True)
+    await datastore.upsert([Document(id="cats", text="Cats sleep most of the day.")])
+
+    queried = []
+    run_query = datastore._query
+
+    async def record_query(queries):
+        queried.extend(query.query for query in queries)
+        return await run_query(queries)
+
+    monkeypatch.setattr(datastore, "_query", record_query)
+    query = Query(query="How long do cats sleep?", top_k=2)
+
+    first = await datastore.query([query])
+    assert await datastore.query([query]) == first
+    assert len(queried) == 1
+
+    await datastore.upsert([Document(id="dogs", text="Dogs sleep less than cats.")])
+    assert len((await datastore.query([query]))[0].results) == 2
+    assert len(queried) == 2
+
+    await datastore.delete(ids=["dogs"])
+    assert len((await datastore.query([query]))[0].results) == 1
+    assert len(queried) == 3
+
+
+@pytest.mark.asyncio
+async def test_client_calls_run_in_the_datastore_thread_pool(monkeypatch):
+    monkeypatch.setattr(embedding_provider, "_embedding_provider", HashingEmbeddingProvider())
+    datastore = ephemeral_chroma_datastore()
+    # The local client's database connection is not thread safe
+    assert datastore.thread_pool_size == 1
+    await datastore.delete(delete_all=True)
+    await datastore.upsert([Document(id="cats", text="Cats sleep most of the day.")])
+
+    threads = []
+    collection_class = type(datastore._collection)
+    query = collection_class.query
+
+    def record_thread(self, *args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return query(self, *args, **kwargs)
+
+    monkeypatch.setattr(collection_class, "query", record_thread)
+    results = await datastore.query([Query(query="cats"), Query(query="sleep")])
+
+    assert [len(result.results) for result in results] == [1, 1]
+    assert len(threads) == 2
+    assert all(name.startswith("ChromaDataStore") for name in threads)
@@ -0,0 +1,227 @@
+import random
+from typing import Dict, List
+
+import numpy as np
+import pytest
+
+pytest.importorskip("duckdb")
+pytest.importorskip("pyarrow")
+
+from datastore.providers.duckdb_datastore import DuckDBDataStore
+from models.models import (
+    Document,
+    DocumentChunk,
+    DocumentChunkMetadata,
+    DocumentMetadataFilter,
+    QueryWithEmbedding,
+    Source,
+)
+from services import embedding_provider
+from services.embedding_provider import HashingEmbeddingProvider
+
+TEST_EMBEDDING_DIM = 8
+N_TEST_CHUNKS = 5
+
+random.seed(0)
+
+
+def create_embedding(dim: int = TEST_EMBEDDING_DIM) -> List[float]:
+    return [random.random() for _ in range(dim)]
+
+
+@pytest.fixture(params=["memory", "file"])
+def datastore(request, tmp_path) -> DuckDBDataStore:
+    path = str(tmp_path / "chunks.duckdb") if request.param == "file" else None
+    datastore = DuckDBDataStore(path=path, dimension=TEST_EMBEDDING_DIM)
+    yield datastore
+    datastore.close()
+
+
+@pytest.fixture
+def document_chunks() -> Dict[str, List[DocumentChunk]]:
+    return {
+        "first-doc": [
+            DocumentChunk(
+                id=f"first-doc_{i}",
+                text=f"Lorem ipsum {i}",
+                metadata=DocumentChunkMetadata(
+                    source=Source.email,
+                    author="alice",
+                    created_at="2023-04-03",
+                    document_id="first-doc",
+                ),
+                embedding=create_embedding(),
+            )
+            for i in range(N_TEST_CHUNKS)
+        ],
+        "second-doc": [
+            DocumentChunk(
+                id=f"second-doc_{i}",
+                text=f"Dolor sit amet {i}",
+                metadata=DocumentChunkMetadata(
+                    created_at="2023-04-04", document_id="second-doc"
+                ),
+                embedding=create_embedding(),
+            )
+            for i in range(N_TEST_CHUNKS)
+        ],
+    }
+
+
+def query(embedding, top_k: int = 10, **filter) -> QueryWithEmbedding:
+    return QueryWithEmbedding(
+        query="",
+        embedding=embedding,
+        top_k=top_k,
+        filter=DocumentMetadataFilter(**filter) if filter else None,
+    )
+
+
+def result_ids(result) -> List[str]:
+    return [chunk.id for chunk in result.results]
+
+
+@pytest.mark.asyncio
+async def test_query_is_exact(datastore, document_chunks):
+    await datastore._upsert(document_chunks)
+    chunks = [chunk for doc_chunks in document_chunks.values() for chunk in doc_chunks]
+    embeddings = np.stack([chunk.embedding for chunk in chunks])
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    queries = [query(create_embedding(), top_k=k) for k in (4, 2, 4)]
+    results = await datastore._query(queries)
+
+    assert len(results) == 3
+    for q, result in zip(queries, results):
+        similarities = embeddings @ (q.embedding / np.linalg.norm(q.embedding))
+        expected = [chunks[i].id for i in np.argsort(-similarities)[: q.top_k]]
+        assert result_ids(result) == expected
+        assert [chunk.score for chunk in result.results] == pytest.approx(
+            sorted(similarities, reverse=True)[: q.top_k], abs=1e-5
+        )
+
+
+@pytest.mark.asyncio
+async def test_query_filters(datastore, document_chunks):
+    await datastore._upsert(document_chunks)
+    first_ids = sorted(chunk.id for chunk in document_chunks["first-doc"])
+    second_ids = sorted(chunk.id for chunk in document_chunks["second-doc"])
+    embedding = create_embedding()
+
+    results = await datastore._query(
+        [
+            query(embedding, document_id="second-doc"),
+            query(embedding, source=Source.email),
+            query(embedding, author="alice"),
+            query(embedding, start_date="2023-04-04"),
+            query(embedding, start_date="2023-04-03", end_date="2023-04-03"),
+            query(embedding, author="nobody"),
+            query(embedding, top_k=2, document_id="first-doc"),
+        ]
+    )
+
+    assert sorted(result_ids(results[0])) == second_ids
+    assert sorted(result_ids(results[1])) == first_ids
+    assert sorted(result_ids(results[2])) == first_ids
+    assert sorted(result_ids(results[3])) == second_ids
+    assert sorted(result_ids(results[4])) == first_ids
+    assert results[5].results == []
+    assert len(results[6].results) == 2
+    metadata = results[1].results[0].metadata
+    assert metadata.source == Source.email
+    assert metadata.author == "alice"
+    assert metadata.created_at == "2023-04-03T00:00:00"
+
+
+@pytest.mark.asyncio
+async def test_upsert_replaces_chunks_with_the_same_id(datastore, document_chunks):
+    await datastore._upsert(document_chunks)
+    replacement = DocumentChunk(
+        id="first-doc_0",
+        text="Replaced",
+        metadata=DocumentChunkMetadata(document_id="first-doc"),
+        embedding=create_embedding(),
+    )
+    await datastore._upsert({"first-doc": [replacement, replacement]})
+
+    results = await datastore._query([query(replacement.embedding, top_k=20)])
+    assert len(results[0].results) == 2 * N_TEST_CHUNKS
+    assert results[0].results[0].id == "first-doc_0"
+    assert results[0].results[0].text == "Replaced"
+
+
+@pytest.mark.asyncio
+async def test_delete(datastore, document_chunks):
+    await datastore._upsert(document_chunks)
+    embedding = create_embedding()
+
+    await datastore.delete(ids=["first-doc"])
+    results = await datastore._query([query(embedding)])
+    assert sorted(result_ids(results[0])) == sorted(
+        chunk.id for chunk in document_chunks["second-doc"]
+    )
+
+    await datastore.delete(ids=["second-doc"], filter=DocumentMetadataFilter(author="bob"))
+    assert len((await datastore._query([query(embedding)]))[0].results) == N_TEST_CHUNKS
+
+    await datastore.delete(filter=DocumentMetadataFilter(start_date="2023-04-04"))
+    assert (await datastore._query([query(embedding)]))[0].results == []
+
+    await datastore._upsert(document_chunks)
+    await datastore.delete(delete_all=True)
+    assert (await datastore._query([query(embedding)]))[0].results == []
+
+
+@pytest.mark.asyncio
+async def test_delete_with_an_empty_filter_deletes_nothing(datastore, document_chunks):
+    await datastore._upsert(document_chunks)
+
+    assert await datastore.delete(filter=DocumentMetadataFilter())
+    results = await datastore._query([query(create_embedding(), top_k=20)])
+    assert len(results[0].results) == 2 * N_TEST_CHUNKS
+
+    await datastore.delete(ids=["first-doc"], filter=DocumentMetadataFilter())
+    results = await datastore._query([query(create_embedding(), top_k=20)])
+    assert sorted(result_ids(results[0])) == sorted(
+        chunk.id for chunk in document_chunks["second-doc"]
+    )
+
+
+@pytest.mark.asyncio
+async def test_chunks_are_persisted_to_the_database_file(tmp_path, document_chunks):
+    path = str(tmp_path / "chunks.duckdb")
+    datastore = DuckDBDataStore(path=path, dimension=TEST_EMBEDDING_DIM)
+    await datastore._upsert(document_chunks)
+    embedding = create_embedding()
+    expected = await datastore._query([query(embedding)])
+    datastore.close()
+
+    reopened = DuckDBDataStore(path=path, dimension=TEST_EMBEDDING_DIM)
+    assert await reopened._query([query(embedding)]) == expected
+    reopened.close()
+
+    with pytest.raises(ValueError):
+        DuckDBDataStore(path=path, dimension=TEST_EMBEDDING_DIM + 1)
+
+
+@pytest.mark.asyncio
+async def test_incremental_upsert(monkeypatch):
+    monkeypatch.setattr(embedding_provider, "_embedding_provider", HashingEmbeddingProvider())
+    datastore = DuckDBDataStore(dimension=1536)
+    paragraphs = [
+        f"Paragraph {i} of the manual. " + "It explains one more setting in detail. " * 12
+        for i in range(6)
+    ]
+
+    document = Document(id="manual", text="\n".join(paragraphs))
+    assert await datastore.upsert([document], chunk_token_size=50) == ["manual"]
+    first_hashes = (await datastore._get_chunk_hashes(["manual"]))["manual"]
+    assert len(first_hashes) > 4
+
+    edited = Document(id="manual", text="\n".join(paragraphs[:-1] + ["A short ending."]))
+    await datastore.upsert([edited], chunk_token_size=50)
+    edited_hashes = (await datastore._get_chunk_hashes(["manual"]))["manual"]
+    assert len(edited_hashes) < len(first_hashes)
+    assert sorted(edited_hashes) == sorted(f"manual_{i}" for i in range(len(edited_hashes)))
+    assert edited_hashes["manual_1"] == first_hashes["manual_1"]
+    datastore.close()
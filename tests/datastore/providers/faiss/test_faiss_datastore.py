@@ -0,0 +1,392 @@
+import asyncio
+import os
+import random
+import threading
+from typing import Dict, List
+
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+
+from datastore.providers.faiss_datastore import FaissDataStore
+from models.models import (
+    Document,
+    DocumentChunk,
+    DocumentChunkMetadata,
+    DocumentMetadataFilter,
+    QueryWithEmbedding,
+    Source,
+)
+from services import embedding_provider
+from services.embedding_provider import HashingEmbeddingProvider
+
+TEST_EMBEDDING_DIM = 8
+N_TEST_CHUNKS = 5
+
+random.seed(0)
+
+
+def create_embedding(dim: int = TEST_EMBEDDING_DIM) -> List[float]:
+    return [random.random() for _ in range(dim)]
+
+
+def faiss_datastore(index_type: str = "flat", **kwargs) -> FaissDataStore:
+    return FaissDataStore(
+        index_type=index_type,
+        dimension=TEST_EMBEDDING_DIM,
+        nlist=4,
+        pq_m=4,
+        train_size=256,
+        **kwargs,
+    )
+
+
+@pytest.fixture
+def document_chunks() -> Dict[str, List[DocumentChunk]]:
+    return {
+        "first-doc": [
+            DocumentChunk(
+                id=f"first-doc_{i}",
+                text=f"Lorem ipsum {i}",
+                metadata=DocumentChunkMetadata(
+                    source=Source.email,
+                    author="alice",
+                    created_at="2023-04-03",
+                    document_id="first-doc",
+                ),
+                embedding=create_embedding(),
+            )
+            for i in range(N_TEST_CHUNKS)
+        ],
+        "second-doc": [
+            DocumentChunk(
+                id=f"second-doc_{i}",
+                text=f"Dolor sit amet {i}",
+                metadata=DocumentChunkMetadata(
+                    created_at="2023-04-04", document_id="second-doc"
+                ),
+                embedding=create_embedding(),
+            )
+            for i in range(N_TEST_CHUNKS)
+        ],
+    }
+
+
+def many_chunks(n: int) -> Dict[str, List[DocumentChunk]]:
+    return {
+        "doc": [
+            DocumentChunk(
+                id=f"doc_{i}",
+                text=f"Chunk {i}",
+                metadata=DocumentChunkMetadata(document_id="doc"),
+                embedding=create_embedding(),
+            )
+            for i in range(n)
+        ]
+    }
+
+
+def query(embedding, top_k: int = 10, **filter) -> QueryWithEmbedding:
+    return QueryWithEmbedding(
+        query="",
+        embedding=embedding,
+        top_k=top_k,
+        filter=DocumentMetadataFilter(**filter) if filter else None,
+    )
+
+
+def result_ids(result) -> List[str]:
+    return [chunk.id for chunk in result.results]
+
+
+@pytest.mark.asyncio
+async def test_flat_query_is_exact(document_chunks):
+    datastore = faiss_datastore()
+    await datastore._upsert(document_chunks)
+    chunks = [chunk for doc_chunks in document_chunks.values() for chunk in doc_chunks]
+    embeddings = np.stack([chunk.embedding for chunk in chunks])
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    queries = [query(create_embedding(), top_k=4) for _ in range(3)]
+    results = await datastore._query(queries)
+
+    for q, result in zip(queries, results):
+        similarities = embeddings @ (q.embedding / np.linalg.norm(q.embedding))
+        assert result_ids(result) == [chunks[i].id for i in np.argsort(-similarities)[:4]]
+        assert [chunk.score for chunk in result.results] == pytest.approx(
+            sorted(similarities, reverse=True)[:4], abs=1e-5
+        )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+async def test_query_filters(index_type, document_chunks):
+    datastore = faiss_datastore(index_type)
+    await datastore._upsert(document_chunks)
+    first_ids = sorted(chunk.id for chunk in document_chunks["first-doc"])
+    second_ids = sorted(chunk.id for chunk in document_chunks["second-doc"])
+    embedding = create_embedding()
+
+    results = await datastore._query(
+        [
+            query(embedding, document_id="second-doc"),
+            query(embedding, source=Source.email),
+            query(embedding, author="alice"),
+            query(embedding, start_date="2023-04-04"),
+            query(embedding, start_date="2023-04-03", end_date="2023-04-03"),
+            query(embedding, author="nobody"),
+            query(embedding, top_k=2, document_id="first-doc"),
+        ]
+    )
+
+    assert sorted(result_ids(results[0])) == second_ids
+    assert sorted(result_ids(results[1])) == first_ids
+    assert sorted(result_ids(results[2])) == first_ids
+    assert sorted(result_ids(results[3])) == second_ids
+    assert sorted(result_ids(results[4])) == first_ids
+    assert results[5].results == []
+    assert len(results[6].results) == 2
+    assert results[1].results[0].metadata.source == Source.email
+
+
+@pytest.mark.asyncio
+async def test_queries_with_the_same_filter_are_searched_together(document_chunks):
+    datastore = faiss_datastore()
+    await datastore._upsert(document_chunks)
+    searched = []
+    search = datastore._index.search
+
+    def record_search(vectors, k, params=None):
+        searched.append(len(vectors))
+        return search(vectors, k, params=params)
+
+    datastore._index.search = record_search
+    results = await datastore._query(
+        [
+            query(create_embedding()),
+            query(create_embedding(), document_id="first-doc"),
+            query(create_embedding(), top_k=3),
+        ]
+    )
+
+    assert sorted(searched) == [1, 2]
+    assert [len(result.results) for result in results] == [10, N_TEST_CHUNKS, 3]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+async def test_delete(index_type, document_chunks):
+    datastore = faiss_datastore(index_type)
+    await datastore._upsert(document_chunks)
+    embedding = create_embedding()
+
+    await datastore.delete(ids=["first-doc"])
+    results = await datastore._query([query(embedding)])
+    assert sorted(result_ids(results[0])) == sorted(
+        chunk.id for chunk in document_chunks["second-doc"]
+    )
+
+    await datastore.delete(filter=DocumentMetadataFilter(start_date="2023-04-04"))
+    assert (await datastore._query([query(embedding)]))[0].results == []
+    assert datastore._index.ntotal == 0
+
+    await datastore._upsert(document_chunks)
+    await datastore.delete(delete_all=True)
+    assert (await datastore._query([query(embedding)]))[0].results == []
+
+
+@pytest.mark.asyncio
+async def test_delete_with_an_empty_filter_deletes_nothing(document_chunks):
+    datastore = faiss_datastore()
+    await datastore._upsert(document_chunks)
+
+    assert await datastore.delete(filter=DocumentMetadataFilter())
+    assert datastore._index.ntotal == 2 * N_TEST_CHUNKS
+    results = await datastore._query([query(create_embedding(), top_k=20)])
+    assert len(results[0].results) == 2 * N_TEST_CHUNKS
+
+    await datastore.delete(ids=["first-doc"], filter=DocumentMetadataFilter())
+    results = await datastore._query([query(create_embedding(), top_k=20)])
+    assert sorted(result_ids(results[0])) == sorted(
+        chunk.id for chunk in document_chunks["second-doc"]
+    )
+
+
+@pytest.mark.asyncio
+async def test_hnsw_deletes_are_skipped_until_the_graph_is_rebuilt():
+    datastore = faiss_datastore("hnsw")
+    chunks = many_chunks(20)
+    await datastore._upsert(chunks)
+
+    await datastore._delete_chunks(["doc_0", "doc_1"])
+    assert datastore._index.ntotal == 20
+    results = await datastore._query([query(chunks["doc"][0].embedding, top_k=20)])
+    assert sorted(result_ids(results[0])) == sorted(f"doc_{i}" for i in range(2, 20))
+
+    await datastore._delete_chunks([f"doc_{i}" for i in range(2, 6)])
+    assert datastore._index.ntotal == 14
+    assert datastore._deleted == set()
+    results = await datastore._query([query(chunks["doc"][10].embedding, top_k=1)])
+    assert result_ids(results[0]) == ["doc_10"]
+
+
+@pytest.mark.asyncio
+async def test_upsert_replaces_chunks_with_the_same_id(document_chunks):
+    datastore = faiss_datastore()
+    await datastore._upsert(document_chunks)
+    replacement = DocumentChunk(
+        id="first-doc_0",
+        text="Replaced",
+        metadata=DocumentChunkMetadata(document_id="first-doc"),
+        embedding=create_embedding(),
+    )
+    await datastore._upsert({"first-doc": [replacement]})
+
+    results = await datastore._query([query(replacement.embedding, top_k=20)])
+    assert len(results[0].results) == 2 * N_TEST_CHUNKS
+    assert results[0].results[0].id == "first-doc_0"
+    assert results[0].results[0].text == "Replaced"
+
+
+@pytest.mark.asyncio
+async def test_ivfpq_index_is_trained_once_there_are_enough_chunks():
+    datastore = faiss_datastore("ivfpq")
+    chunks = many_chunks(300)
+
+    await datastore._upsert({"doc": chunks["doc"][:100]})
+    assert datastore._active_type == "flat"
+
+    await datastore._upsert({"doc": chunks["doc"][100:]})
+    assert datastore._active_type == "ivfpq"
+    assert datastore._index.ntotal == 300
+
+    target = chunks["doc"][123]
+    results = await datastore._query([query(target.embedding, top_k=10)])
+    assert target.id in result_ids(results[0])
+
+    await datastore._delete_chunks([target.id])
+    assert datastore._index.ntotal == 299
+    results = await datastore._query([query(target.embedding, top_k=10, document_id="doc")])
+    assert target.id not in result_ids(results[0])
+
+
+@pytest.mark.asyncio
+async def test_ivfpq_index_is_trained_without_blocking_searches_and_writes():
+    datastore = faiss_datastore("ivfpq")
+    chunks = many_chunks(300)["doc"]
+    await datastore._upsert({"doc": chunks[:255]})
+    create_index = datastore._create_index
+    searched = []
+
+    def write_and_search():
+        with datastore._lock.write():
+            datastore._remove_records([datastore._id_of["doc_1"]])
+        datastore._add(chunks[256:])
+        searched.append(datastore._search([query(chunks[0].embedding, top_k=1)]))
+
+    def create_index_writing_during_training(index_type):
+        index = create_index(index_type)
+        train = index.train
+
+        def train_while_writing(vectors):
+            # The writes would wait for the lock forever if training held it
+            thread = threading.Thread(target=write_and_search)
+            thread.start()
+            thread.join(timeout=10)
+            assert not thread.is_alive()
+            train(vectors)
+
+        index.train = train_while_writing
+        return index
+
+    datastore._create_index = create_index_writing_during_training
+    await datastore._upsert({"doc": chunks[255:256]})
+
+    assert result_ids(searched[0][0]) == ["doc_0"]
+    assert datastore._active_type == "ivfpq"
+    assert datastore._index.ntotal == 299
+    results = await datastore._query([query(chunks[280].embedding, top_k=10, document_id="doc")])
+    assert "doc_280" in result_ids(results[0])
+    results = await datastore._query([query(chunks[1].embedding, top_k=10, document_id="doc")])
+    assert "doc_1" not in result_ids(results[0])
+
+
+@pytest.mark.asyncio
+async def test_chunk_hashes_wait_for_writers_off_the_event_loop(document_chunks):
+    datastore = faiss_datastore("flat")
+    await datastore._upsert(document_chunks)
+    released = threading.Event()
+
+    def write():
+        with datastore._lock.write():
+            released.wait(timeout=10)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    lookup = asyncio.ensure_future(datastore._get_chunk_hashes(["first-doc"]))
+    # The event loop keeps running while the lookup waits for the write lock
+    await asyncio.sleep(0.05)
+    assert not lookup.done()
+    released.set()
+    writer.join()
+
+    hashes = await lookup
+    assert sorted(hashes["first-doc"]) == sorted(chunk.id for chunk in document_chunks["first-doc"])
+
+
+@pytest.mark.asyncio
+async def test_saves_are_deferred_until_the_save_interval_or_a_flush(tmp_path, document_chunks):
+    path = str(tmp_path / "index.npz")
+    datastore = faiss_datastore(path=path, save_interval=60)
+    await datastore._upsert(document_chunks)
+    await datastore._delete_chunks(["first-doc_0"])
+    assert not os.path.exists(path)
+
+    datastore.flush()
+    assert datastore._save_timer is None
+    assert faiss_datastore(path=path)._index.ntotal == 2 * N_TEST_CHUNKS - 1
+
+    datastore.save_interval = 0.5
+    await datastore._delete_chunks(["first-doc_1"])
+    datastore._save_timer.join()
+    assert faiss_datastore(path=path)._index.ntotal == 2 * N_TEST_CHUNKS - 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+async def test_index_is_saved_and_loaded(index_type, tmp_path, document_chunks):
+    path = str(tmp_path / "index.npz")
+    datastore = faiss_datastore(index_type, path=path, save_interval=0)
+    await datastore._upsert(document_chunks)
+    await datastore._delete_chunks(["second-doc_0"])
+    embedding = create_embedding()
+    expected = await datastore._query([query(embedding), query(embedding, author="alice")])
+
+    loaded = faiss_datastore(index_type, path=path)
+    assert await loaded._query([query(embedding), query(embedding, author="alice")]) == expected
+
+    with pytest.raises(ValueError):
+        FaissDataStore(path=path, dimension=TEST_EMBEDDING_DIM + 1)
+
+
+@pytest.mark.asyncio
+async def test_incremental_upsert(monkeypatch):
+    monkeypatch.setattr(embedding_provider, "_embedding_provider", HashingEmbeddingProvider())
+    datastore = FaissDataStore(dimension=1536)
+    paragraphs = [
+        f"Paragraph {i} of the manual. " + "It explains one more setting in detail. " * 12
+        for i in range(6)
+    ]
+
+    document = Document(id="manual", text="\n".join(paragraphs))
+    assert await datastore.upsert([document], chunk_token_size=50) == ["manual"]
+    first_hashes = (await datastore._get_chunk_hashes(["manual"]))["manual"]
+    assert len(first_hashes) > 4
+
+    edited = Document(id="manual", text="\n".join(paragraphs[:-1] + ["A short ending."]))
+    await datastore.upsert([edited], chunk_token_size=50)
+    edited_hashes = (await datastore._get_chunk_hashes(["manual"]))["manual"]
+    assert len(edited_hashes) < len(first_hashes)
+    assert sorted(edited_hashes) == sorted(f"manual_{i}" for i in range(len(edited_hashes)))
+    assert edited_hashes["manual_1"] == first_hashes["manual_1"]
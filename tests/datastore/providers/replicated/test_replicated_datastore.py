@@ -0,0 +1,126 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from datastore.providers.chroma_datastore import ChromaDataStore
+from datastore.providers.replicated_datastore import ReplicatedDataStore
+from models.models import Document, Query
+from services import embedding_provider
+from services.embedding_provider import HashingEmbeddingProvider
+from services.metrics import REPLICATED_HEDGE_WINS, REPLICATED_HEDGES, REPLICATED_QUERIES
+
+
+class CountingEmbeddingProvider(HashingEmbeddingProvider):
+    def __init__(self):
+        super().__init__()
+        self.texts: List[str] = []
+
+    async def embed(self, texts: List[str], num_tokens=None) -> List[List[float]]:
+        self.texts.extend(texts)
+        return await super().embed(texts, num_tokens)
+
+
+@pytest.fixture(autouse=True)
+def provider(monkeypatch) -> CountingEmbeddingProvider:
+    provider = CountingEmbeddingProvider()
+    monkeypatch.setattr(embedding_provider, "_embedding_provider", provider)
+    return provider
+
+
+def chroma(name: str) -> ChromaDataStore:
+    return ChromaDataStore(collection_name=name, in_memory=True, persistence_dir=None)
+
+
+@pytest.fixture
+async def replicated_datastore() -> ReplicatedDataStore:
+    datastore = ReplicatedDataStore(
+        chroma("primary"), [chroma("replica-0"), chroma("replica-1")], hedge_min_delay_ms=20
+    )
+    await datastore.delete(delete_all=True)
+    await datastore.upsert(
+        [
+            Document(id="cats", text="Cats sleep most of the day."),
+            Document(id="dogs", text="Dogs like long walks."),
+        ]
+    )
+    return datastore
+
+
+def slow_down(monkeypatch, datastore: ChromaDataStore, seconds: float, calls: List[str]):
+    query = datastore._query
+
+    async def slow_query(queries):
+        calls.append("started")
+        await asyncio.sleep(seconds)
+        calls.append("finished")
+        return await query(queries)
+
+    monkeypatch.setattr(datastore, "_query", slow_query)
+
+
+@pytest.mark.asyncio
+async def test_writes_go_to_every_datastore(replicated_datastore, provider):
+    for datastore in replicated_datastore.datastores:
+        assert sorted(datastore._collection.get()["ids"]) == ["cats_0", "dogs_0"]
+    # Documents are embedded once, not once per replica
+    assert len(provider.texts) == 2
+
+    await replicated_datastore.upsert([Document(id="cats", text="Cats purr.")])
+    await replicated_datastore.delete(ids=["dogs"])
+    for datastore in replicated_datastore.datastores:
+        assert datastore._collection.get()["documents"] == ["Cats purr."]
+
+
+@pytest.mark.asyncio
+async def test_fast_primary_is_not_hedged(replicated_datastore, monkeypatch):
+    calls = []
+    slow_down(monkeypatch, replicated_datastore.replicas[0], 0, calls)
+
+    results = await replicated_datastore.query([Query(query="sleep", top_k=1)])
+
+    assert results[0].results[0].id == "cats_0"
+    assert calls == []
+    assert replicated_datastore.stats()["hedges"] == 0
+
+
+@pytest.mark.asyncio
+async def test_slow_primary_is_hedged_and_cancelled(replicated_datastore, monkeypatch):
+    primary_calls = []
+    slow_down(monkeypatch, replicated_datastore.primary, 1, primary_calls)
+    exported = [REPLICATED_QUERIES.get(), REPLICATED_HEDGES.get(), REPLICATED_HEDGE_WINS.get()]
+
+    results = await replicated_datastore.query([Query(query="sleep", top_k=1)])
+
+    assert results[0].results[0].id == "cats_0"
+    assert primary_calls == ["started"]
+    stats = replicated_datastore.stats()
+    assert stats["hedges"] == 1
+    assert stats["hedge_wins"] == 1
+    assert [
+        REPLICATED_QUERIES.get(), REPLICATED_HEDGES.get(), REPLICATED_HEDGE_WINS.get()
+    ] == [count + 1 for count in exported]
+
+
+@pytest.mark.asyncio
+async def test_failed_primary_falls_back_to_a_replica(replicated_datastore, monkeypatch):
+    async def fail(queries):
+        raise RuntimeError("primary is down")
+
+    monkeypatch.setattr(replicated_datastore.primary, "_query", fail)
+
+    results = await replicated_datastore.query([Query(query="walks", top_k=1)])
+
+    assert results[0].results[0].id == "dogs_0"
+
+
+@pytest.mark.asyncio
+async def test_hedge_delay_follows_primary_latency(replicated_datastore):
+    assert replicated_datastore.get_hedge_delay() == pytest.approx(0.02)
+
+    replicated_datastore._latencies.extend([0.01] * 90 + [0.5] * 10)
+    assert replicated_datastore.get_hedge_delay() == pytest.approx(0.5)
+
+    replicated_datastore._latencies.clear()
+    replicated_datastore._latencies.extend([0.001] * 100)
+    assert replicated_datastore.get_hedge_delay() == pytest.approx(0.02)
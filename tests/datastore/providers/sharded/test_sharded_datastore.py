@@ -0,0 +1,151 @@
+import json
+import sys
+from collections import Counter
+
+import pytest
+
+from datastore.factory import get_datastore, get_datastore_from_spec
+from datastore.providers.chroma_datastore import ChromaDataStore
+from datastore.providers.sharded_datastore import HashRing, ShardedDataStore
+from models.models import Document, DocumentMetadataFilter, Query
+from services import embedding_provider
+from services.embedding_provider import HashingEmbeddingProvider
+
+N_SHARDS = 3
+
+
+@pytest.fixture(autouse=True)
+def hashing_embeddings(monkeypatch):
+    monkeypatch.setattr(embedding_provider, "_embedding_provider", HashingEmbeddingProvider())
+
+
+def chroma_shard(name: str) -> ChromaDataStore:
+    return ChromaDataStore(collection_name=name, in_memory=True, persistence_dir=None)
+
+
+@pytest.fixture
+async def sharded_datastore() -> ShardedDataStore:
+    datastore = ShardedDataStore([chroma_shard(f"shard-{i}") for i in range(N_SHARDS)])
+    await datastore.delete(delete_all=True)
+    return datastore
+
+
+@pytest.fixture
+def documents():
+    return [
+        Document(id=f"doc-{i}", text=f"Document {i} is about topic {i % 4} and nothing else.")
+        for i in range(30)
+    ]
+
+
+def test_hash_ring_spreads_and_keeps_keys():
+    keys = [f"doc-{i}" for i in range(3000)]
+    ring = HashRing(4)
+    counts = Counter(ring.get_shard(key) for key in keys)
+
+    assert set(counts) == {0, 1, 2, 3}
+    assert min(counts.values()) > 3000 / 4 * 0.6
+
+    # Adding a shard only moves keys to the new shard
+    larger_ring = HashRing(5)
+    moved = [key for key in keys if larger_ring.get_shard(key) != ring.get_shard(key)]
+    assert all(larger_ring.get_shard(key) == 4 for key in moved)
+    assert len(moved) < 3000 / 5 * 1.5
+
+
+@pytest.mark.asyncio
+async def test_upsert_routes_documents_to_their_shard(sharded_datastore, documents):
+    ids = await sharded_datastore.upsert(documents)
+
+    assert ids == [document.id for document in documents]
+    for i, shard in enumerate(sharded_datastore.shards):
+        stored = {metadata["document_id"] for metadata in shard._collection.get()["metadatas"]}
+        assert stored == {
+            document.id
+            for document in documents
+            if sharded_datastore.get_shard(document.id) is shard
+        }
+        assert stored
+
+
+@pytest.mark.asyncio
+async def test_upsert_assigns_missing_ids(sharded_datastore):
+    (doc_id,) = await sharded_datastore.upsert([Document(text="A document without an id.")])
+
+    stored = sharded_datastore.get_shard(doc_id)._collection.get()["metadatas"]
+    assert [metadata["document_id"] for metadata in stored] == [doc_id]
+
+
+@pytest.mark.asyncio
+async def test_query_merges_the_best_results_of_all_shards(sharded_datastore, documents):
+    single = chroma_shard("single")
+    await single.delete(delete_all=True)
+    await single.upsert(documents)
+    await sharded_datastore.upsert(documents)
+
+    queries = [
+        Query(query="Document 7 is about topic 3", top_k=5),
+        Query(query="topic 1", top_k=8, filter=DocumentMetadataFilter(document_id="doc-5")),
+    ]
+    expected = await single.query(queries)
+    results = await sharded_datastore.query(queries)
+
+    # Compare scores rather than ids, results with equal scores can come in any order
+    for result, expected_result in zip(results, expected):
+        assert [r.score for r in result.results] == pytest.approx(
+            [r.score for r in expected_result.results]
+        )
+    assert len(results[0].results) == 5
+    assert results[0].results[0].id == "doc-7_0"
+
+
+@pytest.mark.asyncio
+async def test_delete_is_broadcast(sharded_datastore, documents):
+    await sharded_datastore.upsert(documents)
+    # A stray copy on another shard, as left behind when the shards change
+    stray_shard = next(
+        shard for shard in sharded_datastore.shards if shard is not sharded_datastore.get_shard("doc-0")
+    )
+    await stray_shard.upsert([documents[0]])
+
+    assert await sharded_datastore.delete(ids=["doc-0", "doc-1"])
+
+    for shard in sharded_datastore.shards:
+        stored = {metadata["document_id"] for metadata in shard._collection.get()["metadatas"]}
+        assert not stored & {"doc-0", "doc-1"}
+
+
+@pytest.mark.asyncio
+async def test_init_creates_shards_from_the_environment():
+    shards = json.dumps(
+        [
+            {"datastore": "chroma", "env": {"CHROMA_COLLECTION": "env-shard-0", "CHROMA_PERSISTENCE_DIR": ""}},
+            {"datastore": "chroma", "env": {"CHROMA_COLLECTION": "env-shard-1", "CHROMA_PERSISTENCE_DIR": ""}},
+        ]
+    )
+
+    datastore = await ShardedDataStore.init(shards)
+
+    assert [shard._collection.name for shard in datastore.shards] == ["env-shard-0", "env-shard-1"]
+    assert datastore.score_is_distance
+
+
+@pytest.mark.asyncio
+async def test_init_rejects_nested_shards():
+    with pytest.raises(ValueError):
+        await ShardedDataStore.init(json.dumps(["sharded"]))
+
+
+@pytest.mark.asyncio
+async def test_providers_first_imported_for_a_shard_keep_none_of_its_settings(monkeypatch):
+    monkeypatch.delitem(sys.modules, "datastore.providers.numpy_datastore", raising=False)
+    monkeypatch.delenv("NUMPY_COMPACTION_THRESHOLD", raising=False)
+
+    shard = await get_datastore_from_spec(
+        {"datastore": "numpy", "env": {"NUMPY_COMPACTION_THRESHOLD": "0.9"}}
+    )
+    assert shard.compaction_threshold == 0.9
+    assert "datastore.providers.numpy_datastore" not in sys.modules
+
+    datastore = await get_datastore("numpy")
+    assert datastore.compaction_threshold == 0.25
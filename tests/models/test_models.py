@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from pydantic import ValidationError
+
+from models.api import QueryResponse
+from models.models import (
+    DocumentChunk,
+    DocumentChunkMetadata,
+    DocumentChunkWithScore,
+    QueryResult,
+    QueryWithEmbedding,
+)
+
+
+def test_embedding_is_float32_array():
+    chunk = DocumentChunk(text="text", metadata=DocumentChunkMetadata(), embedding=[1, 2.5])
+    assert isinstance(chunk.embedding, np.ndarray)
+    assert chunk.embedding.dtype == np.float32
+    assert chunk.embedding.tolist() == [1.0, 2.5]
+
+
+def test_embedding_assignment_is_validated():
+    chunk = DocumentChunk(text="text", metadata=DocumentChunkMetadata())
+    chunk.embedding = [0.5, 0.25]
+    assert chunk.embedding.dtype == np.float32
+
+
+def test_embedding_row_is_not_copied():
+    matrix = np.ones((2, 3), dtype=np.float32)
+    chunk = DocumentChunk(text="text", metadata=DocumentChunkMetadata(), embedding=matrix[1])
+    assert np.shares_memory(chunk.embedding, matrix)
+
+
+def test_embedding_must_be_one_dimensional():
+    with pytest.raises(ValidationError):
+        QueryWithEmbedding(query="q", embedding=[[1.0], [2.0]])
+    with pytest.raises(ValidationError):
+        QueryWithEmbedding(query="q", embedding=["not a number"])
+
+
+def test_embedding_json():
+    query = QueryWithEmbedding(query="q", embedding=[0.5, 0.25])
+    assert '"embedding": [0.5, 0.25]' in query.json()
+
+    response = QueryResponse(
+        results=[
+            QueryResult(
+                query="q",
+                results=[
+                    DocumentChunkWithScore(
+                        text="text",
+                        metadata=DocumentChunkMetadata(),
+                        embedding=[1.0],
+                        score=0.5,
+                    )
+                ],
+            )
+        ]
+    )
+    assert '"embedding": [1.0]' in response.json()
+    assert QueryWithEmbedding.schema()["properties"]["embedding"]["type"] == "array"
+
+
+def test_models_with_embeddings_compare_by_value():
+    def chunk(embedding):
+        return DocumentChunkWithScore(
+            id="doc_0", text="text", metadata=DocumentChunkMetadata(), embedding=embedding, score=0.5
+        )
+
+    assert chunk([1.0, 2.0]) == chunk([1.0, 2.0])
+    assert chunk([1.0, 2.0]) != chunk([1.0, 3.0])
+    assert chunk([1.0, 2.0]) != chunk([1.0, 2.0, 3.0])
+    assert chunk([1.0, 2.0]) != chunk(None)
+    assert chunk([1.0, 2.0]) in [chunk(None), chunk([1.0, 2.0])]
+
+    chunks = [chunk([1.0]), chunk([2.0])]
+    chunks.remove(chunk([2.0]))
+    assert chunks == [chunk([1.0])]
+
+    result = QueryResult(query="q", results=[chunk([1.0, 2.0])])
+    assert result == QueryResult(query="q", results=[chunk([1.0, 2.0])])
+    assert result != QueryResult(query="q", results=[chunk([2.0, 1.0])])
+    assert QueryResponse(results=[result]) == QueryResponse(results=[result])
+    assert QueryWithEmbedding(query="q", embedding=[0.5]) == QueryWithEmbedding(query="q", embedding=[0.5])
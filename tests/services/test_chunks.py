@@ -0,0 +1,191 @@
+import asyncio
+import random
+import string
+
+import pytest
+
+from benchmarks.chunking import make_text, slicing_text_chunks
+from models.models import Document
+from services import chunks, embedding_provider
+from services.chunks import (
+    chunk_documents,
+    iter_document_chunk_batches,
+    iter_text_chunks,
+    iter_text_segments,
+    get_embedding_batches,
+    get_text_chunks,
+    get_text_chunks_with_token_counts,
+    tokenizer,
+)
+from services.embedding_provider import HashingEmbeddingProvider
+
+
+def test_get_embedding_batches_packs_by_tokens():
+    assert get_embedding_batches([40, 40, 40, 10, 90], max_batch_tokens=100) == [
+        (0, 2),
+        (2, 4),
+        (4, 5),
+    ]
+
+
+def test_get_embedding_batches_respects_batch_size():
+    assert get_embedding_batches([1] * 5, max_batch_tokens=100, max_batch_size=2) == [
+        (0, 2),
+        (2, 4),
+        (4, 5),
+    ]
+
+
+def test_get_embedding_batches_keeps_oversized_texts_alone():
+    assert get_embedding_batches([10, 500, 10], max_batch_tokens=100) == [
+        (0, 1),
+        (1, 2),
+        (2, 3),
+    ]
+    assert get_embedding_batches([]) == []
+
+
+def test_get_text_chunks_with_token_counts():
+    text = "This is a sentence about embeddings. " * 200
+
+    chunks = get_text_chunks_with_token_counts(text, 50)
+
+    assert [chunk_text for chunk_text, _ in chunks] == get_text_chunks(text, 50)
+    assert all(num_tokens <= 50 for _, num_tokens in chunks)
+    assert sum(num_tokens for _, num_tokens in chunks) <= len(tokenizer.encode(text))
+
+
+@pytest.mark.parametrize("chunk_token_size", [None, 50, 1000])
+def test_get_text_chunks_matches_slicing_chunker(chunk_token_size):
+    text = make_text(200_000, seed=1) + "\n\n   \n" + "tail without punctuation " * 30
+
+    assert get_text_chunks_with_token_counts(
+        text, chunk_token_size
+    ) == slicing_text_chunks(text, chunk_token_size)
+
+
+def test_get_text_chunks_matches_slicing_chunker_on_merged_punctuation():
+    # Punctuation merges with the characters around it into tokens such as "?!(", ".\"" or ")\"",
+    # which a chunk boundary or the cut at the last punctuation mark can go through
+    rng = random.Random(4)
+    characters = string.ascii_letters + ' \n.?!()"' + " " * 5
+    pieces = ["?!(", '."', ')"', "!(", "?("]
+
+    for _ in range(200):
+        text = "".join(
+            rng.choice(pieces) if rng.random() < 0.1 else rng.choice(characters)
+            for _ in range(rng.randint(500, 3000))
+        )
+        assert get_text_chunks_with_token_counts(text, 50) == slicing_text_chunks(text, 50)
+
+
+async def test_chunk_documents_in_worker_processes(monkeypatch):
+    documents = [
+        Document(id=f"doc-{i}", text=make_text(5_000, seed=i)) for i in range(5)
+    ] + [Document(id="empty", text="  ")]
+    in_thread = await chunk_documents(documents, None)
+
+    monkeypatch.setattr(chunks, "CHUNKING_PROCESSES", 2)
+    monkeypatch.setattr(chunks, "CHUNKING_PROCESS_MIN_DOCUMENTS", 1)
+    try:
+        in_processes = await chunk_documents(documents, None)
+    finally:
+        chunks.shutdown_chunking_pool()
+
+    assert [doc_id for _, _, doc_id in in_processes] == [doc.id for doc in documents]
+    assert in_processes == in_thread
+    assert in_processes[-1] == ([], [], "empty")
+
+
+def test_iter_text_segments_keep_tokens():
+    text = make_text(50_000, seed=2) + "x" * 5_000 + " tail"
+    segments = list(iter_text_segments(text, segment_chars=1_000))
+
+    assert len(segments) > 1
+    assert "".join(segments) == text
+    # Only the run of 5000 characters without any boundary is cut arbitrarily
+    tokens = [token for segment in segments for token in tokenizer.encode(segment)]
+    assert tokens[:1000] == tokenizer.encode(text)[:1000]
+
+
+def test_iter_text_chunks_from_pieces():
+    text = make_text(100_000, seed=3)
+    lines = text.splitlines(keepends=True)
+
+    assert list(iter_text_chunks(iter(lines), None)) == get_text_chunks_with_token_counts(
+        text, None
+    )
+
+
+def test_get_text_chunks_has_no_chunk_cap():
+    text = "Many short words in a long text. " * 10_000
+
+    assert len(get_text_chunks(text, 5)) > 10_000
+
+
+async def test_iter_document_chunk_batches(monkeypatch):
+    monkeypatch.setattr(embedding_provider, "_embedding_provider", HashingEmbeddingProvider())
+    documents = [
+        Document(id="long", text=make_text(5_000, seed=4)),
+        Document(id="empty", text=" "),
+        Document(id="short", text="A short document about embeddings."),
+    ]
+    expected = {
+        doc_id: [chunk.text for chunk in doc_chunks]
+        for doc_chunks, _, doc_id in await chunk_documents(documents, 50)
+    }
+
+    batches = [batch async for batch in iter_document_chunk_batches(documents, 50, max_chunks=3)]
+
+    assert len(batches) > 2
+    assert all(sum(len(doc_chunks) for doc_chunks in batch.values()) <= 3 for batch in batches)
+    merged = {}
+    for batch in batches:
+        for doc_id, doc_chunks in batch.items():
+            merged.setdefault(doc_id, []).extend(doc_chunks)
+            assert all(chunk.embedding is not None for chunk in doc_chunks)
+    assert {doc_id: [chunk.text for chunk in doc_chunks] for doc_id, doc_chunks in merged.items()} == expected
+    assert [chunk.id for chunk in merged["long"]] == [f"long_{i}" for i in range(len(merged["long"]))]
+
+
+class SlowEmbeddingProvider(HashingEmbeddingProvider):
+    def __init__(self, events, fail_after=None):
+        super().__init__()
+        self.events = events
+        self.fail_after = fail_after
+        self.calls = 0
+
+    async def embed(self, texts, num_tokens=None):
+        self.calls += 1
+        if self.fail_after is not None and self.calls > self.fail_after:
+            raise RuntimeError("embedding failed")
+        self.events.append(("embed", texts[0]))
+        await asyncio.sleep(0.01)
+        return await super().embed(texts, num_tokens)
+
+
+async def test_iter_document_chunk_batches_overlaps_stages(monkeypatch):
+    events = []
+    monkeypatch.setattr(embedding_provider, "_embedding_provider", SlowEmbeddingProvider(events))
+    documents = [Document(id=f"doc-{i}", text=f"Document number {i} is about pipelines.") for i in range(4)]
+
+    async for batch in iter_document_chunk_batches(documents, 50, max_chunks=1):
+        (doc_id,) = batch
+        events.append(("write start", doc_id))
+        await asyncio.sleep(0.03)
+        events.append(("write end", doc_id))
+
+    # The next batch is embedded while the previous one is written
+    assert events.index(("embed", "Document number 1 is about pipelines.")) < events.index(("write end", "doc-0"))
+    assert [event for event in events if event[0] == "write end"] == [("write end", f"doc-{i}") for i in range(4)]
+
+
+async def test_iter_document_chunk_batches_raises_stage_errors(monkeypatch):
+    monkeypatch.setattr(embedding_provider, "_embedding_provider", SlowEmbeddingProvider([], fail_after=1))
+    documents = [Document(id=f"doc-{i}", text=f"Document number {i}.") for i in range(3)]
+
+    written = []
+    with pytest.raises(RuntimeError, match="embedding failed"):
+        async for batch in iter_document_chunk_batches(documents, 50, max_chunks=1):
+            written.extend(batch)
+    assert written == ["doc-0"]
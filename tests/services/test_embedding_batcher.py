@@ -0,0 +1,71 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from services.embedding_batcher import EmbeddingBatcher
+
+
+class FakeEmbedder:
+    def __init__(self):
+        self.requests: List[List[str]] = []
+
+    async def __call__(self, texts: List[str]) -> List[List[float]]:
+        self.requests.append(texts)
+        return [[float(len(text))] for text in texts]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_request():
+    embedder = FakeEmbedder()
+    batcher = EmbeddingBatcher(embedder, max_wait_ms=5, max_batch_size=100)
+
+    results = await asyncio.gather(
+        batcher.embed(["a"]), batcher.embed(["bb", "ccc"]), batcher.embed(["dddd"])
+    )
+
+    assert results == [[[1.0]], [[2.0], [3.0]], [[4.0]]]
+    assert embedder.requests == [["a", "bb", "ccc", "dddd"]]
+
+
+@pytest.mark.asyncio
+async def test_flushes_when_batch_is_full():
+    embedder = FakeEmbedder()
+    batcher = EmbeddingBatcher(embedder, max_wait_ms=10000, max_batch_size=2)
+
+    results = await asyncio.wait_for(
+        asyncio.gather(batcher.embed(["a"]), batcher.embed(["bb"])), timeout=1
+    )
+
+    assert results == [[[1.0]], [[2.0]]]
+    assert embedder.requests == [["a", "bb"]]
+
+
+@pytest.mark.asyncio
+async def test_passes_total_token_count_when_every_caller_knows_it():
+    requested = []
+
+    async def embed(texts: List[str], num_tokens=None) -> List[List[float]]:
+        requested.append((texts, num_tokens))
+        return [[0.0] for _ in texts]
+
+    batcher = EmbeddingBatcher(embed, max_wait_ms=5, max_batch_size=100)
+
+    await asyncio.gather(batcher.embed(["a"], num_tokens=1), batcher.embed(["bb"], num_tokens=2))
+    await asyncio.gather(batcher.embed(["a"], num_tokens=1), batcher.embed(["bb"]))
+
+    assert requested == [(["a", "bb"], 3), (["a", "bb"], None)]
+
+
+@pytest.mark.asyncio
+async def test_errors_are_raised_to_every_caller():
+    async def failing_embed(texts: List[str]) -> List[List[float]]:
+        raise RuntimeError("embeddings unavailable")
+
+    batcher = EmbeddingBatcher(failing_embed, max_wait_ms=1, max_batch_size=100)
+
+    results = await asyncio.gather(
+        batcher.embed(["a"]), batcher.embed(["b"]), return_exceptions=True
+    )
+
+    assert all(isinstance(result, RuntimeError) for result in results)
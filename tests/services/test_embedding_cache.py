@@ -0,0 +1,145 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import pytest
+
+import services.embedding_cache as embedding_cache
+from services.embedding_cache import EmbeddingCache, get_embeddings_with_cache
+from services.metrics import EMBEDDED_TOKENS, EMBEDDING_CACHE_ENTRIES, EMBEDDING_CACHE_LOOKUPS
+
+MODEL = "text-embedding-ada-002"
+
+
+@pytest.fixture
+def cache(tmp_path) -> EmbeddingCache:
+    return EmbeddingCache(str(tmp_path / "embeddings.sqlite"), max_entries=3)
+
+
+def test_get_many_returns_none_for_misses(cache: EmbeddingCache):
+    cache.put_many(MODEL, ["a"], [[0.5, 0.25]])
+    hits, misses = EMBEDDING_CACHE_LOOKUPS.get(result="hit"), EMBEDDING_CACHE_LOOKUPS.get(result="miss")
+
+    assert cache.get_many(MODEL, ["a", "b"]) == [[0.5, 0.25], None]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+    assert EMBEDDING_CACHE_LOOKUPS.get(result="hit") == hits + 1
+    assert EMBEDDING_CACHE_LOOKUPS.get(result="miss") == misses + 1
+    assert EMBEDDING_CACHE_ENTRIES.get() == 1
+
+
+def test_keys_include_model(cache: EmbeddingCache):
+    cache.put_many(MODEL, ["a"], [[1.0]])
+
+    assert cache.get_many("another-model", ["a"]) == [None]
+
+
+def test_evicts_least_recently_used(cache: EmbeddingCache):
+    cache.put_many(MODEL, ["a", "b", "c"], [[1.0], [2.0], [3.0]])
+    # Touch "a" so that "b" becomes the least recently used entry
+    cache.get_many(MODEL, ["a"])
+    cache.put_many(MODEL, ["d"], [[4.0]])
+
+    assert cache.get_many(MODEL, ["a", "b", "c", "d"]) == [[1.0], None, [3.0], [4.0]]
+    assert cache.stats()["entries"] == 3
+
+
+def test_lookups_defer_access_time_writes(cache: EmbeddingCache, monkeypatch):
+    monkeypatch.setattr(embedding_cache, "ACCESS_TIME_FLUSH_SIZE", 2)
+    cache.put_many(MODEL, ["a", "b"], [[1.0], [2.0]])
+    changes = cache._conn.total_changes
+
+    cache.get_many(MODEL, ["a"])
+    assert cache._conn.total_changes == changes
+    cache.get_many(MODEL, ["b"])
+    assert cache._conn.total_changes == changes + 2
+
+
+def test_entries_are_counted_without_duplicates(cache: EmbeddingCache):
+    cache.put_many(MODEL, ["a", "b", "a"], [[1.0], [2.0], [1.0]])
+    cache.put_many(MODEL, ["b", "c"], [[2.0], [3.0]])
+
+    assert cache.stats()["entries"] == 3
+    (count,) = cache._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+    assert count == 3
+
+
+def test_concurrent_lookups_are_all_counted(cache: EmbeddingCache):
+    cache.put_many(MODEL, ["a"], [[1.0]])
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: cache.get_many(MODEL, ["a", "b"]), range(200)))
+
+    assert cache.stats()["hits"] == 200
+    assert cache.stats()["misses"] == 200
+
+
+def test_persists_across_instances(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    EmbeddingCache(path).put_many(MODEL, ["a"], [[1.0, 2.0]])
+
+    assert EmbeddingCache(path).get_many(MODEL, ["a"]) == [[1.0, 2.0]]
+
+
+@pytest.mark.asyncio
+async def test_get_embeddings_with_cache_only_embeds_misses(
+    cache: EmbeddingCache, monkeypatch
+):
+    requested: List[List[str]] = []
+
+    async def fake_embed(texts: List[str], num_tokens: int) -> List[List[float]]:
+        requested.append(texts)
+        return [[float(len(text))] for text in texts]
+
+    monkeypatch.setattr(embedding_cache, "_embedding_cache", cache)
+
+    assert await get_embeddings_with_cache(
+        ["a", "bb", "a"], embed=fake_embed
+    ) == [[1.0], [2.0], [1.0]]
+    assert await get_embeddings_with_cache(["bb", "ccc"], embed=fake_embed) == [
+        [2.0],
+        [3.0],
+    ]
+    assert requested == [["a", "bb"], ["ccc"]]
+
+
+@pytest.mark.asyncio
+async def test_get_embeddings_with_cache_passes_token_counts_of_misses(
+    cache: EmbeddingCache, monkeypatch
+):
+    requested: List[Tuple[List[str], int]] = []
+
+    async def fake_embed(texts: List[str], num_tokens: int) -> List[List[float]]:
+        requested.append((texts, num_tokens))
+        return [[float(len(text))] for text in texts]
+
+    monkeypatch.setattr(embedding_cache, "_embedding_cache", cache)
+
+    await get_embeddings_with_cache(["a", "bb"], embed=fake_embed, token_counts=[1, 2])
+    await get_embeddings_with_cache(
+        ["bb", "ccc", "dddd", "ccc"], embed=fake_embed, token_counts=[2, 3, 4, 3]
+    )
+    assert requested == [(["a", "bb"], 3), (["ccc", "dddd"], 7)]
+
+
+@pytest.mark.asyncio
+async def test_get_embeddings_with_cache_counts_only_embedded_tokens(
+    cache: EmbeddingCache, monkeypatch
+):
+    requested: List[Tuple[List[str], int]] = []
+
+    async def fake_embed(texts: List[str], num_tokens: int) -> List[List[float]]:
+        requested.append((texts, num_tokens))
+        return [[float(len(text))] for text in texts]
+
+    monkeypatch.setattr(embedding_cache, "_embedding_cache", cache)
+    tokens = EMBEDDED_TOKENS.get()
+
+    await get_embeddings_with_cache(["a", "bb"], embed=fake_embed, token_counts=[1, 2])
+    # Cache hits are not counted
+    await get_embeddings_with_cache(["a", "bb"], embed=fake_embed, token_counts=[1, 2])
+    assert EMBEDDED_TOKENS.get() == tokens + 3
+
+    # Queries have no token counts, they are tokenized once and counted too
+    await get_embeddings_with_cache(["hello world"], embed=fake_embed)
+    assert requested[-1] == (["hello world"], 2)
+    assert EMBEDDED_TOKENS.get() == tokens + 5
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from services.embedding_profile import EmbeddingProfile
+
+
+def test_apply_keeps_matching_dimension():
+    profile = EmbeddingProfile(dimension=3)
+    matrix = profile.apply([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+    assert matrix.dtype == np.float32
+    assert matrix.tolist() == [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]
+
+
+def test_apply_truncates_and_renormalizes():
+    profile = EmbeddingProfile(dimension=2)
+    matrix = profile.apply([[3.0, 4.0, 12.0], [0.0, 0.0, 1.0]])
+    assert matrix.shape == (2, 2)
+    np.testing.assert_allclose(matrix[0], [0.6, 0.8], rtol=1e-6)
+    # A vector that truncates to zero stays zero rather than dividing by zero
+    assert matrix[1].tolist() == [0.0, 0.0]
+
+
+def test_apply_rejects_narrow_embeddings():
+    with pytest.raises(ValueError):
+        EmbeddingProfile(dimension=4).apply([[1.0, 0.0]])
+
+
+def test_apply_empty_batch():
+    assert EmbeddingProfile(dimension=4).apply([]).shape == (0, 4)
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{"dimension": 0}, {"dtype": "float64"}, {"metric": "hamming"}]
+)
+def test_invalid_profile(kwargs):
+    with pytest.raises(ValueError):
+        EmbeddingProfile(**kwargs)
+
+
+def test_numpy_dtype():
+    assert EmbeddingProfile(dtype="float16").numpy_dtype == np.float16
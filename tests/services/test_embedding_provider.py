@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+import services.embedding_provider as embedding_provider
+from services.embedding_provider import (
+    HashingEmbeddingProvider,
+    OpenAIEmbeddingProvider,
+    get_embedding_provider,
+)
+
+
+@pytest.mark.asyncio
+async def test_hashing_embeddings_are_deterministic_and_normalized():
+    provider = HashingEmbeddingProvider(dimension=64)
+
+    first = await provider.embed(["The quick brown fox", ""])
+    second = await HashingEmbeddingProvider(dimension=64).embed(["The quick brown fox", ""])
+
+    assert first == second
+    assert len(first[0]) == 64
+    assert np.allclose(np.linalg.norm(np.array(first), axis=1), 1.0)
+
+
+def test_hashing_embeddings_reflect_shared_words():
+    provider = HashingEmbeddingProvider(dimension=256)
+
+    query, related, unrelated = provider.embed_sync(
+        ["revenue in Q3", "Q3 revenue report", "the cat sat on the mat"]
+    )
+
+    assert query @ related > query @ unrelated
+
+
+@pytest.mark.parametrize(
+    "name, provider_class",
+    [("openai", OpenAIEmbeddingProvider), ("hash", HashingEmbeddingProvider)],
+)
+def test_get_embedding_provider(monkeypatch, name, provider_class):
+    monkeypatch.setattr(embedding_provider, "_embedding_provider", None)
+    monkeypatch.setenv("EMBEDDING_PROVIDER", name)
+
+    assert isinstance(get_embedding_provider(), provider_class)
+
+
+def test_get_embedding_provider_rejects_unknown_names(monkeypatch):
+    monkeypatch.setattr(embedding_provider, "_embedding_provider", None)
+    monkeypatch.setenv("EMBEDDING_PROVIDER", "unknown")
+
+    with pytest.raises(ValueError):
+        get_embedding_provider()
+
+
+def test_get_embedding_provider_rejects_narrow_embeddings(monkeypatch):
+    monkeypatch.setattr(embedding_provider, "_embedding_provider", None)
+    monkeypatch.setattr(embedding_provider, "EMBEDDING_DIMENSION", 4096)
+    monkeypatch.setenv("EMBEDDING_PROVIDER", "hash")
+
+    with pytest.raises(ValueError, match="EMBEDDING_DIMENSION"):
+        get_embedding_provider()
+    assert embedding_provider._embedding_provider is None
@@ -0,0 +1,154 @@
+import asyncio
+from typing import List
+
+import pytest
+
+import services.jobs as jobs
+from models.models import Document
+from services.jobs import (
+    JOB_FAILED,
+    JOB_PENDING,
+    JOB_RUNNING,
+    JOB_SUCCEEDED,
+    JOB_UPSERT,
+    JOB_UPSERT_FILE,
+    JobQueue,
+    start_job_workers,
+    stop_job_workers,
+)
+
+
+@pytest.fixture
+def queue(tmp_path) -> JobQueue:
+    return JobQueue(str(tmp_path / "jobs.sqlite"), max_attempts=2, retry_delay_seconds=0)
+
+
+async def test_enqueue_and_claim(queue: JobQueue):
+    job_id = await queue.enqueue(
+        JOB_UPSERT, {"documents": [{"id": "a", "text": "hello"}]}
+    )
+
+    assert (await queue.get(job_id))["status"] == JOB_PENDING
+    job = await queue.claim()
+    assert job["id"] == job_id
+    assert job["attempts"] == 1
+    assert job["payload"] == {"documents": [{"id": "a", "text": "hello"}]}
+    assert (await queue.get(job_id))["status"] == JOB_RUNNING
+    assert await queue.claim() is None
+
+    await queue.complete(job_id, ["a"])
+    assert (await queue.get(job_id))["status"] == JOB_SUCCEEDED
+    assert (await queue.get(job_id))["ids"] == ["a"]
+
+
+async def test_get_unknown_job(queue: JobQueue):
+    assert await queue.get("missing") is None
+
+
+async def test_failed_jobs_are_retried_until_max_attempts(queue: JobQueue):
+    job_id = await queue.enqueue(JOB_UPSERT, {"documents": []})
+
+    job = await queue.claim()
+    await queue.fail(job_id, job["attempts"], "boom")
+    assert (await queue.get(job_id))["status"] == JOB_PENDING
+    assert (await queue.get(job_id))["error"] == "boom"
+
+    job = await queue.claim()
+    assert job["attempts"] == 2
+    await queue.fail(job_id, job["attempts"], "boom again")
+    assert (await queue.get(job_id))["status"] == JOB_FAILED
+    assert await queue.claim() is None
+
+
+async def test_retries_are_delayed(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"), retry_delay_seconds=60)
+    job_id = await queue.enqueue(JOB_UPSERT, {"documents": []})
+    await queue.fail(job_id, (await queue.claim())["attempts"], "boom")
+
+    assert (await queue.get(job_id))["status"] == JOB_PENDING
+    assert await queue.claim() is None
+
+
+async def test_running_jobs_are_claimed_again_once_their_lease_expires(tmp_path):
+    path = str(tmp_path / "jobs.sqlite")
+    queue = JobQueue(path, max_attempts=2, lease_seconds=0.05)
+    job_id = await queue.enqueue(JOB_UPSERT, {"documents": []})
+    await queue.claim()
+    queue.close()
+
+    # Another process sharing the file leaves the job to its worker until the lease expires
+    restarted = JobQueue(path, max_attempts=2, lease_seconds=0.05)
+    assert (await restarted.get(job_id))["status"] == JOB_RUNNING
+    assert await restarted.claim() is None
+
+    await asyncio.sleep(0.1)
+    job = await restarted.claim()
+    assert job["id"] == job_id
+    assert job["attempts"] == 2
+
+    # A job interrupted max_attempts times is not run again
+    await asyncio.sleep(0.1)
+    assert await restarted.claim() is None
+    assert (await restarted.get(job_id))["status"] == JOB_FAILED
+
+
+async def test_renewed_leases_do_not_expire(queue: JobQueue):
+    queue.lease_seconds = 0.05
+    job_id = await queue.enqueue(JOB_UPSERT, {"documents": []})
+    await queue.claim()
+
+    for _ in range(4):
+        await asyncio.sleep(0.03)
+        await queue.renew(job_id)
+        assert await queue.claim() is None
+
+
+async def test_concurrent_claims_take_each_job_once(tmp_path):
+    path = str(tmp_path / "jobs.sqlite")
+    queues = [JobQueue(path) for _ in range(4)]
+    job_ids = [await queues[0].enqueue(JOB_UPSERT, {"documents": []}) for _ in range(20)]
+
+    async def drain(queue: JobQueue) -> List[str]:
+        claimed = []
+        while (job := await queue.claim()) is not None:
+            claimed.append(job["id"])
+        return claimed
+
+    claimed = await asyncio.gather(*[drain(queue) for queue in queues])
+    assert sorted(job_id for ids in claimed for job_id in ids) == sorted(job_ids)
+
+
+async def test_workers_run_jobs(queue: JobQueue, monkeypatch):
+    monkeypatch.setattr(jobs, "_job_queue", queue)
+    upserted: List[Document] = []
+    calls = 0
+
+    async def upsert(documents: List[Document]) -> List[str]:
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise RuntimeError("datastore unavailable")
+        upserted.extend(documents)
+        return [document.id for document in documents]  # type: ignore
+
+    job_id = await queue.enqueue(
+        JOB_UPSERT, {"documents": [{"id": "a", "text": "hello"}]}
+    )
+    file_job_id = await queue.enqueue(
+        JOB_UPSERT_FILE,
+        {"metadata": {"source": "file"}, "mimetype": "text/plain"},
+        file=b"file contents",
+    )
+    start_job_workers(upsert, num_workers=2)
+    try:
+        for _ in range(100):
+            statuses = [(await queue.get(i))["status"] for i in (job_id, file_job_id)]
+            if all(status == JOB_SUCCEEDED for status in statuses):
+                break
+            await asyncio.sleep(0.05)
+    finally:
+        await stop_job_workers()
+
+    assert (await queue.get(job_id))["status"] == JOB_SUCCEEDED
+    assert (await queue.get(file_job_id))["status"] == JOB_SUCCEEDED
+    assert sorted(document.text for document in upserted) == ["file contents", "hello"]
@@ -0,0 +1,132 @@
+import asyncio
+from typing import Dict, List
+
+import pytest
+
+from datastore.datastore import DataStore
+from models.models import (
+    DocumentChunk,
+    DocumentChunkMetadata,
+    QueryResult,
+    QueryWithEmbedding,
+)
+from services.metrics import (
+    DATASTORE_BATCH_SIZE,
+    DATASTORE_ERRORS,
+    DATASTORE_SECONDS,
+    Counter,
+    Gauge,
+    Histogram,
+)
+
+
+def test_counter_renders_labels():
+    counter = Counter("test_counter_total", "A test counter.", ["path"])
+    counter.inc(path="/query")
+    counter.inc(2, path='/a"b')
+
+    assert counter.render().splitlines() == [
+        "# HELP test_counter_total A test counter.",
+        "# TYPE test_counter_total counter",
+        'test_counter_total{path="/query"} 1',
+        'test_counter_total{path="/a\\"b"} 2',
+    ]
+
+
+def test_metrics_without_labels_start_at_zero():
+    counter = Counter("test_unlabeled_total", "A test counter.")
+
+    assert counter.render().splitlines()[-1] == "test_unlabeled_total 0"
+
+
+def test_wrong_labels_are_rejected():
+    counter = Counter("test_labels_total", "A test counter.", ["path"])
+
+    with pytest.raises(ValueError):
+        counter.inc(method="GET")
+
+
+def test_gauge_tracks_in_progress():
+    gauge = Gauge("test_in_flight", "A test gauge.", ["path"])
+
+    with gauge.track_in_progress(path="/query"):
+        assert gauge.get(path="/query") == 1
+    assert gauge.get(path="/query") == 0
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_seconds", "A test histogram.", buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert histogram.render().splitlines()[2:] == [
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        "test_seconds_sum 5.55",
+        "test_seconds_count 3",
+    ]
+
+
+def test_histogram_time_counts_errors():
+    histogram = Histogram("test_stage_seconds", "A test histogram.", ["stage"])
+    errors = Counter("test_stage_errors_total", "A test counter.", ["stage"])
+
+    with pytest.raises(RuntimeError):
+        with histogram.time(errors, stage="embed"):
+            raise RuntimeError("embedding failed")
+
+    assert histogram.get_count(stage="embed") == 1
+    assert errors.get(stage="embed") == 1
+
+
+async def test_histogram_time_ignores_cancellation():
+    histogram = Histogram("test_hedged_seconds", "A test histogram.", ["stage"])
+    errors = Counter("test_hedged_errors_total", "A test counter.", ["stage"])
+
+    async def hedged_loser():
+        with histogram.time(errors, stage="query"):
+            await asyncio.sleep(10)
+
+    task = asyncio.create_task(hedged_loser())
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert histogram.get_count(stage="query") == 0
+    assert errors.get(stage="query") == 0
+
+
+class MetricsTestDataStore(DataStore):
+    async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
+        return list(chunks.keys())
+
+    async def _query(self, queries: List[QueryWithEmbedding]) -> List[QueryResult]:
+        raise RuntimeError("search failed")
+
+    async def delete(self, ids=None, filter=None, delete_all=None) -> bool:
+        return True
+
+
+async def test_datastore_operations_are_instrumented():
+    datastore = MetricsTestDataStore()
+    labels = {"datastore": "MetricsTestDataStore"}
+    chunks = {
+        "doc": [
+            DocumentChunk(id=f"doc_{i}", text=text, metadata=DocumentChunkMetadata())
+            for i, text in enumerate(["a", "b"])
+        ]
+    }
+
+    await datastore._upsert(chunks)
+    await datastore.delete(ids=["doc"])
+    with pytest.raises(RuntimeError):
+        await datastore._query([QueryWithEmbedding(query="a", embedding=[1.0])])
+
+    assert DATASTORE_SECONDS.get_count(operation="_upsert", **labels) == 1
+    assert DATASTORE_SECONDS.get_count(operation="delete", **labels) == 1
+    assert DATASTORE_BATCH_SIZE.get_count(operation="_upsert", **labels) == 1
+    assert DATASTORE_BATCH_SIZE.get_count(operation="_query", **labels) == 1
+    assert DATASTORE_ERRORS.get(operation="_query", **labels) == 1
@@ -0,0 +1,181 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from models.models import DocumentMetadataFilter, Query, QueryResult, QueryWithEmbedding
+from services import query_cache
+from services.metrics import QUERY_CACHE_LOOKUPS, render_metrics
+from services.query_cache import QueryCache, SemanticCache, set_query_cache_endpoint
+
+
+class FakeQueries:
+    def __init__(self):
+        self.calls: List[List[str]] = []
+
+    async def __call__(self, queries: List[Query]) -> List[QueryResult]:
+        self.calls.append([query.query for query in queries])
+        return [QueryResult(query=query.query, results=[]) for query in queries]
+
+
+@pytest.mark.asyncio
+async def test_only_runs_missing_queries():
+    cache, run = QueryCache(max_entries=10), FakeQueries()
+
+    await cache.get_or_query([Query(query="a"), Query(query="b")], run)
+    results = await cache.get_or_query([Query(query="b"), Query(query="c")], run)
+
+    assert [result.query for result in results] == ["b", "c"]
+    assert run.calls == [["a", "b"], ["c"]]
+
+
+@pytest.mark.asyncio
+async def test_keys_include_filter_and_top_k():
+    cache, run = QueryCache(max_entries=10), FakeQueries()
+
+    await cache.get_or_query([Query(query="a")], run)
+    await cache.get_or_query([Query(query="a", top_k=5)], run)
+    await cache.get_or_query(
+        [Query(query="a", filter=DocumentMetadataFilter(author="x"))], run
+    )
+    await cache.get_or_query([Query(query="a")], run)
+
+    assert run.calls == [["a"], ["a"], ["a"]]
+
+
+@pytest.mark.asyncio
+async def test_invalidate_starts_a_new_generation():
+    cache, run = QueryCache(max_entries=10), FakeQueries()
+
+    await cache.get_or_query([Query(query="a")], run)
+    await cache.invalidate()
+    await cache.get_or_query([Query(query="a")], run)
+
+    assert run.calls == [["a"], ["a"]]
+
+
+@pytest.mark.asyncio
+async def test_results_computed_during_a_write_are_not_cached():
+    cache = QueryCache(max_entries=10)
+    run = FakeQueries()
+
+    async def run_during_write(queries):
+        await cache.invalidate()
+        return await run(queries)
+
+    await cache.get_or_query([Query(query="a")], run_during_write)
+    await cache.get_or_query([Query(query="a")], run)
+
+    assert run.calls == [["a"], ["a"]]
+
+
+@pytest.mark.asyncio
+async def test_expires_and_evicts_least_recently_used(monkeypatch):
+    cache, run = QueryCache(max_entries=2, ttl_seconds=60), FakeQueries()
+    now = [1000.0]
+    monkeypatch.setattr(query_cache.time, "monotonic", lambda: now[0])
+
+    await cache.get_or_query([Query(query="a"), Query(query="b")], run)
+    # Touch "a" so that "b" becomes the least recently used entry
+    await cache.get_or_query([Query(query="a")], run)
+    await cache.get_or_query([Query(query="c")], run)
+    await cache.get_or_query([Query(query="a"), Query(query="b")], run)
+    assert run.calls == [["a", "b"], ["c"], ["b"]]
+
+    now[0] += 61
+    await cache.get_or_query([Query(query="a")], run)
+    assert run.calls[-1] == ["a"]
+
+
+@pytest.mark.asyncio
+async def test_stats_per_endpoint():
+    cache, run = QueryCache(max_entries=10), FakeQueries()
+
+    async def request(endpoint: str, texts: List[str]):
+        set_query_cache_endpoint(endpoint)
+        await cache.get_or_query([Query(query=text) for text in texts], run)
+
+    await asyncio.create_task(request("/query", ["a", "b"]))
+    await asyncio.create_task(request("/query", ["a"]))
+    await asyncio.create_task(request("/sub/query", ["a", "c"]))
+
+    assert cache.stats() == {
+        "/query": {"hits": 1, "misses": 2, "hit_rate": 1 / 3},
+        "/sub/query": {"hits": 1, "misses": 1, "hit_rate": 0.5},
+    }
+
+
+@pytest.mark.asyncio
+async def test_lookups_are_exported_as_metrics():
+    cache, run = QueryCache(max_entries=10), FakeQueries()
+    set_query_cache_endpoint("/metrics-test/query")
+
+    await cache.get_or_query([Query(query="a"), Query(query="b")], run)
+    await cache.get_or_query([Query(query="a")], run)
+
+    labels = {"cache": "exact", "endpoint": "/metrics-test/query"}
+    assert QUERY_CACHE_LOOKUPS.get(result="hit", **labels) == 1
+    assert QUERY_CACHE_LOOKUPS.get(result="miss", **labels) == 2
+    assert (
+        'retrieval_query_cache_lookups_total{cache="exact",endpoint="/metrics-test/query",result="hit"} 1'
+        in render_metrics()
+    )
+
+
+def query_with_embedding(text: str, embedding: List[float], **kwargs) -> QueryWithEmbedding:
+    return QueryWithEmbedding(query=text, embedding=embedding, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_semantic_cache_answers_similar_queries():
+    cache, run = SemanticCache(dimension=3, max_entries=4, threshold=0.95), FakeQueries()
+
+    await cache.get_or_query([query_with_embedding("Q3 revenue", [1.0, 0.1, 0.0])], run)
+    results = await cache.get_or_query(
+        [
+            query_with_embedding("revenue in Q3", [2.0, 0.25, 0.0]),
+            query_with_embedding("headcount", [0.0, 1.0, 0.0]),
+        ],
+        run,
+    )
+
+    # The cached results are reported under the text of the new query
+    assert [result.query for result in results] == ["revenue in Q3", "headcount"]
+    assert run.calls == [["Q3 revenue"], ["headcount"]]
+    assert cache.stats()["datastore"] == {"hits": 1, "misses": 2, "hit_rate": 1 / 3}
+
+
+@pytest.mark.asyncio
+async def test_semantic_cache_requires_same_filter_and_top_k():
+    cache, run = SemanticCache(dimension=2, max_entries=4), FakeQueries()
+
+    await cache.get_or_query([query_with_embedding("a", [1.0, 0.0])], run)
+    await cache.get_or_query([query_with_embedding("b", [1.0, 0.0], top_k=1)], run)
+    await cache.get_or_query(
+        [query_with_embedding("c", [1.0, 0.0], filter=DocumentMetadataFilter(source_id="x"))],
+        run,
+    )
+
+    assert run.calls == [["a"], ["b"], ["c"]]
+
+
+@pytest.mark.asyncio
+async def test_semantic_cache_reuses_oldest_rows_and_invalidates():
+    cache, run = SemanticCache(dimension=2, max_entries=2), FakeQueries()
+
+    await cache.get_or_query(
+        [
+            query_with_embedding("a", [1.0, 0.0]),
+            query_with_embedding("b", [0.0, 1.0]),
+            query_with_embedding("c", [-1.0, 0.0]),
+        ],
+        run,
+    )
+    await cache.get_or_query(
+        [query_with_embedding("a", [1.0, 0.0]), query_with_embedding("c", [-1.0, 0.0])], run
+    )
+    assert run.calls == [["a", "b", "c"], ["a"]]
+
+    cache.invalidate()
+    await cache.get_or_query([query_with_embedding("a", [1.0, 0.0])], run)
+    assert run.calls[-1] == ["a"]
@@ -0,0 +1,41 @@
+import time
+
+import pytest
+
+from services.rate_limiter import RateLimiter
+
+
+@pytest.mark.asyncio
+async def test_acquire_within_limits_does_not_wait():
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=6000)
+
+    start = time.monotonic()
+    for _ in range(10):
+        await limiter.acquire(100)
+
+    assert time.monotonic() - start < 0.1
+
+
+@pytest.mark.asyncio
+async def test_acquire_waits_for_requests():
+    # Ten requests per second, with a single request left in the bucket
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=10**9)
+    limiter._available_requests = 1
+
+    start = time.monotonic()
+    await limiter.acquire()
+    await limiter.acquire()
+
+    assert time.monotonic() - start >= 0.09
+
+
+@pytest.mark.asyncio
+async def test_acquire_waits_for_tokens():
+    # 100 tokens per second, with an empty bucket
+    limiter = RateLimiter(requests_per_minute=10**6, tokens_per_minute=6000)
+    limiter._available_tokens = 0
+
+    start = time.monotonic()
+    await limiter.acquire(10)
+
+    assert time.monotonic() - start >= 0.09